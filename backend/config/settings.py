@@ -3,17 +3,92 @@ from pathlib import Path
 
 # Directories
 BASE_DIR = Path(__file__).resolve().parent.parent
-CONFIG_DIR = Path("/app/config")
+CONFIG_DIR = Path(os.getenv("CONFIG_DIR", "/app/config"))
 STATIC_DIR = Path("/app/frontend/build/static")
 ASSETS_DIR = Path("/app/frontend/build/assets")
-FRONTEND_BUILD_DIR = Path("/app/frontend/build")
+FRONTEND_BUILD_DIR = Path(os.getenv("FRONTEND_BUILD_DIR", "/app/frontend/build"))
 
 # Config file
 CONFIG_FILE = CONFIG_DIR / "proxies.json"
 
+# Proxy configuration store: "sqlite" (imports CONFIG_FILE when present) or "json" (CONFIG_FILE only)
+PROXY_STORE = os.getenv("PROXY_STORE", "sqlite")
+PROXY_DATABASE_FILE = Path(os.getenv("PROXY_DATABASE_FILE", str(CONFIG_DIR / "proxies.db")))
+
+# Largest page size of the proxy listing
+PROXY_LIST_MAX_LIMIT = int(os.getenv("PROXY_LIST_MAX_LIMIT", "1000"))
+
+# Seconds between background checks of the proxy store for external edits
+CONFIG_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", "1.0"))
+
+# Number of server processes; uvicorn reads the same variable as its --workers default.
+# Workers share the proxy store and the response cache's disk tier.
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
 # Ensure config directory exists
 CONFIG_DIR.mkdir(exist_ok=True)
 
+# Rewrite output cache
+REWRITE_CACHE_MAX_BYTES = int(os.getenv("REWRITE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+REWRITE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("REWRITE_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024)))
+
+# Upstream response cache (enabled per proxy with cache_enabled)
+RESPONSE_CACHE_DIR = CONFIG_DIR / "cache"
+RESPONSE_CACHE_MEMORY_BYTES = int(os.getenv("RESPONSE_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_DISK_BYTES = int(os.getenv("RESPONSE_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_OBJECT_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_OBJECT_BYTES", str(16 * 1024 * 1024)))
+
+# Compression of rewritten responses
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+
+# Worker pool for large rewrites ("thread" or "process")
+REWRITE_POOL_MODE = os.getenv("REWRITE_POOL_MODE", "thread")
+REWRITE_POOL_WORKERS = int(os.getenv("REWRITE_POOL_WORKERS", "0"))
+REWRITE_POOL_MAX_QUEUE = int(os.getenv("REWRITE_POOL_MAX_QUEUE", "32"))
+REWRITE_OFFLOAD_THRESHOLD = int(os.getenv("REWRITE_OFFLOAD_THRESHOLD", str(256 * 1024)))
+
+# Interval in seconds between event loop lag samples
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+# WebSocket proxying
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_MAX_MESSAGE_SIZE = int(os.getenv("WS_MAX_MESSAGE_SIZE", str(16 * 1024 * 1024)))
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", "16"))
+
+# Metrics settings
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Upstream target health: consecutive failures that open a target's circuit,
+# how long it stays open, and active health probe behaviour
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "5"))
+HEALTH_CHECK_UNHEALTHY_THRESHOLD = int(os.getenv("HEALTH_CHECK_UNHEALTHY_THRESHOLD", "2"))
+
+# Request coalescing: how long a request waits for an identical in-flight one,
+# and the largest response that is shared between them
+COALESCE_MAX_WAIT = float(os.getenv("COALESCE_MAX_WAIT", "10"))
+COALESCE_MAX_BODY_BYTES = int(os.getenv("COALESCE_MAX_BODY_BYTES", str(8 * 1024 * 1024)))
+
+# Frontend build assets held in memory (bytes, including compressed variants)
+FRONTEND_ASSET_CACHE_BYTES = int(os.getenv("FRONTEND_ASSET_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Admission control: concurrent proxied requests per worker and per proxy (0 = unlimited),
+# requests a proxy may queue beyond its limit, and how long they may wait for a slot
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "1024"))
+ADMISSION_PROXY_MAX_CONCURRENT = int(os.getenv("ADMISSION_PROXY_MAX_CONCURRENT", "256"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "256"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+# Subresource preloading: subresources announced per page, concurrent prefetches
+# per worker, and pages whose subresources are remembered
+PRELOAD_MAX_SUBRESOURCES = int(os.getenv("PRELOAD_MAX_SUBRESOURCES", "16"))
+PRELOAD_CONCURRENCY = int(os.getenv("PRELOAD_CONCURRENCY", "4"))
+PRELOAD_MAX_PAGES = int(os.getenv("PRELOAD_MAX_PAGES", "1024"))
+
 # CORS settings
 CORS_ORIGINS = ["*"]
 CORS_ALLOW_CREDENTIALS = True
@@ -2,20 +2,43 @@
 Nebula Proxy Web Application
 Main application entry point with clean, modular architecture
 """
-from pathlib import Path
+import asyncio
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
 from backend.config.settings import CORS_ALLOW_CREDENTIALS, CORS_ALLOW_HEADERS, CORS_ALLOW_METHODS, CORS_ORIGINS
-from backend.routes import proxy_handler_router, proxy_routes_router, static_routes_router
+from backend.routes import ProxyDispatcher, proxy_handler_router, proxy_routes_router, static_routes_router
+from backend.services import AssetIndex, ClientPool, LoadBalancer, LoopMonitor, ProxyService, ResponseCache, RewritePool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Manage resources that live for the whole application lifetime"""
+    # Index (and precompress) the frontend build off the event loop
+    await asyncio.to_thread(AssetIndex.load)
+    # Open the proxy store, importing proxies.json on first run
+    await asyncio.to_thread(ProxyService.load)
+    ProxyService.start()
+    await ResponseCache.load_disk_index()
+    RewritePool.start()
+    LoopMonitor.start()
+    LoadBalancer.start()
+    yield
+    await LoadBalancer.stop()
+    await ProxyService.stop()
+    await LoopMonitor.stop()
+    RewritePool.shutdown()
+    # Close pooled upstream connections on shutdown
+    await ClientPool.close_all()
 
 # Initialize FastAPI application
 app = FastAPI(
     title="Nebula Proxy",
     description="Reverse proxy with iframe support for local network applications",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Configure CORS middleware
@@ -27,21 +50,19 @@ app.add_middleware(
     allow_headers=CORS_ALLOW_HEADERS,
 )
 
-# Mount static files for React app (must be before catch-all routes)
-static_dir = Path("/app/frontend/build/static")
-assets_dir = Path("/app/frontend/build/assets")
-
-if static_dir.exists():
-    app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
-if assets_dir.exists():
-    app.mount("/assets", StaticFiles(directory=str(assets_dir)), name="assets")
+# Hand proxied requests to the proxy handler before FastAPI routing (added last, so it runs first)
+app.add_middleware(ProxyDispatcher)
 
 # Register route modules
 app.include_router(proxy_routes_router)  # Proxy management API routes
 app.include_router(proxy_handler_router)  # Proxy request handler
-app.include_router(static_routes_router)  # Frontend static file serving
+app.include_router(static_routes_router)  # Frontend files, served from the in-memory asset index
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    from backend.config.settings import WORKERS
+
+    # Several workers need the import string so each process can load the app
+    uvicorn.run("backend.main:app" if WORKERS > 1 else app, host="0.0.0.0", port=8000, workers=WORKERS)
@@ -1,4 +1,4 @@
 """Models module initialization"""
-from .proxy import ProxyConfig, ProxyCreate, ProxyUpdate
+from .proxy import ProxyBatch, ProxyConfig, ProxyCreate, ProxyUpdate
 
-__all__ = ['ProxyConfig', 'ProxyCreate', 'ProxyUpdate']
+__all__ = ['ProxyBatch', 'ProxyConfig', 'ProxyCreate', 'ProxyUpdate']
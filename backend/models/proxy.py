@@ -1,7 +1,11 @@
-from typing import Optional
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel
 
+LoadBalancing = Literal["least_outstanding", "ewma"]
+RewriteMode = Literal["server", "service_worker"]
+BatchMode = Literal["merge", "replace"]
+
 
 class ProxyConfig(BaseModel):
     """Proxy configuration model"""
@@ -11,6 +15,50 @@ class ProxyConfig(BaseModel):
     description: Optional[str] = ""
     enabled: bool = True
 
+    # Upstream connection pool settings
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    timeout: float = 30.0
+    connect_timeout: Optional[float] = None
+    # Longest wait for each chunk of the response (default: timeout), and
+    # for the response to start, including failover (default: unbounded)
+    read_timeout: Optional[float] = None
+    total_timeout: Optional[float] = None
+
+    # Admission control; unset values use the ADMISSION_* defaults. A
+    # max_concurrent_requests of 0 is unlimited, while a max_queued_requests
+    # or queue_timeout of 0 rejects requests that can't run straight away
+    max_concurrent_requests: Optional[int] = None
+    max_queued_requests: Optional[int] = None
+    queue_timeout: Optional[float] = None
+
+    # Shared cache for upstream responses
+    cache_enabled: bool = False
+
+    # Share one upstream fetch between identical concurrent GET requests
+    coalesce_requests: bool = False
+
+    # Announce the stylesheets, scripts and images of rewritten pages with
+    # Link preload headers (and 103 Early Hints), and prefetch them into the
+    # response cache when it is enabled
+    preload_subresources: bool = False
+
+    # Where URLs are routed through the proxy: "server" rewrites HTML and
+    # CSS, "service_worker" leaves them as they are and rewrites requests
+    # in the browser with a service worker scoped to the proxy
+    rewrite_mode: RewriteMode = "server"
+
+    # Additional targets balanced with target_url, and how requests are spread
+    # across them: "least_outstanding" or "ewma" (latency-weighted)
+    targets: List[str] = []
+    load_balancing: LoadBalancing = "least_outstanding"
+
+    # Active health probes (disabled when no path is set)
+    health_check_path: Optional[str] = None
+    health_check_interval: float = 10.0
+
 
 class ProxyCreate(BaseModel):
     """Model for creating a new proxy"""
@@ -20,6 +68,29 @@ class ProxyCreate(BaseModel):
     enabled: bool = True
     id: Optional[str] = None
 
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    timeout: float = 30.0
+    connect_timeout: Optional[float] = None
+    read_timeout: Optional[float] = None
+    total_timeout: Optional[float] = None
+
+    max_concurrent_requests: Optional[int] = None
+    max_queued_requests: Optional[int] = None
+    queue_timeout: Optional[float] = None
+
+    cache_enabled: bool = False
+    coalesce_requests: bool = False
+    preload_subresources: bool = False
+    rewrite_mode: RewriteMode = "server"
+
+    targets: List[str] = []
+    load_balancing: LoadBalancing = "least_outstanding"
+    health_check_path: Optional[str] = None
+    health_check_interval: float = 10.0
+
 
 class ProxyUpdate(BaseModel):
     """Model for updating an existing proxy"""
@@ -27,3 +98,36 @@ class ProxyUpdate(BaseModel):
     target_url: Optional[str] = None
     description: Optional[str] = None
     enabled: Optional[bool] = None
+
+    max_connections: Optional[int] = None
+    max_keepalive_connections: Optional[int] = None
+    keepalive_expiry: Optional[float] = None
+    http2: Optional[bool] = None
+    timeout: Optional[float] = None
+    connect_timeout: Optional[float] = None
+    read_timeout: Optional[float] = None
+    total_timeout: Optional[float] = None
+
+    max_concurrent_requests: Optional[int] = None
+    max_queued_requests: Optional[int] = None
+    queue_timeout: Optional[float] = None
+
+    cache_enabled: Optional[bool] = None
+    coalesce_requests: Optional[bool] = None
+    preload_subresources: Optional[bool] = None
+    rewrite_mode: Optional[RewriteMode] = None
+
+    targets: Optional[List[str]] = None
+    load_balancing: Optional[LoadBalancing] = None
+    health_check_path: Optional[str] = None
+    health_check_interval: Optional[float] = None
+
+
+class ProxyBatch(BaseModel):
+    """Model for importing many proxies at once
+
+    "merge" creates or overwrites the given proxies; "replace" also deletes
+    every proxy that is not in the batch.
+    """
+    proxies: List[ProxyCreate]
+    mode: BatchMode = "merge"
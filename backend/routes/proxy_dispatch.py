@@ -0,0 +1,52 @@
+"""Raw ASGI dispatch of proxied requests, ahead of FastAPI routing"""
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from starlette.middleware.cors import CORSMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..config.settings import CORS_ALLOW_CREDENTIALS, CORS_ALLOW_HEADERS, CORS_ALLOW_METHODS, CORS_ORIGINS
+from .proxy_handler import PROXY_METHODS, handle_proxy_request
+
+PROXY_PREFIX = '/proxy/'
+
+
+class ProxyDispatcher:
+    """ASGI middleware that hands /proxy/{proxy_id}/{path} requests straight to the proxy handler
+
+    Proxied requests skip FastAPI's route matching, dependency resolution
+    and exception middleware. They still pass through a CORSMiddleware with
+    the application's settings, so preflights and credentialed requests are
+    answered as before. WebSockets, other methods and every other path fall
+    through to the application.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.proxy = CORSMiddleware(
+            self.handle,
+            allow_origins=CORS_ORIGINS,
+            allow_credentials=CORS_ALLOW_CREDENTIALS,
+            allow_methods=CORS_ALLOW_METHODS,
+            allow_headers=CORS_ALLOW_HEADERS,
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope['type'] == 'http'
+            and scope['path'].startswith(PROXY_PREFIX)
+            and scope['method'] in PROXY_METHODS
+            and scope['path'].find('/', len(PROXY_PREFIX)) > len(PROXY_PREFIX)
+        ):
+            await self.proxy(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def handle(self, scope: Scope, receive: Receive, send: Send) -> None:
+        proxy_id, _, path = scope['path'][len(PROXY_PREFIX):].partition('/')
+        request = Request(scope, receive)
+        try:
+            response = await handle_proxy_request(proxy_id, path, request, send)
+        except HTTPException as e:
+            # Same body as FastAPI's own HTTPException handler
+            response = JSONResponse({'detail': e.detail}, status_code=e.status_code, headers=e.headers)
+        await response(scope, receive, send)
@@ -1,17 +1,450 @@
 """Routes for proxying requests to target applications"""
+import asyncio
+import math
+import time
+from functools import partial
+from typing import Optional
+
 import httpx
-from fastapi import APIRouter, HTTPException, Request, Response
+import websockets
+from fastapi import APIRouter, HTTPException, Request, Response, WebSocket
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import MutableHeaders
+from starlette.types import Send
 
+from ..config.settings import (
+    COMPRESSION_ENABLED,
+    COMPRESSION_LEVEL,
+    COMPRESSION_MIN_SIZE,
+    WS_MAX_MESSAGE_SIZE,
+    WS_MAX_QUEUE,
+    WS_PING_INTERVAL,
+)
+from ..services.admission import AdmissionControl, AdmissionRejected, AdmittedResponse
+from ..services.client_pool import ClientPool
+from ..services.load_balancer import LoadBalancer, NoHealthyTarget
+from ..services.metrics import NULL_TIMER, Metrics
+from ..services.preloader import PagePreload, Preloader
 from ..services.proxy_service import ProxyService
-from ..utils.headers import modify_headers_for_proxy, modify_response_headers
-from ..utils.rewrite import rewrite_css_content, rewrite_html_content
+from ..services.response_cache import ResponseCache
+from ..services.rewrite_cache import CacheKey, RewriteCache, RewriteCacheEntry
+from ..services.rewrite_pool import RewritePool, RewritePoolSaturated
+from ..services.single_flight import COALESCED_METHODS, SharedError, SingleFlight
+from ..utils.compression import StreamCompressor, compress, is_compressible, negotiate_encoding
+from ..utils.headers import append_vary, modify_headers_for_proxy, proxy_request_headers, proxy_response_headers
+from ..utils.rewrite import (
+    CLIENT_SCRIPT_PATH,
+    SERVICE_WORKER_PATH,
+    HTMLRewriter,
+    RewritePlan,
+    SnippetInserter,
+    css_bytes_rewritable,
+    rewrite_css_bytes,
+    rewrite_css_content,
+    rewrite_html_content,
+    rewrite_html_with_subresources,
+    rewrite_plan,
+)
 
 router = APIRouter(prefix="/proxy", tags=["proxy"])
 
 
-@router.api_route("/{proxy_id}/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
+async def relay_body(response: httpx.Response, timer=NULL_TIMER):
+    """Yield raw upstream body chunks, releasing the connection when done"""
+    try:
+        async for chunk in response.aiter_raw():
+            timer.mark('body')
+            yield chunk
+            timer.mark('send')
+    finally:
+        await response.aclose()
+
+
+async def count_received(chunks, timer):
+    """Count request body bytes as they are streamed upstream"""
+    async for chunk in chunks:
+        timer.bytes_in += len(chunk)
+        yield chunk
+
+
+async def count_sent(chunks, timer):
+    """Count response body bytes as they are streamed to the client"""
+    async for chunk in chunks:
+        timer.bytes_out += len(chunk)
+        yield chunk
+
+
+async def finish_request(background: Optional[BackgroundTask], timer, status_code: int) -> None:
+    """Run the response's own background task, then record the request"""
+    try:
+        if background is not None:
+            await background()
+    finally:
+        timer.mark('send')
+        Metrics.finish(timer, status_code)
+
+
+def with_headers(response: Response, headers: MutableHeaders) -> Response:
+    """Give a response already-encoded headers, keeping the framing headers it computed itself
+
+    Avoids re-encoding every header through a mapping and keeps repeated
+    headers such as Set-Cookie.
+    """
+    raw = headers.raw
+    present = {name for name, _ in raw}
+    raw.extend(item for item in response.raw_headers if item[0] not in present)
+    response.raw_headers = raw
+    return response
+
+
+def instrument(result: Response, timer) -> Response:
+    """Attach Server-Timing and arrange for the request to be recorded once sent"""
+    if timer is NULL_TIMER:
+        return result
+    if Metrics.server_timing:
+        result.headers['server-timing'] = timer.server_timing()
+    if isinstance(result, StreamingResponse):
+        result.body_iterator = count_sent(result.body_iterator, timer)
+    else:
+        timer.bytes_out = len(result.body)
+    result.background = BackgroundTask(finish_request, result.background, timer, result.status_code)
+    return result
+
+
+async def rewrite_html_stream(response: httpx.Response, rewriter: HTMLRewriter,
+                              cache_key: Optional[CacheKey] = None, timer=NULL_TIMER,
+                              preload: Optional[PagePreload] = None):
+    """Rewrite decoded HTML chunks as they arrive from upstream
+
+    When a cache key is given, the output is collected (up to the cache's
+    entry size limit) and stored once the page has been fully rewritten.
+    The subresources collected by a preload are remembered at the end.
+    """
+    captured = [] if cache_key is not None else None
+    captured_size = 0
+    try:
+        async for text in response.aiter_text():
+            timer.mark('body')
+            if rewriter is not None:
+                try:
+                    text = rewriter.rewrite_chunk(text)
+                except Exception:
+                    # Stop rewriting but keep relaying the rest of the page,
+                    # starting with what the rewriter was holding back
+                    text = rewriter.abandon(text)
+                    rewriter = None
+                    captured = None
+            if text:
+                chunk = text.encode('utf-8')
+                if captured is not None:
+                    captured_size += len(chunk)
+                    if captured_size > RewriteCache.max_entry_bytes:
+                        captured = None
+                    else:
+                        captured.append(chunk)
+                timer.mark('rewrite')
+                yield chunk
+                timer.mark('send')
+        if rewriter is not None:
+            try:
+                chunk = rewriter.finish().encode('utf-8')
+            except Exception:
+                yield rewriter.abandon().encode('utf-8')
+                return
+            if captured is not None:
+                captured.append(chunk)
+                RewriteCache.put(cache_key, b''.join(captured))
+            if preload is not None:
+                preload.finish()
+            yield chunk
+    finally:
+        await response.aclose()
+
+
+async def compress_stream(chunks, compressor: StreamCompressor, timer=NULL_TIMER):
+    """Compress a stream of body chunks as they are produced"""
+    try:
+        async for chunk in chunks:
+            data = compressor.compress(chunk)
+            timer.mark('rewrite')
+            if data:
+                yield data
+                timer.mark('send')
+        yield compressor.finish()
+    finally:
+        await chunks.aclose()
+
+
+def choose_encoding(accept_encoding: Optional[str], content_type: Optional[str],
+                    size: Optional[int] = None) -> Optional[str]:
+    """Pick the content-coding for a rewritten body, or None to send it as-is"""
+    if not COMPRESSION_ENABLED or (size is not None and size < COMPRESSION_MIN_SIZE):
+        return None
+    if not is_compressible(content_type):
+        return None
+    return negotiate_encoding(accept_encoding)
+
+
+async def rewritten_response(entry: RewriteCacheEntry, cache_key: Optional[CacheKey], status_code: int,
+                             headers: MutableHeaders, accept_encoding: Optional[str], media_type: Optional[str] = None,
+                             timer=NULL_TIMER):
+    """Build the response for a rewritten body, compressing it for the client
+
+    Compressed variants are kept on the cache entry so each one is only
+    produced once per cached body.
+    """
+    body = entry.body
+    append_vary(headers, 'Accept-Encoding')
+    encoding = choose_encoding(accept_encoding, headers.get('content-type', media_type), len(body))
+    if encoding is not None:
+        data = entry.variants.get(encoding)
+        if data is None:
+            try:
+                data = await RewritePool.run(compress, body, encoding, COMPRESSION_LEVEL, size=len(body))
+            except RewritePoolSaturated:
+                data = None
+            if data is not None and cache_key is not None:
+                RewriteCache.add_variant(cache_key, entry, encoding, data)
+        if data is not None:
+            body = data
+            headers['content-encoding'] = encoding
+        timer.mark('rewrite')
+    return with_headers(Response(content=body, status_code=status_code, media_type=media_type), headers)
+
+
+def add_preload_links(headers: MutableHeaders, subresources) -> None:
+    """Announce subresources of a page with a Link preload header"""
+    if subresources:
+        headers.append('link', Preloader.link_header(subresources))
+
+
+def has_body(method: str, status_code: int) -> bool:
+    """Whether a response to the request may carry a body (RFC 9110 section 6.4.1)"""
+    return method != 'HEAD' and status_code >= 200 and status_code not in (204, 304)
+
+
+def declared_length(response: httpx.Response) -> Optional[int]:
+    """Return the upstream content-length if it is present and valid"""
+    try:
+        return int(response.headers['content-length'])
+    except (KeyError, ValueError):
+        return None
+
+
+async def respond_html(response: httpx.Response, proxy_id: str, target_url: str, full_url: str,
+                       accept_encoding: Optional[str], timer=NULL_TIMER, preload: Optional[PagePreload] = None):
+    """Return rewritten HTML, from the rewrite cache when possible
+
+    With a preload, the page's subresources are collected (and prefetched)
+    while it is rewritten and announced in a Link header when known.
+    """
+    # Decoded content is re-encoded as UTF-8, so drop encoding headers
+    response_headers = MutableHeaders(raw=proxy_response_headers(response.headers.raw, remove_encoding=True))
+    response_headers['content-type'] = 'text/html; charset=utf-8'
+
+    cache_key = None
+    if response.status_code == 200 and RewriteCache.cacheable(response.request.headers, response.headers):
+        cache_key = RewriteCache.validator_key(proxy_id, full_url, response.request.headers, response.headers)
+        if cache_key is None:
+            # Without validators, small pages are keyed by a hash of their body
+            length = declared_length(response)
+            if length is not None and length <= RewriteCache.max_entry_bytes:
+                await response.aread()
+                await response.aclose()
+                timer.mark('body')
+                cache_key = RewriteCache.content_key(proxy_id, full_url, response.content)
+
+        cached = RewriteCache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            await response.aclose()
+            if preload is not None:
+                add_preload_links(response_headers, preload.known)
+            return await rewritten_response(cached, cache_key, response.status_code, response_headers,
+                                            accept_encoding, timer=timer)
+
+    if response.is_closed:
+        # Body was already read to compute its hash
+        text = response.text
+        try:
+            if preload is None:
+                content = await RewritePool.run(rewrite_html_content, text, proxy_id, target_url, size=len(text))
+            else:
+                content, subresources = await RewritePool.run(rewrite_html_with_subresources, text, proxy_id,
+                                                              target_url, size=len(text))
+                for subresource in subresources:
+                    preload.add(*subresource)
+                preload.finish()
+                add_preload_links(response_headers, preload.subresources)
+        except RewritePoolSaturated:
+            # Too many rewrites queued: pass the page through rather than wait
+            return await rewritten_response(RewriteCacheEntry(text.encode('utf-8')), None,
+                                            response.status_code, response_headers, accept_encoding, timer=timer)
+        timer.mark('rewrite')
+        entry = RewriteCache.put(cache_key, content.encode('utf-8'))
+        return await rewritten_response(entry, cache_key, response.status_code, response_headers,
+                                        accept_encoding, timer=timer)
+
+    if preload is None:
+        rewriter = HTMLRewriter(proxy_id, target_url)
+    else:
+        # Only subresources seen on earlier requests can be announced before the body
+        rewriter = HTMLRewriter(proxy_id, target_url, on_subresource=preload.add)
+        add_preload_links(response_headers, preload.known)
+    body = rewrite_html_stream(response, rewriter, cache_key, timer, preload)
+    append_vary(response_headers, 'Accept-Encoding')
+    encoding = choose_encoding(accept_encoding, response_headers['content-type'])
+    if encoding is not None:
+        body = compress_stream(body, StreamCompressor(encoding, COMPRESSION_LEVEL), timer)
+        response_headers['content-encoding'] = encoding
+
+    return with_headers(StreamingResponse(
+        body,
+        status_code=response.status_code,
+        background=BackgroundTask(response.aclose),
+    ), response_headers)
+
+
+async def insert_snippet_stream(chunks, inserter: SnippetInserter, response: httpx.Response, timer=NULL_TIMER):
+    """Relay page chunks with the service worker snippet inserted after the opening tag"""
+    try:
+        async for chunk in chunks:
+            timer.mark('body')
+            data = inserter.feed(chunk)
+            if data:
+                yield data
+                timer.mark('send')
+        data = inserter.finish()
+        if data:
+            yield data
+    finally:
+        await response.aclose()
+
+
+def respond_html_passthrough(response: httpx.Response, plan: RewritePlan,
+                             accept_encoding: Optional[str], timer=NULL_TIMER) -> Response:
+    """Relay HTML unparsed, only inserting the snippet that registers the service worker
+
+    The page keeps its encoding and validators. A compressed page is
+    decoded to insert the snippet and compressed again for the client.
+    """
+    # The snippet changes the length and the byte offsets of the body
+    response_headers = MutableHeaders(raw=proxy_response_headers(response.headers.raw, remove_encoding=True))
+    inserter = SnippetInserter(plan.snippet)
+    if response.headers.get('content-encoding', 'identity').lower() == 'identity':
+        return with_headers(StreamingResponse(
+            insert_snippet_stream(response.aiter_raw(), inserter, response, timer),
+            status_code=response.status_code,
+            background=BackgroundTask(response.aclose),
+        ), response_headers)
+
+    body = insert_snippet_stream(response.aiter_bytes(), inserter, response, timer)
+    append_vary(response_headers, 'Accept-Encoding')
+    encoding = choose_encoding(accept_encoding, response_headers.get('content-type'))
+    if encoding is not None:
+        body = compress_stream(body, StreamCompressor(encoding, COMPRESSION_LEVEL), timer)
+        response_headers['content-encoding'] = encoding
+    return with_headers(StreamingResponse(
+        body,
+        status_code=response.status_code,
+        background=BackgroundTask(response.aclose),
+    ), response_headers)
+
+
+def service_worker_response(proxy_config: dict, path: str, request: Request) -> Response:
+    """Serve the service worker or the client script of a proxy in service worker mode"""
+    plan = rewrite_plan(proxy_config['id'], proxy_config['target_url'].rstrip('/'))
+    if path == SERVICE_WORKER_PATH:
+        return Response(plan.service_worker, media_type='application/javascript', headers={
+            # Browsers check for a new worker on navigations; it must not be cached
+            'cache-control': 'no-cache',
+            'service-worker-allowed': plan.proxy_prefix,
+        })
+    if request.query_params.get('v') == plan.client_version:
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'no-cache'
+    return Response(plan.client_script, media_type='application/javascript',
+                    headers={'cache-control': cache_control})
+
+
+async def respond_css(response: httpx.Response, proxy_id: str, full_url: str,
+                      accept_encoding: Optional[str], timer=NULL_TIMER):
+    """Return rewritten CSS, from the rewrite cache when possible"""
+    # Remove encoding headers since we decode the content
+    response_headers = MutableHeaders(raw=proxy_response_headers(response.headers.raw, remove_encoding=True))
+
+    cache_key = None
+    cacheable = response.status_code == 200 and RewriteCache.cacheable(response.request.headers, response.headers)
+    if cacheable:
+        cache_key = RewriteCache.validator_key(proxy_id, full_url, response.request.headers, response.headers)
+        cached = RewriteCache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            await response.aclose()
+            return await rewritten_response(cached, cache_key, response.status_code, response_headers,
+                                            accept_encoding, media_type="text/css", timer=timer)
+
+    await response.aread()
+    await response.aclose()
+    timer.mark('body')
+
+    if cacheable and cache_key is None:
+        cache_key = RewriteCache.content_key(proxy_id, full_url, response.content)
+        cached = RewriteCache.get(cache_key)
+        if cached is not None:
+            return await rewritten_response(cached, cache_key, response.status_code, response_headers,
+                                            accept_encoding, media_type="text/css", timer=timer)
+
+    if css_bytes_rewritable(response.content, response.charset_encoding):
+        # Rewritten in its own encoding, without decoding it
+        rewrite, source = rewrite_css_bytes, response.content
+    else:
+        rewrite, source = rewrite_css_content, response.text
+        response_headers['content-type'] = 'text/css; charset=utf-8'
+    try:
+        content = await RewritePool.run(rewrite, source, proxy_id, size=len(source))
+    except RewritePoolSaturated:
+        # Too many rewrites queued: pass the stylesheet through rather than wait
+        cache_key = None
+        content = source
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    timer.mark('rewrite')
+    entry = RewriteCache.put(cache_key, content) if cache_key is not None else RewriteCacheEntry(content)
+    return await rewritten_response(entry, cache_key, response.status_code, response_headers,
+                                    accept_encoding, media_type="text/css", timer=timer)
+
+
+# Methods proxied over HTTP
+PROXY_METHODS = ("GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS")
+
+
+@router.api_route("/{proxy_id}/{path:path}", methods=list(PROXY_METHODS))
 async def proxy_request(proxy_id: str, path: str, request: Request):
-    """Proxy requests to target URLs"""
+    """Proxy requests to target URLs
+
+    Requests normally reach handle_proxy_request through ProxyDispatcher
+    without FastAPI routing; this route serves apps that don't install it.
+    """
+    return await handle_proxy_request(proxy_id, path, request)
+
+
+def preloads(proxy_config: dict) -> bool:
+    """Whether subresources of the proxy's pages are announced and prefetched
+
+    Subresources are found while pages are rewritten, which service worker
+    mode doesn't do on the server.
+    """
+    return bool(proxy_config.get('preload_subresources')) and proxy_config.get('rewrite_mode') != 'service_worker'
+
+
+async def handle_proxy_request(proxy_id: str, path: str, request: Request, send: Optional[Send] = None) -> Response:
+    """Proxy a request to the proxy's target
+
+    send is the ASGI send callable of the connection, when the caller has
+    one; informational responses such as Early Hints go through it.
+    """
+    timer = Metrics.start(proxy_id)
     proxy_config = ProxyService.get_proxy_by_id(proxy_id)
 
     if not proxy_config:
@@ -20,6 +453,19 @@ async def proxy_request(proxy_id: str, path: str, request: Request):
     if not proxy_config.get('enabled', True):
         raise HTTPException(status_code=403, detail="Proxy is disabled")
 
+    timer.mark('config')
+    if proxy_config.get('rewrite_mode') == 'service_worker' and path in (SERVICE_WORKER_PATH, CLIENT_SCRIPT_PATH):
+        # Generated by the proxy itself, so they don't take an admission slot
+        return instrument(service_worker_response(proxy_config, path, request), timer)
+
+    try:
+        gate = await AdmissionControl.acquire(proxy_config)
+    except AdmissionRejected as e:
+        Metrics.finish(timer, 503)
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={'Retry-After': str(max(1, math.ceil(e.retry_after)))})
+    timer.mark('queue')
+
     target_url = proxy_config['target_url'].rstrip('/')
     full_url = f"{target_url}/{path}"
 
@@ -27,63 +473,246 @@ async def proxy_request(proxy_id: str, path: str, request: Request):
     if request.url.query:
         full_url = f"{full_url}?{request.url.query}"
 
+    try:
+        if preloads(proxy_config) and request.method == 'GET':
+            # Lets the browser fetch what the page needs while the upstream works on it
+            await Preloader.announce(request, proxy_config, full_url, send)
+
+        if proxy_config.get('coalesce_requests') and request.method in COALESCED_METHODS:
+            # Identical concurrent requests share one upstream fetch and rewrite
+            key = SingleFlight.key(proxy_id, request.method, full_url, request.headers)
+            try:
+                response, shared = await SingleFlight.run(
+                    key, request.headers, partial(forward_request, request, proxy_config, path, full_url, timer)
+                )
+            except SharedError as e:
+                # The first request recorded its own error
+                Metrics.finish(timer, e.status_code)
+                raise
+            if shared:
+                timer.mark('upstream')
+                response = instrument(response, timer)
+        else:
+            response = await forward_request(request, proxy_config, path, full_url, timer)
+    except BaseException:
+        AdmissionControl.release(gate)
+        raise
+    # The slot is held until the response body has been sent
+    return AdmittedResponse(response, gate)
+
+
+async def forward_request(request: Request, proxy_config: dict, path: str, full_url: str, timer=NULL_TIMER):
+    """Send a request upstream and build the response, rewriting HTML and CSS"""
+    proxy_id = proxy_config['id']
+    target_url = proxy_config['target_url'].rstrip('/')
+
     # Prepare headers
-    headers = modify_headers_for_proxy(dict(request.headers), target_url, proxy_id)
+    accept_encoding = request.headers.get('accept-encoding')
+    headers = proxy_request_headers(request.scope['headers'], target_url, proxy_id)
 
-    # Get request body if present
+    # Stream the request body upstream instead of buffering it
     body = None
     if request.method in ["POST", "PUT", "PATCH"]:
-        body = await request.body()
+        body = count_received(request.stream(), timer)
 
     try:
-        async with httpx.AsyncClient(follow_redirects=True, timeout=30.0) as client:
-            response = await client.request(
-                method=request.method,
-                url=full_url,
-                headers=headers,
-                content=body,
-            )
+        client = ClientPool.get_client(proxy_config)
+        upstream_request = client.build_request(
+            method=request.method,
+            url=full_url,
+            headers=headers,
+            content=body,
+        )
+    except (httpx.InvalidURL, TypeError, ValueError) as e:
+        # Settings that can't make a client or a request, e.g. from a hand-edited config
+        Metrics.finish(timer, 502)
+        raise HTTPException(status_code=502, detail=f"Invalid target configuration: {str(e)}")
 
-            # Check if content is HTML and rewrite it
-            content_type = response.headers.get('content-type', '')
-            if 'text/html' in content_type:
-                content = response.text
-                content = rewrite_html_content(content, proxy_id, target_url)
-                # Remove encoding headers since we decoded the content
-                response_headers = modify_response_headers(dict(response.headers), remove_encoding=True)
-                return Response(
-                    content=content,
-                    status_code=response.status_code,
-                    headers=response_headers,
-                    media_type="text/html"
-                )
+    # The request is built for the primary target (which also keys the
+    # caches) and sent to whichever target the load balancer picks
+    send = partial(LoadBalancer.send, client, proxy_config)
 
-            # Check if content is CSS and rewrite it
-            if 'text/css' in content_type or path.endswith('.css'):
-                content = response.text
-                content = rewrite_css_content(content, proxy_id)
-                # Remove encoding headers since we decoded the content
-                response_headers = modify_response_headers(dict(response.headers), remove_encoding=True)
-                return Response(
-                    content=content,
-                    status_code=response.status_code,
-                    headers=response_headers,
-                    media_type="text/css"
-                )
+    if proxy_config.get('cache_enabled'):
+        fetch = ResponseCache.fetch(send, upstream_request, proxy_id)
+    else:
+        fetch = send(upstream_request)
+    total_timeout = proxy_config.get('total_timeout')
 
-            # For other content types, pass through as-is with standard header modifications
-            # Always remove encoding headers because httpx automatically decodes the content
-            response_headers = modify_response_headers(dict(response.headers), remove_encoding=True)
+    response = None
+    try:
+        if total_timeout:
+            # Bounds the wait for the response to start, across failover attempts
+            response = await asyncio.wait_for(fetch, total_timeout)
+        else:
+            response = await fetch
+        timer.mark('upstream')
 
-            # For other content types, return as-is
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=response_headers,
-                media_type=content_type
+        if not has_body(request.method, response.status_code):
+            # Nothing to rewrite or compress: relay the upstream headers alone
+            await response.aclose()
+            response_headers = MutableHeaders(raw=proxy_response_headers(response.headers.raw))
+            return instrument(with_headers(Response(status_code=response.status_code), response_headers), timer)
+
+        # Check if content is HTML and rewrite it
+        content_type = response.headers.get('content-type', '')
+        # Part of a document can't be rewritten, so ranges are always relayed as-is
+        rewritable = response.status_code != 206
+        if rewritable and proxy_config.get('rewrite_mode') == 'service_worker':
+            # The service worker rewrites requests in the browser: pages only
+            # get the snippet registering it, everything else is relayed as-is
+            if 'text/html' in content_type:
+                plan = rewrite_plan(proxy_id, target_url)
+                return instrument(respond_html_passthrough(response, plan, accept_encoding, timer), timer)
+            rewritable = False
+
+        if rewritable and 'text/html' in content_type:
+            preload = None
+            if preloads(proxy_config) and request.method == 'GET':
+                preload = Preloader.page(proxy_config, full_url, request)
+            return instrument(
+                await respond_html(response, proxy_id, target_url, full_url, accept_encoding, timer, preload), timer
             )
 
+        # Check if content is CSS and rewrite it
+        if rewritable and ('text/css' in content_type or path.endswith('.css')):
+            return instrument(await respond_css(response, proxy_id, full_url, accept_encoding, timer), timer)
+
+        # For other content types, relay the raw upstream bytes as they arrive.
+        # The body is not decoded, so content-encoding, content-length and
+        # content-range stay valid.
+        response_headers = MutableHeaders(raw=proxy_response_headers(response.headers.raw))
+        return instrument(with_headers(StreamingResponse(
+            relay_body(response, timer),
+            status_code=response.status_code,
+            background=BackgroundTask(response.aclose),
+        ), response_headers), timer)
+
+    except NoHealthyTarget as e:
+        Metrics.finish(timer, 503)
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={'Retry-After': str(int(LoadBalancer.open_seconds))})
+    except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+        if response is not None:
+            await response.aclose()
+        Metrics.finish(timer, 504)
+        raise HTTPException(status_code=504, detail=f"Timed out waiting for target: {str(e) or 'no response'}")
     except httpx.RequestError as e:
+        if response is not None:
+            await response.aclose()
+        Metrics.finish(timer, 502)
         raise HTTPException(status_code=502, detail=f"Error connecting to target: {str(e)}")
     except Exception as e:
+        if response is not None:
+            await response.aclose()
+        Metrics.finish(timer, 500)
         raise HTTPException(status_code=500, detail=f"Proxy error: {str(e)}")
+
+
+# Handshake headers generated by the WebSocket client itself
+WEBSOCKET_HANDSHAKE_HEADERS = frozenset([
+    'host', 'origin', 'sec-websocket-key', 'sec-websocket-version', 'sec-websocket-extensions',
+    'sec-websocket-protocol', 'sec-websocket-accept', 'content-length',
+])
+
+# Close codes that are reserved and must not be sent in a close frame
+RESERVED_CLOSE_CODES = frozenset([1004, 1005, 1006, 1015])
+
+
+def close_code(code: Optional[int], default: int = 1000) -> int:
+    """Map a received close code to one that may be sent on the other side"""
+    if code is None or code in RESERVED_CLOSE_CODES:
+        return default
+    return code
+
+
+async def relay_client_to_upstream(websocket: WebSocket, upstream) -> None:
+    """Forward frames from the browser to the target until either side closes"""
+    while True:
+        message = await websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            await upstream.close(code=close_code(message.get('code')))
+            return
+        if message.get('text') is not None:
+            await upstream.send(message['text'])
+        elif message.get('bytes') is not None:
+            await upstream.send(message['bytes'])
+
+
+async def relay_upstream_to_client(websocket: WebSocket, upstream) -> None:
+    """Forward frames from the target to the browser, then propagate the close"""
+    try:
+        async for message in upstream:
+            if isinstance(message, str):
+                await websocket.send_text(message)
+            else:
+                await websocket.send_bytes(message)
+    except websockets.ConnectionClosed:
+        pass
+    await websocket.close(code=close_code(upstream.close_code), reason=upstream.close_reason or None)
+
+
+@router.websocket("/{proxy_id}/{path:path}")
+async def proxy_websocket(websocket: WebSocket, proxy_id: str, path: str):
+    """Proxy WebSocket connections to the target's ws/wss endpoint"""
+    proxy_config = ProxyService.get_proxy_by_id(proxy_id)
+
+    if not proxy_config or not proxy_config.get('enabled', True):
+        await websocket.close(code=1008)
+        return
+
+    try:
+        target = LoadBalancer.choose(proxy_config)
+    except NoHealthyTarget:
+        await websocket.close(code=1013)
+        return
+
+    target_url = target.url
+    ws_url = 'ws' + target_url[4:] if target_url.startswith('http') else target_url
+    full_url = f"{ws_url}/{path}"
+    if websocket.url.query:
+        full_url = f"{full_url}?{websocket.url.query}"
+
+    # Apply the same header/origin rewriting as HTTP requests
+    headers = modify_headers_for_proxy(dict(websocket.headers), target_url, proxy_id)
+    origin = headers.get('origin')
+    extra_headers = [(k, v) for k, v in headers.items() if k not in WEBSOCKET_HANDSHAKE_HEADERS]
+    subprotocols = [
+        p.strip() for p in websocket.headers.get('sec-websocket-protocol', '').split(',') if p.strip()
+    ]
+
+    started = time.perf_counter()
+    try:
+        upstream = await websockets.connect(
+            full_url,
+            extra_headers=extra_headers,
+            origin=origin,
+            subprotocols=subprotocols or None,
+            open_timeout=proxy_config.get('connect_timeout') or proxy_config.get('timeout', 30.0),
+            ping_interval=WS_PING_INTERVAL or None,
+            max_size=WS_MAX_MESSAGE_SIZE,
+            max_queue=WS_MAX_QUEUE,
+            compression=None,
+        )
+    except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake, websockets.InvalidURI) as e:
+        LoadBalancer.release(target, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+        await websocket.close(code=1011)
+        return
+    except BaseException:
+        LoadBalancer.abandon(target)
+        raise
+    LoadBalancer.release(target, time.perf_counter() - started)
+
+    try:
+        await websocket.accept(subprotocol=upstream.subprotocol)
+        tasks = [
+            asyncio.create_task(relay_client_to_upstream(websocket, upstream)),
+            asyncio.create_task(relay_upstream_to_client(websocket, upstream)),
+        ]
+        # When either direction finishes the session is over; stop the other one.
+        # Errors here are disconnects from one side and need no further handling.
+        _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await upstream.close()
@@ -1,34 +1,156 @@
 """API routes for proxy management"""
-from typing import List
+import os
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.responses import PlainTextResponse
 
-from ..models.proxy import ProxyConfig, ProxyCreate, ProxyUpdate
+from ..config.settings import PROXY_LIST_MAX_LIMIT, WORKERS
+from ..models.proxy import ProxyBatch, ProxyConfig, ProxyCreate, ProxyUpdate
+from ..services.admission import AdmissionControl
+from ..services.asset_index import AssetIndex
+from ..services.load_balancer import LoadBalancer
+from ..services.loop_monitor import LoopMonitor
+from ..services.metrics import Metrics
+from ..services.preloader import Preloader
 from ..services.proxy_service import ProxyService
+from ..services.response_cache import ResponseCache
+from ..services.rewrite_cache import RewriteCache
+from ..services.rewrite_pool import RewritePool
+from ..services.single_flight import SingleFlight
 
 router = APIRouter(prefix="/_rproxy", tags=["proxy-management"])
 
 
 @router.get("/proxies", response_model=List[ProxyConfig])
-async def get_proxies():
-    """Get all proxy configurations"""
-    return ProxyService.get_all_proxies()
+async def get_proxies(
+    response: Response,
+    search: Optional[str] = None,
+    enabled: Optional[bool] = None,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=PROXY_LIST_MAX_LIMIT),
+):
+    """Get proxy configurations, optionally filtered and paginated
+
+    The total number of matching proxies is returned in X-Total-Count.
+    """
+    if search is None and enabled is None and offset == 0 and limit is None:
+        proxies = ProxyService.get_all_proxies()
+        total = len(proxies)
+    else:
+        proxies, total = await ProxyService.list_proxies(search=search, enabled=enabled, offset=offset, limit=limit)
+    response.headers['X-Total-Count'] = str(total)
+    return proxies
+
+
+@router.get("/proxies:batch", response_model=ProxyBatch)
+async def export_proxies():
+    """Export every proxy configuration in the format accepted by the batch import"""
+    return {"proxies": ProxyService.get_all_proxies()}
+
+
+@router.post("/proxies:batch")
+async def import_proxies(batch: ProxyBatch):
+    """Create or overwrite many proxy configurations in one transaction"""
+    return await ProxyService.import_proxies(batch.proxies, replace=batch.mode == "replace")
 
 
 @router.post("/proxies", response_model=ProxyConfig, status_code=201)
 async def create_proxy(proxy: ProxyCreate):
     """Create a new proxy configuration"""
-    return ProxyService.create_proxy(proxy)
+    return await ProxyService.create_proxy(proxy)
 
 
 @router.put("/proxies/{proxy_id}", response_model=ProxyConfig)
 async def update_proxy(proxy_id: str, proxy: ProxyUpdate):
     """Update a proxy configuration"""
-    return ProxyService.update_proxy(proxy_id, proxy)
+    return await ProxyService.update_proxy(proxy_id, proxy)
 
 
 @router.delete("/proxies/{proxy_id}")
 async def delete_proxy(proxy_id: str):
     """Delete a proxy configuration"""
-    ProxyService.delete_proxy(proxy_id)
+    await ProxyService.delete_proxy(proxy_id)
     return {"success": True}
+
+
+@router.get("/proxies/{proxy_id}/targets")
+async def get_proxy_targets(proxy_id: str):
+    """Get the health, circuit state and load of each target of a proxy"""
+    proxy_config = ProxyService.get_proxy_by_id(proxy_id)
+    if not proxy_config:
+        raise HTTPException(status_code=404, detail="Proxy not found")
+    return LoadBalancer.stats(proxy_config)
+
+
+@router.get("/stats")
+async def get_stats():
+    """Get runtime statistics for the proxy
+
+    With several workers, figures are those of the worker that answered.
+    """
+    return {
+        "worker": {"pid": os.getpid(), "workers": WORKERS},
+        "rewrite_cache": RewriteCache.stats(),
+        "response_cache": ResponseCache.stats(),
+        "rewrite_pool": RewritePool.stats(),
+        "event_loop": LoopMonitor.stats(),
+        "frontend_assets": AssetIndex.stats(),
+        "coalescing": SingleFlight.stats(),
+        "admission": AdmissionControl.stats(),
+        "preload": Preloader.stats(),
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Get request and cache metrics in the Prometheus text format"""
+    rewrite_cache = RewriteCache.stats()
+    response_cache = ResponseCache.stats()
+    rewrite_pool = RewritePool.stats()
+    event_loop = LoopMonitor.stats()
+    coalescing = SingleFlight.stats()
+    admission = AdmissionControl.stats()
+    preload = Preloader.stats()
+    gates = admission['proxies']
+    extra = [
+        ('nebula_rewrite_cache_hits_total', 'counter', 'Rewrite cache hits', rewrite_cache['hits']),
+        ('nebula_rewrite_cache_misses_total', 'counter', 'Rewrite cache misses', rewrite_cache['misses']),
+        ('nebula_rewrite_cache_evictions_total', 'counter', 'Rewrite cache evictions', rewrite_cache['evictions']),
+        ('nebula_rewrite_cache_bytes', 'gauge', 'Bytes held by the rewrite cache', rewrite_cache['bytes']),
+        ('nebula_response_cache_hits_total', 'counter', 'Response cache hits', response_cache['hits']),
+        ('nebula_response_cache_misses_total', 'counter', 'Response cache misses', response_cache['misses']),
+        ('nebula_response_cache_revalidations_total', 'counter', 'Response cache revalidations',
+         response_cache['revalidations']),
+        ('nebula_response_cache_memory_bytes', 'gauge', 'Bytes held in memory by the response cache',
+         response_cache['memory_bytes']),
+        ('nebula_response_cache_disk_bytes', 'gauge', 'Bytes held on disk by the response cache',
+         response_cache['disk_bytes']),
+        ('nebula_rewrite_pool_pending', 'gauge', 'Rewrites waiting for or running in the worker pool',
+         rewrite_pool['pending']),
+        ('nebula_rewrite_pool_offloaded_total', 'counter', 'Rewrites run in the worker pool',
+         rewrite_pool['offloaded']),
+        ('nebula_rewrite_pool_rejected_total', 'counter', 'Rewrites rejected because the pool was saturated',
+         rewrite_pool['rejected']),
+        ('nebula_coalesced_requests_total', 'counter', 'Requests answered with the response of an identical request',
+         coalescing['joined']),
+        ('nebula_admission_active', 'gauge', 'Proxied requests holding an admission slot', admission['active']),
+        ('nebula_admission_queued', 'gauge', 'Proxied requests waiting for an admission slot', admission['queued']),
+        ('nebula_early_hints_total', 'counter', 'Early Hints responses sent', preload['early_hints']),
+        ('nebula_prefetched_total', 'counter', 'Subresources prefetched into the response cache',
+         preload['prefetched']),
+        ('nebula_prefetch_errors_total', 'counter', 'Subresource prefetches that failed', preload['prefetch_errors']),
+        ('nebula_event_loop_lag_seconds', 'gauge', 'Most recent event loop lag', event_loop['lag_seconds']),
+        ('nebula_event_loop_lag_max_seconds', 'gauge', 'Largest event loop lag observed',
+         event_loop['lag_max_seconds']),
+    ]
+    per_proxy = [
+        ('nebula_proxy_admission_active', 'gauge', 'Requests to a proxy holding an admission slot',
+         {proxy_id: gate['active'] for proxy_id, gate in gates.items()}),
+        ('nebula_proxy_admission_queued', 'gauge', 'Requests to a proxy waiting for an admission slot',
+         {proxy_id: gate['queued_now'] for proxy_id, gate in gates.items()}),
+        ('nebula_proxy_admission_rejected_total', 'counter',
+         'Requests to a proxy rejected because its queue was full or the wait timed out',
+         {proxy_id: gate['rejected'] + gate['timed_out'] for proxy_id, gate in gates.items()}),
+    ]
+    return PlainTextResponse(Metrics.render(extra, per_proxy), media_type='text/plain; version=0.0.4')
@@ -1,4 +1,36 @@
 """Services module initialization"""
+from .admission import AdmissionControl, AdmissionRejected, AdmittedResponse
+from .asset_index import AssetIndex
+from .client_pool import ClientPool
+from .load_balancer import LoadBalancer, NoHealthyTarget
+from .loop_monitor import LoopMonitor
+from .metrics import Metrics
+from .preloader import Preloader
 from .proxy_service import ProxyService
+from .proxy_store import JsonProxyStore, ProxyStore, SqliteProxyStore
+from .response_cache import ResponseCache
+from .rewrite_cache import RewriteCache
+from .rewrite_pool import RewritePool, RewritePoolSaturated
+from .single_flight import SingleFlight
 
-__all__ = ['ProxyService']
+__all__ = [
+    'AdmissionControl',
+    'AdmissionRejected',
+    'AdmittedResponse',
+    'AssetIndex',
+    'ClientPool',
+    'LoadBalancer',
+    'LoopMonitor',
+    'Metrics',
+    'NoHealthyTarget',
+    'Preloader',
+    'ProxyService',
+    'ProxyStore',
+    'JsonProxyStore',
+    'SqliteProxyStore',
+    'ResponseCache',
+    'RewriteCache',
+    'RewritePool',
+    'RewritePoolSaturated',
+    'SingleFlight',
+]
@@ -0,0 +1,214 @@
+"""Admission control: bounded concurrency and queueing of proxied requests"""
+import asyncio
+from collections import deque
+from typing import Deque, Dict
+
+from fastapi import Response
+
+from ..config.settings import (
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_MAX_QUEUED,
+    ADMISSION_PROXY_MAX_CONCURRENT,
+    ADMISSION_QUEUE_TIMEOUT,
+)
+
+
+class AdmissionRejected(Exception):
+    """The request could not be admitted: the queue is full or its deadline passed"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ProxyGate:
+    """Active requests and waiting queue of one proxy"""
+
+    __slots__ = ('proxy_id', 'limit', 'max_queued', 'active', 'waiters',
+                 'admitted', 'queued', 'rejected', 'timed_out')
+
+    def __init__(self, proxy_id: str):
+        self.proxy_id = proxy_id
+        self.limit = ADMISSION_PROXY_MAX_CONCURRENT
+        self.max_queued = ADMISSION_MAX_QUEUED
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def depth(self) -> int:
+        return sum(1 for waiter in self.waiters if not waiter.done())
+
+    def to_dict(self) -> dict:
+        return {
+            'active': self.active,
+            'queued_now': self.depth(),
+            'limit': self.limit,
+            'max_queued': self.max_queued,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+        }
+
+
+class AdmissionControl:
+    """Bounds concurrent proxied requests per proxy and per worker
+
+    A request runs once its proxy is below its max_concurrent_requests and
+    the worker is below max_concurrent (a limit of 0 disables either
+    bound). Otherwise it waits in its proxy's
+    FIFO queue; freed slots are handed to the queues in turn, so a busy
+    proxy can't take every slot freed by others. Requests are rejected
+    when the proxy's queue is full or they waited longer than the queue
+    timeout.
+    """
+
+    max_concurrent: int = ADMISSION_MAX_CONCURRENT
+
+    _gates: Dict[str, ProxyGate] = {}
+    # Proxies with waiting requests, in the order they are served
+    _rotation: Deque[ProxyGate] = deque()
+    _active: int = 0
+
+    @classmethod
+    def _gate(cls, proxy_config: dict) -> ProxyGate:
+        gate = cls._gates.get(proxy_config['id'])
+        if gate is None:
+            gate = cls._gates[proxy_config['id']] = ProxyGate(proxy_config['id'])
+        limit = proxy_config.get('max_concurrent_requests')
+        gate.limit = ADMISSION_PROXY_MAX_CONCURRENT if limit is None else limit
+        max_queued = proxy_config.get('max_queued_requests')
+        gate.max_queued = ADMISSION_MAX_QUEUED if max_queued is None else max_queued
+        return gate
+
+    @classmethod
+    def _has_room(cls, gate: ProxyGate) -> bool:
+        return (gate.limit <= 0 or gate.active < gate.limit) and (
+            cls.max_concurrent <= 0 or cls._active < cls.max_concurrent)
+
+    @classmethod
+    def _take(cls, gate: ProxyGate) -> None:
+        gate.active += 1
+        gate.admitted += 1
+        cls._active += 1
+
+    @classmethod
+    async def acquire(cls, proxy_config: dict) -> ProxyGate:
+        """Wait for a slot for a request to a proxy
+
+        Every successful call must be paired with release().
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait exceeded the queue timeout
+        """
+        gate = cls._gate(proxy_config)
+        timeout = proxy_config.get('queue_timeout')
+        timeout = ADMISSION_QUEUE_TIMEOUT if timeout is None else timeout
+
+        if not gate.depth() and cls._has_room(gate):
+            cls._take(gate)
+            return gate
+
+        if gate.depth() >= gate.max_queued:
+            gate.rejected += 1
+            raise AdmissionRejected(f"Too many requests queued for proxy '{gate.proxy_id}'", timeout)
+
+        waiter = asyncio.get_running_loop().create_future()
+        gate.waiters.append(waiter)
+        gate.queued += 1
+        if gate not in cls._rotation:
+            cls._rotation.append(gate)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as the wait ended
+                cls.release(gate)
+            if isinstance(e, asyncio.TimeoutError):
+                gate.timed_out += 1
+                raise AdmissionRejected(
+                    f"Request to proxy '{gate.proxy_id}' waited more than {timeout:g}s for a slot", timeout
+                ) from None
+            raise
+        return gate
+
+    @classmethod
+    def release(cls, gate: ProxyGate) -> None:
+        """Free a request's slot and hand freed slots to waiting requests"""
+        gate.active -= 1
+        cls._active -= 1
+        cls._dispatch()
+
+    @classmethod
+    def _dispatch(cls) -> None:
+        """Admit waiting requests, one proxy at a time, while slots are free"""
+        skipped = 0
+        while cls._rotation and skipped < len(cls._rotation):
+            if cls.max_concurrent > 0 and cls._active >= cls.max_concurrent:
+                return
+            gate = cls._rotation.popleft()
+            while gate.waiters and gate.waiters[0].done():
+                # Timed out or cancelled while waiting
+                gate.waiters.popleft()
+            if not gate.waiters:
+                continue
+            if not cls._has_room(gate):
+                # Proxy at its own limit; others may still have room
+                cls._rotation.append(gate)
+                skipped += 1
+                continue
+            cls._take(gate)
+            gate.waiters.popleft().set_result(None)
+            if gate.waiters:
+                cls._rotation.append(gate)
+            skipped = 0
+
+    @classmethod
+    def forget_proxy(cls, proxy_id: str) -> None:
+        """Drop the gate of a deleted proxy once it is idle"""
+        gate = cls._gates.get(proxy_id)
+        if gate is not None and not gate.active and not gate.depth():
+            del cls._gates[proxy_id]
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Active and queued requests per proxy and for the worker"""
+        return {
+            'active': cls._active,
+            'max_concurrent': cls.max_concurrent,
+            'queued': sum(gate.depth() for gate in cls._gates.values()),
+            'proxies': {proxy_id: gate.to_dict() for proxy_id, gate in sorted(cls._gates.items())},
+        }
+
+
+class AdmittedResponse(Response):
+    """Sends a response, then frees the request's admission slot
+
+    The slot is freed however sending ends, including client disconnects
+    and errors while streaming.
+    """
+
+    def __init__(self, response: Response, gate: ProxyGate):
+        # Response.__init__ is not called: everything else is read from the wrapped response
+        self.response = response
+        self.gate = gate
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    @property
+    def background(self):
+        return self.response.background
+
+    @background.setter
+    def background(self, value):
+        self.response.background = value
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            AdmissionControl.release(self.gate)
@@ -0,0 +1,147 @@
+"""In-memory index of the frontend build, served without touching the disk"""
+import hashlib
+import mimetypes
+import re
+from pathlib import Path
+from typing import Dict, Mapping, Optional
+
+from fastapi import Response
+from fastapi.responses import FileResponse
+
+from ..config.settings import (
+    ALLOWED_STATIC_EXTENSIONS,
+    COMPRESSION_MIN_SIZE,
+    FRONTEND_ASSET_CACHE_BYTES,
+    FRONTEND_BUILD_DIR,
+)
+from ..utils.compression import AVAILABLE_ENCODINGS, compress, is_compressible, negotiate_encoding
+from ..utils.headers import etag_matches
+
+# Build tools put a content hash in the name of every fingerprinted file, e.g. main.3f2a9c1b.js
+HASHED_NAME = re.compile(r'[.-][0-9a-f]{8,}\.', re.IGNORECASE)
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# Types mimetypes doesn't know
+MEDIA_TYPE_OVERRIDES = {'.map': 'application/json'}
+
+# Compression level for variants built once at startup
+PRECOMPRESS_LEVEL = 11
+
+
+class Asset:
+    """A build file with its validators and precompressed variants
+
+    `body` is None when the file did not fit in the memory budget and is
+    streamed from disk instead.
+    """
+
+    __slots__ = ('path', 'body', 'variants', 'etag', 'media_type', 'cache_control')
+
+    def __init__(self, path: Path, body: Optional[bytes], etag: str, media_type: str, cache_control: str):
+        self.path = path
+        self.body = body
+        self.variants: Dict[str, bytes] = {}
+        self.etag = etag
+        self.media_type = media_type
+        self.cache_control = cache_control
+
+    @property
+    def size(self) -> int:
+        return len(self.body or b'') + sum(len(v) for v in self.variants.values())
+
+
+class AssetIndex:
+    """Frontend build files indexed once at startup
+
+    Every servable file is hashed for a strong ETag and, within the memory
+    budget, kept in memory together with its compressed variants. Requests
+    are answered from the index, so serving the dashboard needs no stat()
+    calls, MIME guessing or file reads.
+    """
+
+    build_dir: Path = FRONTEND_BUILD_DIR
+    max_bytes: int = FRONTEND_ASSET_CACHE_BYTES
+
+    _assets: Dict[str, Asset] = {}
+    _size: int = 0
+
+    @classmethod
+    def load(cls) -> None:
+        """Index the build directory, replacing any previous index"""
+        assets: Dict[str, Asset] = {}
+        size = 0
+        if cls.build_dir.is_dir():
+            files = sorted(p for p in cls.build_dir.rglob('*') if p.is_file() and cls._servable(p))
+            # index.html first so the dashboard shell always fits in memory
+            files.sort(key=lambda p: p.parent != cls.build_dir or p.name != 'index.html')
+            for path in files:
+                asset = cls._build_asset(path, cls.max_bytes - size)
+                assets[path.relative_to(cls.build_dir).as_posix()] = asset
+                size += asset.size
+        cls._assets = assets
+        cls._size = size
+
+    @classmethod
+    def _servable(cls, path: Path) -> bool:
+        return path == cls.build_dir / 'index.html' or path.suffix.lower() in ALLOWED_STATIC_EXTENSIONS
+
+    @classmethod
+    def _build_asset(cls, path: Path, budget: int) -> Asset:
+        data = path.read_bytes()
+        media_type = (MEDIA_TYPE_OVERRIDES.get(path.suffix.lower()) or mimetypes.guess_type(path.name)[0]
+                      or 'application/octet-stream')
+        if media_type in ('application/javascript', 'application/json'):
+            # text/* types get their charset from the response class
+            media_type += '; charset=utf-8'
+        cache_control = IMMUTABLE_CACHE_CONTROL if HASHED_NAME.search(path.name) else REVALIDATE_CACHE_CONTROL
+        etag = '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+        if len(data) > budget:
+            return Asset(path, None, etag, media_type, cache_control)
+
+        asset = Asset(path, data, etag, media_type, cache_control)
+        if len(data) >= COMPRESSION_MIN_SIZE and is_compressible(media_type):
+            for encoding in AVAILABLE_ENCODINGS:
+                variant = compress(data, encoding, PRECOMPRESS_LEVEL)
+                if len(variant) < len(data) and asset.size + len(variant) <= budget:
+                    asset.variants[encoding] = variant
+        return asset
+
+    @classmethod
+    def get(cls, path: str) -> Optional[Asset]:
+        """Look up an indexed file by its path relative to the build directory"""
+        return cls._assets.get(path)
+
+    @classmethod
+    def respond(cls, asset: Asset, request_headers: Mapping[str, str]) -> Response:
+        """Serve an asset, honouring If-None-Match and Accept-Encoding"""
+        headers = {'etag': asset.etag, 'cache-control': asset.cache_control}
+        if asset.variants:
+            headers['vary'] = 'Accept-Encoding'
+
+        if etag_matches(request_headers.get('if-none-match'), asset.etag):
+            return Response(status_code=304, headers=headers)
+
+        if asset.body is None:
+            return FileResponse(asset.path, media_type=asset.media_type, headers=headers)
+
+        body = asset.body
+        if asset.variants:
+            # Variants are stored in order of preference
+            encoding = negotiate_encoding(request_headers.get('accept-encoding'), tuple(asset.variants))
+            if encoding is not None:
+                body = asset.variants[encoding]
+                headers['content-encoding'] = encoding
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Counters describing the index"""
+        return {
+            'files': len(cls._assets),
+            'in_memory': sum(1 for a in cls._assets.values() if a.body is not None),
+            'bytes': cls._size,
+            'max_bytes': cls.max_bytes,
+        }
@@ -0,0 +1,178 @@
+"""Pool of long-lived upstream HTTP clients, one per proxy"""
+import asyncio
+import importlib.util
+from http.cookiejar import CookieJar
+from typing import Callable, Dict, Optional, Tuple
+
+import httpx
+
+from ..models.proxy import ProxyConfig
+
+# HTTP/2 needs the optional 'h2' package; fall back to HTTP/1.1 without it
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Proxy settings a client is built from, in the order of the settings tuple
+CLIENT_SETTINGS = ('target_url', 'max_connections', 'max_keepalive_connections', 'keepalive_expiry',
+                   'http2', 'timeout', 'connect_timeout', 'read_timeout')
+CLIENT_DEFAULTS = {name: ProxyConfig.model_fields[name].default for name in CLIENT_SETTINGS}
+
+# Seconds a replaced client may keep serving responses that are still open
+CLOSE_GRACE = 60.0
+
+
+class NoCookieJar(CookieJar):
+    """Cookie jar that never stores anything
+
+    A pooled client is shared by everyone using a proxy, so cookies set by
+    one response must not be sent with anybody else's requests. Only the
+    Cookie header of the browser's own request reaches the upstream.
+    """
+
+    def set_cookie(self, cookie):
+        pass
+
+    def extract_cookies(self, response, request):
+        pass
+
+
+class TrackedStream(httpx.AsyncByteStream):
+    """Response body that reports when it is closed"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close: Optional[Callable[[], None]] = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                on_close, self._on_close = self._on_close, None
+                on_close()
+
+
+class TrackingTransport(httpx.AsyncHTTPTransport):
+    """HTTP transport that knows when none of its responses are open"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.open_responses = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await super().handle_async_request(request)
+        self.open_responses += 1
+        self.idle.clear()
+        response.stream = TrackedStream(response.stream, self._response_closed)
+        return response
+
+    def _response_closed(self) -> None:
+        self.open_responses -= 1
+        if not self.open_responses:
+            self.idle.set()
+
+
+class ClientPool:
+    """Keeps one keep-alive httpx.AsyncClient per proxy for the app lifetime"""
+
+    _clients: Dict[str, Tuple[tuple, httpx.AsyncClient, TrackingTransport]] = {}
+    # Replaced clients waiting for their open responses before closing
+    _closing: Dict[asyncio.Task, httpx.AsyncClient] = {}
+
+    @staticmethod
+    def _client_settings(proxy_config: dict) -> tuple:
+        """Settings that require a new client when they change
+
+        Read straight from the config dict, which is looked up on every request.
+        """
+        return tuple(proxy_config.get(name, CLIENT_DEFAULTS[name]) for name in CLIENT_SETTINGS)
+
+    @staticmethod
+    def _build_client(settings: tuple) -> Tuple[httpx.AsyncClient, TrackingTransport]:
+        """Create a client configured from the proxy settings, and its transport"""
+        (_, max_connections, max_keepalive_connections, keepalive_expiry,
+         http2, timeout, connect_timeout, read_timeout) = settings
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        timeout = httpx.Timeout(timeout, connect=connect_timeout or timeout, read=read_timeout or timeout)
+        transport = TrackingTransport(limits=limits, http2=bool(http2) and HTTP2_AVAILABLE)
+        client = httpx.AsyncClient(
+            follow_redirects=True,
+            cookies=NoCookieJar(),
+            timeout=timeout,
+            transport=transport,
+        )
+        return client, transport
+
+    @classmethod
+    def get_client(cls, proxy_config: dict) -> httpx.AsyncClient:
+        """Get the pooled client for a proxy, rebuilding it if its settings changed"""
+        proxy_id = proxy_config['id']
+        settings = cls._client_settings(proxy_config)
+
+        entry = cls._clients.get(proxy_id)
+        if entry is not None:
+            current_settings, client, transport = entry
+            if current_settings == settings:
+                return client
+            cls._close_later(client, transport)
+
+        client, transport = cls._build_client(settings)
+        cls._clients[proxy_id] = (settings, client, transport)
+        return client
+
+    @classmethod
+    def invalidate(cls, proxy_id: str) -> None:
+        """Drop the pooled client for a proxy so the next request builds a fresh one"""
+        entry = cls._clients.pop(proxy_id, None)
+        if entry is not None:
+            cls._close_later(entry[1], entry[2])
+
+    @classmethod
+    async def close_all(cls) -> None:
+        """Close every pooled client (called on application shutdown)
+
+        Replaced clients still waiting for their responses are closed now.
+        """
+        clients = [client for _, client, _ in cls._clients.values()]
+        cls._clients.clear()
+        for task, client in list(cls._closing.items()):
+            task.cancel()
+            clients.append(client)
+        await asyncio.gather(*cls._closing, return_exceptions=True)
+        await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+
+    @classmethod
+    def _close_later(cls, client: httpx.AsyncClient, transport: TrackingTransport) -> None:
+        """Close a replaced client once its open responses are finished
+
+        Responses still open after CLOSE_GRACE seconds are cut off. Outside
+        the event loop there is nothing in flight, so the client is closed
+        right away.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(client.aclose())
+            return
+
+        task = loop.create_task(cls._close_when_idle(client, transport))
+        cls._closing[task] = client
+        task.add_done_callback(lambda task: cls._closing.pop(task, None))
+
+    @staticmethod
+    async def _close_when_idle(client: httpx.AsyncClient, transport: TrackingTransport) -> None:
+        try:
+            await asyncio.wait_for(transport.idle.wait(), CLOSE_GRACE)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await client.aclose()
@@ -0,0 +1,323 @@
+"""Upstream target selection with health checks and circuit breaking"""
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import urlparse
+
+import httpx
+
+from ..config.settings import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_OPEN_SECONDS,
+    HEALTH_CHECK_TIMEOUT,
+    HEALTH_CHECK_UNHEALTHY_THRESHOLD,
+)
+from .client_pool import ClientPool
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Upstream statuses that count as a failure of the target itself, when the
+# proxy has other targets to send requests to instead
+FAILURE_STATUS_CODES = frozenset([502, 503, 504])
+
+# Requests that can be sent to another target when the first one can't be reached
+REPLAYABLE_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+# Weight of the newest sample in the latency moving average
+EWMA_WEIGHT = 0.2
+
+
+class NoHealthyTarget(Exception):
+    """Every target of a proxy is unhealthy or has an open circuit"""
+
+
+class TargetState:
+    """Load, latency and health of one upstream target"""
+
+    __slots__ = ('url', 'outstanding', 'latency', 'samples', 'failures', 'circuit', 'opened_at',
+                 'trial_in_flight', 'healthy', 'probe_failures', 'last_probe', 'last_error',
+                 'requests', 'errors', 'trips')
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency = 0.0
+        self.samples = 0
+        self.failures = 0
+        self.circuit = CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.healthy = True
+        self.probe_failures = 0
+        self.last_probe: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.requests = 0
+        self.errors = 0
+        self.trips = 0
+
+    def available(self, now: float, open_seconds: float) -> bool:
+        """Whether the target may receive a request"""
+        if not self.healthy:
+            return False
+        if self.circuit == OPEN:
+            return now - self.opened_at >= open_seconds
+        if self.circuit == HALF_OPEN:
+            return not self.trial_in_flight
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'circuit': self.circuit,
+            'outstanding': self.outstanding,
+            'latency_ewma_seconds': self.latency,
+            'consecutive_failures': self.failures,
+            'requests': self.requests,
+            'errors': self.errors,
+            'circuit_trips': self.trips,
+            'last_error': self.last_error,
+        }
+
+
+class LoadBalancer:
+    """Spreads a proxy's requests over its targets
+
+    Targets are picked by fewest outstanding requests or by latency EWMA
+    weighted by load. Failures seen on real traffic (connection errors, and
+    502/503/504 when the proxy has several targets) open a target's circuit
+    after CIRCUIT_FAILURE_THRESHOLD in a row; an open circuit is skipped until CIRCUIT_OPEN_SECONDS have passed,
+    then a single trial request decides whether it closes again. Proxies with
+    a health_check_path are also probed in the background, and targets that
+    fail HEALTH_CHECK_UNHEALTHY_THRESHOLD probes are skipped until one passes.
+    """
+
+    failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD
+    open_seconds: float = CIRCUIT_OPEN_SECONDS
+    probe_timeout: float = HEALTH_CHECK_TIMEOUT
+    unhealthy_threshold: int = HEALTH_CHECK_UNHEALTHY_THRESHOLD
+
+    _states: Dict[str, Dict[str, TargetState]] = {}
+    # Proxies with health checks, set by the proxy service whenever its registry changes
+    _probed: List[dict] = []
+    _task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def targets(proxy_config: dict) -> List[str]:
+        """All target URLs of a proxy, primary first"""
+        urls = []
+        for url in [proxy_config['target_url'], *(proxy_config.get('targets') or [])]:
+            url = url.rstrip('/')
+            if url not in urls:
+                urls.append(url)
+        return urls
+
+    @classmethod
+    def _states_for(cls, proxy_config: dict) -> Dict[str, TargetState]:
+        """Target states of a proxy, reconciled with its current target list"""
+        urls = cls.targets(proxy_config)
+        states = cls._states.get(proxy_config['id'])
+        if states is None or list(states) != urls:
+            previous = states or {}
+            states = {url: previous.get(url) or TargetState(url) for url in urls}
+            cls._states[proxy_config['id']] = states
+        return states
+
+    @classmethod
+    def choose(cls, proxy_config: dict, exclude: Sequence[str] = ()) -> TargetState:
+        """Pick a target for a request and count it as outstanding
+
+        Every call must be paired with release().
+        """
+        now = time.monotonic()
+        candidates = [
+            state for state in cls._states_for(proxy_config).values()
+            if state.url not in exclude and state.available(now, cls.open_seconds)
+        ]
+        if not candidates:
+            raise NoHealthyTarget(f"No healthy target for proxy '{proxy_config['id']}'")
+
+        if proxy_config.get('load_balancing') == 'ewma':
+            # Untried targets have no latency yet and are picked first
+            state = min(candidates, key=lambda s: (s.latency * (s.outstanding + 1), s.outstanding))
+        else:
+            fewest = min(s.outstanding for s in candidates)
+            state = random.choice([s for s in candidates if s.outstanding == fewest])
+
+        if state.circuit == OPEN:
+            state.circuit = HALF_OPEN
+        if state.circuit == HALF_OPEN:
+            state.trial_in_flight = True
+        state.outstanding += 1
+        state.requests += 1
+        return state
+
+    @classmethod
+    def release(cls, state: TargetState, latency: float, error: Optional[str] = None) -> None:
+        """Record the outcome of a request sent to a target"""
+        state.outstanding -= 1
+        state.latency = latency if not state.samples else state.latency * (1 - EWMA_WEIGHT) + latency * EWMA_WEIGHT
+        state.samples += 1
+
+        if error is None:
+            state.failures = 0
+            state.circuit = CLOSED
+            state.trial_in_flight = False
+            return
+
+        state.errors += 1
+        state.failures += 1
+        state.last_error = error
+        if state.circuit == HALF_OPEN or state.failures >= cls.failure_threshold:
+            cls._trip(state)
+
+    @staticmethod
+    def abandon(state: TargetState) -> None:
+        """Stop counting a request whose outcome is unknown"""
+        state.outstanding -= 1
+        state.trial_in_flight = False
+
+    @staticmethod
+    def _trip(state: TargetState) -> None:
+        state.circuit = OPEN
+        state.opened_at = time.monotonic()
+        state.trial_in_flight = False
+        state.trips += 1
+
+    @classmethod
+    async def send(cls, client: httpx.AsyncClient, proxy_config: dict, request: httpx.Request) -> httpx.Response:
+        """Send a request built for the primary target to the best available target
+
+        Requests without a body are retried on another target when the
+        chosen one refuses the connection.
+        """
+        primary = str(httpx.URL(proxy_config['target_url'].rstrip('/')))
+        replayable = request.method in REPLAYABLE_METHODS
+        tried: List[str] = []
+        # An error status from the only target is relayed, not held against it:
+        # with its circuit open the whole proxy would answer 503
+        balanced = len(cls._states_for(proxy_config)) > 1
+        state = cls.choose(proxy_config)
+        while True:
+            started = time.perf_counter()
+            try:
+                response = await client.send(retarget(request, primary, state.url), stream=True)
+            except httpx.RequestError as e:
+                cls.release(state, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+                tried.append(state.url)
+                if not replayable or not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                    raise
+                try:
+                    state = cls.choose(proxy_config, exclude=tried)
+                except NoHealthyTarget:
+                    raise e from None
+                continue
+            except BaseException:
+                # Cancelled while waiting, which says nothing about the target
+                cls.abandon(state)
+                raise
+            error = None
+            if balanced and response.status_code in FAILURE_STATUS_CODES:
+                error = f"HTTP {response.status_code}"
+            cls.release(state, time.perf_counter() - started, error)
+            return response
+
+    @classmethod
+    def start(cls) -> None:
+        """Start active health probes in the background (called at application startup)"""
+        if cls._task is None:
+            cls._task = asyncio.get_running_loop().create_task(cls._probe_loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        """Stop health probes (called at application shutdown)"""
+        if cls._task is not None:
+            cls._task.cancel()
+            try:
+                await cls._task
+            except asyncio.CancelledError:
+                pass
+            cls._task = None
+
+    @classmethod
+    def watch(cls, proxies: List[dict]) -> None:
+        """Set the proxies whose targets are probed, from the full list of proxies"""
+        cls._probed = [
+            proxy_config for proxy_config in proxies
+            if proxy_config.get('enabled', True) and proxy_config.get('health_check_path')
+            and (proxy_config.get('health_check_interval') or 0) > 0
+        ]
+
+    @classmethod
+    async def _probe_loop(cls) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            now = time.monotonic()
+            probes = []
+            for proxy_config in cls._probed:
+                interval = proxy_config['health_check_interval']
+                for state in cls._states_for(proxy_config).values():
+                    if state.last_probe is None or now - state.last_probe >= interval:
+                        state.last_probe = now
+                        probes.append(cls._probe(proxy_config, state))
+            if probes:
+                await asyncio.gather(*probes, return_exceptions=True)
+
+    @classmethod
+    async def _probe(cls, proxy_config: dict, state: TargetState) -> None:
+        """Probe a target's health check path and update its health"""
+        client = ClientPool.get_client(proxy_config)
+        url = f"{state.url}/{proxy_config['health_check_path'].lstrip('/')}"
+        try:
+            response = await client.get(url, timeout=cls.probe_timeout)
+            error = f"Health check returned HTTP {response.status_code}" if response.status_code >= 500 else None
+        except httpx.HTTPError as e:
+            error = f"Health check failed: {type(e).__name__}: {e}"
+
+        if error is None:
+            state.probe_failures = 0
+            state.healthy = True
+            if state.circuit != CLOSED and not state.trial_in_flight:
+                # The target answers again; let traffic back in
+                state.circuit = CLOSED
+                state.failures = 0
+            return
+
+        state.probe_failures += 1
+        state.last_error = error
+        if state.probe_failures >= cls.unhealthy_threshold:
+            state.healthy = False
+
+    @classmethod
+    def forget_proxy(cls, proxy_id: str) -> None:
+        """Drop the target states of a deleted proxy"""
+        cls._states.pop(proxy_id, None)
+
+    @classmethod
+    def stats(cls, proxy_config: dict) -> List[dict]:
+        """State of every target of a proxy"""
+        return [state.to_dict() for state in cls._states_for(proxy_config).values()]
+
+
+def retarget(request: httpx.Request, primary: str, target: str) -> httpx.Request:
+    """Point a request built for the primary target at another target"""
+    target = str(httpx.URL(target))
+    if target == primary:
+        return request
+    url = str(request.url)
+    if url.startswith(primary):
+        url = target + url[len(primary):]
+
+    parsed = urlparse(target)
+    headers = request.headers.copy()
+    headers['host'] = parsed.netloc
+    if 'origin' in headers:
+        headers['origin'] = f"{parsed.scheme}://{parsed.netloc}"
+    referer = headers.get('referer')
+    if referer and referer.startswith(primary):
+        headers['referer'] = target + referer[len(primary):]
+    return httpx.Request(request.method, url, headers=headers, stream=request.stream, extensions=request.extensions)
@@ -0,0 +1,63 @@
+"""Event loop lag monitor"""
+import asyncio
+import time
+from typing import Optional
+
+from ..config.settings import LOOP_LAG_INTERVAL
+
+
+class LoopMonitor:
+    """Measures how late the event loop wakes up a periodic timer
+
+    Lag is the difference between the requested sleep and the time that
+    actually passed, i.e. how long other work blocked the loop.
+    """
+
+    interval: float = LOOP_LAG_INTERVAL
+
+    _task: Optional[asyncio.Task] = None
+
+    last_lag: float = 0.0
+    max_lag: float = 0.0
+    average_lag: float = 0.0
+    samples: int = 0
+
+    @classmethod
+    def start(cls) -> None:
+        """Start sampling in the background (called at application startup)"""
+        if cls._task is None:
+            cls._task = asyncio.get_running_loop().create_task(cls._sample())
+
+    @classmethod
+    async def stop(cls) -> None:
+        """Stop sampling (called at application shutdown)"""
+        if cls._task is not None:
+            cls._task.cancel()
+            try:
+                await cls._task
+            except asyncio.CancelledError:
+                pass
+            cls._task = None
+
+    @classmethod
+    async def _sample(cls) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(cls.interval)
+            lag = max(0.0, time.perf_counter() - started - cls.interval)
+
+            cls.last_lag = lag
+            cls.max_lag = max(cls.max_lag, lag)
+            # Exponentially weighted moving average over roughly the last 20 samples
+            cls.average_lag = lag if not cls.samples else cls.average_lag * 0.95 + lag * 0.05
+            cls.samples += 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Lag figures in seconds"""
+        return {
+            'lag_seconds': cls.last_lag,
+            'lag_average_seconds': cls.average_lag,
+            'lag_max_seconds': cls.max_lag,
+            'samples': cls.samples,
+        }
@@ -0,0 +1,196 @@
+"""Per-proxy request metrics with Prometheus text exposition"""
+import time
+from bisect import bisect_left
+from typing import Dict, List, Mapping, Tuple
+
+from ..config.settings import METRICS_ENABLED, SERVER_TIMING_ENABLED
+
+# Phases of a proxied request, in the order they happen
+PHASES = ('config', 'queue', 'upstream', 'body', 'rewrite', 'send')
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets"""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class ProxyMetrics:
+    """Counters and phase histograms of a single proxy"""
+
+    __slots__ = ('requests', 'bytes_in', 'bytes_out', 'phases')
+
+    def __init__(self):
+        self.requests: Dict[str, int] = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+
+class RequestTimer:
+    """Accumulates phase durations and byte counts for one request"""
+
+    __slots__ = ('proxy_id', 'durations', 'bytes_in', 'bytes_out', '_mark')
+
+    def __init__(self, proxy_id: str):
+        self.proxy_id = proxy_id
+        self.durations: Dict[str, float] = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._mark = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        """Attribute the time since the previous mark to a phase"""
+        now = time.perf_counter()
+        self.durations[phase] = self.durations.get(phase, 0.0) + now - self._mark
+        self._mark = now
+
+    def server_timing(self) -> str:
+        """Format the phases measured so far as a Server-Timing header value"""
+        return ', '.join(
+            f'{phase};dur={self.durations[phase] * 1000:.2f}' for phase in PHASES if phase in self.durations
+        )
+
+
+class NullTimer:
+    """Timer used when metrics are disabled; every operation is a no-op"""
+
+    __slots__ = ()
+
+    proxy_id = ''
+    bytes_in = 0
+    bytes_out = 0
+
+    def mark(self, phase: str) -> None:
+        pass
+
+    def server_timing(self) -> str:
+        return ''
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Collects per-proxy request metrics
+
+    Handlers get a RequestTimer from start() and hand it back to finish()
+    once the response has been sent. When metrics are disabled a shared
+    no-op timer is returned, so instrumentation costs only a method call.
+    """
+
+    enabled: bool = METRICS_ENABLED
+    server_timing: bool = SERVER_TIMING_ENABLED
+
+    _proxies: Dict[str, ProxyMetrics] = {}
+
+    @classmethod
+    def start(cls, proxy_id: str):
+        """Begin timing a request"""
+        if not cls.enabled and not cls.server_timing:
+            return NULL_TIMER
+        return RequestTimer(proxy_id)
+
+    @classmethod
+    def finish(cls, timer, status_code: int) -> None:
+        """Record a completed request"""
+        if not cls.enabled or timer is NULL_TIMER:
+            return
+
+        metrics = cls._proxies.get(timer.proxy_id)
+        if metrics is None:
+            metrics = cls._proxies[timer.proxy_id] = ProxyMetrics()
+
+        status_class = f'{status_code // 100}xx'
+        metrics.requests[status_class] = metrics.requests.get(status_class, 0) + 1
+        metrics.bytes_in += timer.bytes_in
+        metrics.bytes_out += timer.bytes_out
+        for phase, seconds in timer.durations.items():
+            metrics.phases[phase].observe(seconds)
+
+    @classmethod
+    def forget_proxy(cls, proxy_id: str) -> None:
+        """Drop the series of a deleted proxy"""
+        cls._proxies.pop(proxy_id, None)
+
+    @classmethod
+    def render(cls, extra: List[Tuple[str, str, str, float]] = (),
+               per_proxy: List[Tuple[str, str, str, Mapping[str, float]]] = ()) -> str:
+        """Render all metrics in the Prometheus text exposition format
+
+        Args:
+            extra: Additional unlabelled (name, type, help, value) samples
+            per_proxy: Additional (name, type, help, {proxy_id: value}) samples
+        """
+        lines = [
+            '# HELP nebula_requests_total Proxied HTTP requests by status class',
+            '# TYPE nebula_requests_total counter',
+        ]
+        proxies = sorted(cls._proxies.items())
+        for proxy_id, metrics in proxies:
+            label = _escape_label(proxy_id)
+            for status_class, count in sorted(metrics.requests.items()):
+                lines.append(f'nebula_requests_total{{proxy="{label}",status_class="{status_class}"}} {count}')
+
+        lines += [
+            '# HELP nebula_received_bytes_total Request body bytes received from clients',
+            '# TYPE nebula_received_bytes_total counter',
+        ]
+        for proxy_id, metrics in proxies:
+            lines.append(f'nebula_received_bytes_total{{proxy="{_escape_label(proxy_id)}"}} {metrics.bytes_in}')
+
+        lines += [
+            '# HELP nebula_sent_bytes_total Response body bytes sent to clients',
+            '# TYPE nebula_sent_bytes_total counter',
+        ]
+        for proxy_id, metrics in proxies:
+            lines.append(f'nebula_sent_bytes_total{{proxy="{_escape_label(proxy_id)}"}} {metrics.bytes_out}')
+
+        lines += [
+            '# HELP nebula_phase_duration_seconds Time spent in each phase of a proxied request',
+            '# TYPE nebula_phase_duration_seconds histogram',
+        ]
+        for proxy_id, metrics in proxies:
+            label = _escape_label(proxy_id)
+            for phase in PHASES:
+                histogram = metrics.phases[phase]
+                if not histogram.count:
+                    continue
+                labels = f'proxy="{label}",phase="{phase}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'nebula_phase_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'nebula_phase_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'nebula_phase_duration_seconds_sum{{{labels}}} {histogram.total}')
+                lines.append(f'nebula_phase_duration_seconds_count{{{labels}}} {histogram.count}')
+
+        for name, metric_type, help_text, values in per_proxy:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+            for proxy_id, value in sorted(values.items()):
+                lines.append(f'{name}{{proxy="{_escape_label(proxy_id)}"}} {value}')
+
+        for name, metric_type, help_text, value in extra:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,205 @@
+"""Preloading of the subresources of rewritten pages"""
+import asyncio
+from collections import OrderedDict
+from functools import partial
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import Request
+from starlette.types import Send
+
+from ..config.settings import PRELOAD_CONCURRENCY, PRELOAD_MAX_PAGES, PRELOAD_MAX_SUBRESOURCES
+from ..utils.headers import RawHeaders, proxy_request_headers
+from .client_pool import ClientPool
+from .load_balancer import LoadBalancer
+from .response_cache import ResponseCache
+
+# (destination, proxied URL) of a subresource, e.g. ('style', '/proxy/app/site.css')
+Subresource = Tuple[str, str]
+
+# Page request headers not forwarded with prefetches: they select another
+# representation or only make sense for the page itself
+PREFETCH_DROPPED_HEADERS = frozenset([
+    b'accept', b'cache-control', b'pragma', b'range', b'if-range', b'if-match', b'if-none-match',
+    b'if-modified-since', b'if-unmodified-since', b'content-length', b'content-type', b'transfer-encoding',
+])
+
+# Characters that would need escaping in a Link header; URLs holding them aren't announced
+UNSAFE_LINK_CHARACTERS = frozenset(' <>"\',;')
+
+# ASGI extension for sending 103 Early Hints
+EARLY_HINT_EXTENSION = 'http.response.early_hint'
+
+
+class PagePreload:
+    """Collects the subresources found while a page is rewritten, prefetching each one"""
+
+    __slots__ = ('proxy_config', 'page_url', 'headers', 'known', 'subresources')
+
+    def __init__(self, proxy_config: dict, page_url: str, headers: RawHeaders):
+        self.proxy_config = proxy_config
+        self.page_url = page_url
+        self.headers = headers
+        # Already announced, and prefetched, when the request started
+        self.known = Preloader.subresources(proxy_config['id'], page_url)
+        self.subresources: List[Subresource] = []
+
+    def add(self, destination: str, url: str) -> None:
+        """Record a subresource of the page; the first max_subresources are kept"""
+        if len(self.subresources) >= Preloader.max_subresources:
+            return
+        if not url.isascii() or not UNSAFE_LINK_CHARACTERS.isdisjoint(url):
+            return
+        subresource = (destination, url)
+        if subresource not in self.subresources:
+            self.subresources.append(subresource)
+            if subresource not in self.known:
+                Preloader.prefetch(self.proxy_config, [subresource], self.headers)
+
+    def finish(self) -> None:
+        """Remember the subresources for the next requests of the page"""
+        Preloader.remember(self.proxy_config['id'], self.page_url, self.subresources)
+
+
+class Preloader:
+    """Announces and prefetches the subresources of rewritten pages
+
+    The stylesheets, scripts and images found while rewriting a page are
+    remembered per page. Later requests for the page announce them before
+    the upstream has answered, with 103 Early Hints where the server
+    supports it and with Link preload headers on the page itself. When the
+    proxy's response cache is enabled they are also prefetched into it,
+    with at most `concurrency` prefetches running at once, so the
+    browser's requests for them don't each wait on the upstream.
+    """
+
+    max_subresources: int = PRELOAD_MAX_SUBRESOURCES
+    concurrency: int = PRELOAD_CONCURRENCY
+    max_pages: int = PRELOAD_MAX_PAGES
+
+    _pages: "OrderedDict[Tuple[str, str], Tuple[Subresource, ...]]" = OrderedDict()
+    _inflight: Set[Tuple[str, str]] = set()
+    _tasks: Set[asyncio.Task] = set()
+    _slots: Optional[asyncio.Semaphore] = None
+
+    early_hints: int = 0
+    prefetched: int = 0
+    prefetch_errors: int = 0
+    skipped: int = 0
+
+    @classmethod
+    def page(cls, proxy_config: dict, page_url: str, request: Request) -> PagePreload:
+        """Start collecting the subresources of a page being rewritten"""
+        return PagePreload(proxy_config, page_url, cls.prefetch_headers(request, proxy_config))
+
+    @classmethod
+    def remember(cls, proxy_id: str, page_url: str, subresources: List[Subresource]) -> None:
+        key = (proxy_id, page_url)
+        if not subresources:
+            cls._pages.pop(key, None)
+            return
+        cls._pages[key] = tuple(subresources)
+        cls._pages.move_to_end(key)
+        while len(cls._pages) > cls.max_pages:
+            cls._pages.popitem(last=False)
+
+    @classmethod
+    def subresources(cls, proxy_id: str, page_url: str) -> Tuple[Subresource, ...]:
+        """Subresources remembered for a page"""
+        return cls._pages.get((proxy_id, page_url), ())
+
+    @staticmethod
+    def link_header(subresources: Tuple[Subresource, ...]) -> str:
+        """Format subresources as a Link header value"""
+        return ', '.join(f'<{url}>; rel=preload; as={destination}' for destination, url in subresources)
+
+    @classmethod
+    async def announce(cls, request: Request, proxy_config: dict, page_url: str,
+                       send: Optional[Send] = None) -> None:
+        """Start prefetching the known subresources of a page, and send Early Hints for them through send"""
+        subresources = cls.subresources(proxy_config['id'], page_url)
+        if not subresources:
+            return
+        cls._pages.move_to_end((proxy_config['id'], page_url))
+
+        if send is not None and EARLY_HINT_EXTENSION in request.scope.get('extensions', {}):
+            links = [f'<{url}>; rel=preload; as={destination}'.encode('latin-1') for destination, url in subresources]
+            await send({'type': EARLY_HINT_EXTENSION, 'links': links})
+            cls.early_hints += 1
+
+        cls.prefetch(proxy_config, subresources, cls.prefetch_headers(request, proxy_config))
+
+    @staticmethod
+    def prefetch_headers(request: Request, proxy_config: dict) -> RawHeaders:
+        """Upstream headers for prefetching the subresources of a page request"""
+        headers = proxy_request_headers(request.scope['headers'], proxy_config['target_url'].rstrip('/'),
+                                        proxy_config['id'])
+        return [(name, value) for name, value in headers if name not in PREFETCH_DROPPED_HEADERS]
+
+    @classmethod
+    def prefetch(cls, proxy_config: dict, subresources, headers: RawHeaders) -> None:
+        """Fetch subresources into the response cache in the background
+
+        Does nothing unless the proxy's response cache is enabled.
+        Subresources already being prefetched are skipped, as are all of
+        them when too many prefetches are queued.
+        """
+        if not proxy_config.get('cache_enabled'):
+            return
+        proxy_id = proxy_config['id']
+        prefix = f'/proxy/{proxy_id}'
+        target_url = proxy_config['target_url'].rstrip('/')
+        for _, url in subresources:
+            key = (proxy_id, url)
+            if key in cls._inflight:
+                continue
+            if len(cls._inflight) >= cls.concurrency * cls.max_subresources:
+                cls.skipped += 1
+                continue
+            cls._inflight.add(key)
+            task = asyncio.get_running_loop().create_task(
+                cls._prefetch(proxy_config, target_url + url[len(prefix):], headers, key)
+            )
+            cls._tasks.add(task)
+            task.add_done_callback(cls._tasks.discard)
+
+    @classmethod
+    async def _prefetch(cls, proxy_config: dict, url: str, headers: RawHeaders, key: Tuple[str, str]) -> None:
+        if cls._slots is None:
+            cls._slots = asyncio.Semaphore(cls.concurrency)
+        try:
+            async with cls._slots:
+                client = ClientPool.get_client(proxy_config)
+                request = client.build_request('GET', url, headers=headers)
+                send = partial(LoadBalancer.send, client, proxy_config)
+                response = await ResponseCache.fetch(send, request, proxy_config['id'])
+                try:
+                    if response.status_code == 200 and (
+                            int(response.headers.get('content-length', 0)) <= ResponseCache.max_object_bytes):
+                        # Reading the body to the end is what stores it
+                        async for _ in response.aiter_raw():
+                            pass
+                finally:
+                    await response.aclose()
+            cls.prefetched += 1
+        except Exception:
+            cls.prefetch_errors += 1
+        finally:
+            cls._inflight.discard(key)
+
+    @classmethod
+    def forget_proxy(cls, proxy_id: str) -> None:
+        """Drop the remembered pages of a changed or deleted proxy"""
+        for key in [k for k in cls._pages if k[0] == proxy_id]:
+            del cls._pages[key]
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        """Counters describing preloading"""
+        return {
+            'pages': len(cls._pages),
+            'prefetching': len(cls._inflight),
+            'early_hints': cls.early_hints,
+            'prefetched': cls.prefetched,
+            'prefetch_errors': cls.prefetch_errors,
+            'skipped': cls.skipped,
+        }
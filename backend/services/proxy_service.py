@@ -1,92 +1,185 @@
 """Proxy service for managing proxy configurations"""
-import json
-from pathlib import Path
-from typing import List, Optional
+import asyncio
+import threading
+from collections import Counter
+from typing import Dict, Hashable, List, Optional, Tuple
 
 from fastapi import HTTPException
 
-from ..config.settings import CONFIG_FILE
-from ..models.proxy import ProxyConfig, ProxyCreate, ProxyUpdate
+from ..config.settings import CONFIG_FILE, CONFIG_RELOAD_INTERVAL, PROXY_DATABASE_FILE, PROXY_STORE
+from ..models.proxy import ProxyCreate, ProxyUpdate
+from ..utils.rewrite import forget_rewrite_plan
+from .admission import AdmissionControl
+from .client_pool import ClientPool
+from .load_balancer import LoadBalancer
+from .metrics import Metrics
+from .preloader import Preloader
+from .proxy_store import ProxyStore, open_store
+from .response_cache import ResponseCache
+from .rewrite_cache import RewriteCache
 
 
 class ProxyService:
-    """Service for managing proxy configurations"""
-
-    @staticmethod
-    def load_proxies() -> List[dict]:
-        """Load proxy configurations from file"""
-        if CONFIG_FILE.exists():
+    """Service for managing proxy configurations
+
+    Configurations are kept in an in-memory registry indexed by id, backed
+    by a ProxyStore. The registry is updated on every write, and a
+    background task reloads it when the store's stamp changes, so edits
+    made by other processes (or by hand, with the JSON store) still apply.
+    Lookups only read the registry.
+    """
+
+    _store: Optional[ProxyStore] = None
+    _proxies: List[dict] = []
+    _registry: Dict[str, dict] = {}
+    _stamp: Optional[Hashable] = None
+    _lock = threading.Lock()
+    # Serialises reloads, so an older snapshot never replaces a newer one
+    _reload_lock = asyncio.Lock()
+    _task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def store(cls) -> ProxyStore:
+        """The configured store, opened on first use"""
+        if cls._store is None:
+            with cls._lock:
+                if cls._store is None:
+                    cls._store = open_store(PROXY_STORE, CONFIG_FILE, PROXY_DATABASE_FILE)
+        return cls._store
+
+    @classmethod
+    def load(cls) -> None:
+        """Open the store and load the registry (called at application startup, off the event loop)"""
+        cls._publish(*cls.store().snapshot())
+
+    @classmethod
+    def start(cls) -> None:
+        """Start watching the store for changes (called at application startup)"""
+        if cls._task is None:
+            cls._task = asyncio.get_running_loop().create_task(cls._watch())
+
+    @classmethod
+    async def stop(cls) -> None:
+        """Stop watching the store (called at application shutdown)"""
+        if cls._task is not None:
+            cls._task.cancel()
             try:
-                with open(CONFIG_FILE, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                # Invalid JSON format, return empty list
-                return []
-        return []
-
-    @staticmethod
-    def save_proxies(proxies: List[dict]) -> None:
-        """Save proxy configurations to file"""
-        CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(proxies, f, indent=2)
-
-    @staticmethod
-    def get_proxy_by_id(proxy_id: str) -> Optional[dict]:
+                await cls._task
+            except asyncio.CancelledError:
+                pass
+            cls._task = None
+
+    @classmethod
+    async def _watch(cls) -> None:
+        while True:
+            await asyncio.sleep(CONFIG_RELOAD_INTERVAL)
+            try:
+                await cls._refresh()
+            except Exception:
+                # Keep the current registry and try again on the next round
+                pass
+
+    @classmethod
+    async def _refresh(cls) -> None:
+        """Reload the registry if the store changed since the last check"""
+        store = cls.store()
+        async with cls._reload_lock:
+            stamp = await asyncio.to_thread(store.stamp)
+            if stamp != cls._stamp:
+                cls._publish(*await asyncio.to_thread(store.snapshot))
+
+    @classmethod
+    def _publish(cls, stamp: Optional[Hashable], proxies: List[dict]) -> None:
+        """Swap in a new registry and invalidate state of changed proxies"""
+        registry = {p['id']: p for p in proxies if 'id' in p}
+        previous = cls._registry
+
+        cls._proxies = proxies
+        cls._registry = registry
+        cls._stamp = stamp
+        LoadBalancer.watch(proxies)
+
+        for proxy_id, proxy in previous.items():
+            if registry.get(proxy_id) != proxy:
+                ClientPool.invalidate(proxy_id)
+                RewriteCache.invalidate_proxy(proxy_id)
+                forget_rewrite_plan(proxy_id)
+                Preloader.forget_proxy(proxy_id)
+                ResponseCache.invalidate_proxy(proxy_id)
+            if proxy_id not in registry:
+                AdmissionControl.forget_proxy(proxy_id)
+                LoadBalancer.forget_proxy(proxy_id)
+                Metrics.forget_proxy(proxy_id)
+
+    @classmethod
+    async def _reload(cls) -> None:
+        """Pick up a write made through the store"""
+        async with cls._reload_lock:
+            cls._publish(*await asyncio.to_thread(cls.store().snapshot))
+
+    @classmethod
+    def get_proxy_by_id(cls, proxy_id: str) -> Optional[dict]:
         """Get a specific proxy configuration by ID"""
-        proxies = ProxyService.load_proxies()
-        for proxy in proxies:
-            if proxy.get('id') == proxy_id:
-                return proxy
-        return None
+        return cls._registry.get(proxy_id)
 
-    @staticmethod
-    def get_all_proxies() -> List[dict]:
+    @classmethod
+    def get_all_proxies(cls) -> List[dict]:
         """Get all proxy configurations"""
-        return ProxyService.load_proxies()
+        return list(cls._proxies)
 
-    @staticmethod
-    def create_proxy(proxy_data: ProxyCreate) -> dict:
-        """Create a new proxy configuration"""
-        proxies = ProxyService.load_proxies()
+    @classmethod
+    async def list_proxies(cls, search: Optional[str] = None, enabled: Optional[bool] = None,
+                           offset: int = 0, limit: Optional[int] = None) -> Tuple[List[dict], int]:
+        """Get a page of proxy configurations and the total number matching the filters"""
+        return await asyncio.to_thread(cls.store().query, search=search, enabled=enabled, offset=offset, limit=limit)
 
-        # Generate ID from name if not provided
+    @staticmethod
+    def _new_proxy(proxy_data: ProxyCreate) -> dict:
         proxy_dict = proxy_data.model_dump()
+        # Generate ID from name if not provided
         if not proxy_dict.get('id'):
             proxy_dict['id'] = proxy_data.name.lower().replace(' ', '-')
+        return proxy_dict
 
-        # Check if ID already exists
-        if any(p['id'] == proxy_dict['id'] for p in proxies):
+    @classmethod
+    async def create_proxy(cls, proxy_data: ProxyCreate) -> dict:
+        """Create a new proxy configuration"""
+        proxy_dict = cls._new_proxy(proxy_data)
+        if not await asyncio.to_thread(cls.store().insert, proxy_dict):
             raise HTTPException(status_code=400, detail="Proxy ID already exists")
-
-        proxies.append(proxy_dict)
-        ProxyService.save_proxies(proxies)
+        await cls._reload()
         return proxy_dict
 
-    @staticmethod
-    def update_proxy(proxy_id: str, proxy_data: ProxyUpdate) -> dict:
+    @classmethod
+    async def update_proxy(cls, proxy_id: str, proxy_data: ProxyUpdate) -> dict:
         """Update an existing proxy configuration"""
-        proxies = ProxyService.load_proxies()
-
-        for i, proxy in enumerate(proxies):
-            if proxy['id'] == proxy_id:
-                # Update only provided fields
-                update_data = proxy_data.model_dump(exclude_unset=True)
-                proxies[i] = {**proxy, **update_data, 'id': proxy_id}
-                ProxyService.save_proxies(proxies)
-                return proxies[i]
-
-        raise HTTPException(status_code=404, detail="Proxy not found")
+        # Update only provided fields
+        proxy = await asyncio.to_thread(cls.store().update, proxy_id, proxy_data.model_dump(exclude_unset=True))
+        if proxy is None:
+            raise HTTPException(status_code=404, detail="Proxy not found")
+        await cls._reload()
+        return proxy
 
-    @staticmethod
-    def delete_proxy(proxy_id: str) -> bool:
+    @classmethod
+    async def delete_proxy(cls, proxy_id: str) -> bool:
         """Delete a proxy configuration"""
-        proxies = ProxyService.load_proxies()
-        initial_count = len(proxies)
-        proxies = [p for p in proxies if p['id'] != proxy_id]
-
-        if len(proxies) == initial_count:
+        if not await asyncio.to_thread(cls.store().delete, proxy_id):
             raise HTTPException(status_code=404, detail="Proxy not found")
-
-        ProxyService.save_proxies(proxies)
+        await cls._reload()
         return True
+
+    @classmethod
+    async def import_proxies(cls, proxies: List[ProxyCreate], replace: bool = False) -> Dict[str, int]:
+        """Create or overwrite many proxy configurations at once
+
+        The batch is applied in a single transaction. With replace, proxies
+        missing from the batch are deleted.
+        """
+        proxy_dicts = [cls._new_proxy(proxy) for proxy in proxies]
+        duplicates = sorted(proxy_id for proxy_id, n in Counter(p['id'] for p in proxy_dicts).items() if n > 1)
+        if duplicates:
+            raise HTTPException(status_code=400, detail=f"Duplicate proxy IDs in batch: {', '.join(duplicates)}")
+
+        counts = await asyncio.to_thread(cls.store().import_proxies, proxy_dicts, replace=replace)
+        await cls._reload()
+        return counts
@@ -0,0 +1,322 @@
+"""Storage backends for proxy configurations"""
+import fcntl
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+
+class ProxyStore(ABC):
+    """Persistent set of proxy configurations, kept in insertion order
+
+    Every write is atomic: it applies completely or not at all, and
+    concurrent writers (threads or processes) never lose each other's
+    updates.
+    """
+
+    @abstractmethod
+    def stamp(self) -> Optional[Hashable]:
+        """Identify the stored version; it changes with every write, from any process"""
+
+    @abstractmethod
+    def snapshot(self) -> Tuple[Optional[Hashable], List[dict]]:
+        """Return the current stamp together with every proxy"""
+
+    @abstractmethod
+    def insert(self, proxy: dict) -> bool:
+        """Add a proxy; returns False if its id is taken"""
+
+    @abstractmethod
+    def update(self, proxy_id: str, changes: dict) -> Optional[dict]:
+        """Merge changes into a proxy; returns the result, or None if it doesn't exist"""
+
+    @abstractmethod
+    def delete(self, proxy_id: str) -> bool:
+        """Remove a proxy; returns False if it doesn't exist"""
+
+    @abstractmethod
+    def import_proxies(self, proxies: List[dict], replace: bool = False) -> Dict[str, int]:
+        """Create or overwrite proxies in one transaction
+
+        With replace, proxies that are not in the list are deleted.
+        Returns the number of proxies created, updated and deleted.
+        """
+
+    @abstractmethod
+    def query(self, search: Optional[str] = None, enabled: Optional[bool] = None,
+              offset: int = 0, limit: Optional[int] = None) -> Tuple[List[dict], int]:
+        """Return a page of matching proxies and the total number of matches
+
+        search matches id, name or target URL case-insensitively.
+        """
+
+
+def matches(proxy: dict, search: Optional[str], enabled: Optional[bool]) -> bool:
+    """Whether a proxy passes the query filters"""
+    if enabled is not None and proxy.get('enabled', True) != enabled:
+        return False
+    if search:
+        needle = search.lower()
+        return any(needle in str(proxy.get(field) or '').lower() for field in ('id', 'name', 'target_url'))
+    return True
+
+
+class JsonProxyStore(ProxyStore):
+    """Proxies kept in a JSON file that can also be edited by hand
+
+    Writes hold an exclusive lock on a sidecar lock file while they read,
+    modify and atomically replace the file, so concurrent writers don't
+    overwrite each other and readers never see a partial file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock_path = path.with_name(path.name + '.lock')
+
+    def _read(self) -> List[dict]:
+        try:
+            with open(self.path, 'r') as f:
+                proxies = json.load(f)
+        except (OSError, ValueError):
+            # Missing file or invalid JSON
+            return []
+        return proxies if isinstance(proxies, list) else []
+
+    def _write(self, proxies: List[dict]) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(proxies, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @contextmanager
+    def _locked(self) -> Iterator[List[dict]]:
+        """Hold the write lock and yield the current proxies"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield self._read()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def stamp(self) -> Optional[Hashable]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def snapshot(self) -> Tuple[Optional[Hashable], List[dict]]:
+        # Stamp first: a write in between only causes one more reload
+        stamp = self.stamp()
+        return stamp, self._read()
+
+    def insert(self, proxy: dict) -> bool:
+        with self._locked() as proxies:
+            if any(p.get('id') == proxy['id'] for p in proxies):
+                return False
+            self._write(proxies + [proxy])
+        return True
+
+    def update(self, proxy_id: str, changes: dict) -> Optional[dict]:
+        with self._locked() as proxies:
+            for i, proxy in enumerate(proxies):
+                if proxy.get('id') == proxy_id:
+                    proxies[i] = {**proxy, **changes, 'id': proxy_id}
+                    self._write(proxies)
+                    return proxies[i]
+        return None
+
+    def delete(self, proxy_id: str) -> bool:
+        with self._locked() as proxies:
+            remaining = [p for p in proxies if p.get('id') != proxy_id]
+            if len(remaining) == len(proxies):
+                return False
+            self._write(remaining)
+        return True
+
+    def import_proxies(self, proxies: List[dict], replace: bool = False) -> Dict[str, int]:
+        incoming = {p['id']: p for p in proxies}
+        with self._locked() as current:
+            updated = len(incoming.keys() & {p.get('id') for p in current})
+            kept = [p for p in current if not replace or p.get('id') in incoming]
+            # Existing proxies are overwritten in place, new ones appended
+            merged = [incoming.pop(p.get('id'), p) for p in kept]
+            self._write(merged + list(incoming.values()))
+        return {'created': len(incoming), 'updated': updated, 'deleted': len(current) - len(kept)}
+
+    def query(self, search: Optional[str] = None, enabled: Optional[bool] = None,
+              offset: int = 0, limit: Optional[int] = None) -> Tuple[List[dict], int]:
+        found = [p for p in self._read() if matches(p, search, enabled)]
+        end = None if limit is None else offset + limit
+        return found[offset:end], len(found)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS proxies (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    target_url TEXT NOT NULL,
+    enabled INTEGER NOT NULL,
+    config TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS proxies_enabled ON proxies (enabled, seq);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+"""
+
+
+class SqliteProxyStore(ProxyStore):
+    """Proxies kept in an SQLite database in WAL mode
+
+    Each proxy is one row holding its JSON document plus indexed copies of
+    the fields used for filtering. Every write runs in an immediate
+    transaction that also bumps a generation counter, which is what other
+    processes compare to notice changes.
+
+    A JSON config file found next to the database at startup is imported
+    into it, merging by id, and renamed to <name>.imported, so existing
+    installations migrate on their own and a new proxies.json dropped in
+    applies on the next start.
+    """
+
+    def __init__(self, path: Path, json_file: Optional[Path] = None):
+        self.path = path
+        self.json_file = json_file
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode; transactions are opened explicitly
+        self._db = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        # Wait for other processes' transactions instead of failing
+        self._db.execute('PRAGMA busy_timeout=5000')
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._import_json_file()
+
+    @contextmanager
+    def _transaction(self, write: bool = False) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+            try:
+                yield self._db
+                if write:
+                    self._db.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    @staticmethod
+    def _row(proxy: dict) -> tuple:
+        return (proxy['id'], proxy.get('name') or proxy['id'], proxy.get('target_url') or '',
+                int(bool(proxy.get('enabled', True))), json.dumps(proxy))
+
+    @staticmethod
+    def _upsert(db: sqlite3.Connection, proxy: dict) -> None:
+        db.execute(
+            "INSERT INTO proxies (id, name, target_url, enabled, config) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET name = excluded.name, target_url = excluded.target_url, "
+            "enabled = excluded.enabled, config = excluded.config",
+            SqliteProxyStore._row(proxy),
+        )
+
+    def _import_json_file(self) -> None:
+        if self.json_file is None or not self.json_file.exists():
+            return
+        proxies = [p for p in JsonProxyStore(self.json_file)._read() if isinstance(p, dict) and p.get('id')]
+        self.import_proxies(proxies)
+        try:
+            os.replace(self.json_file, self.json_file.with_name(self.json_file.name + '.imported'))
+        except FileNotFoundError:
+            # Another process imported it at the same time
+            pass
+
+    def stamp(self) -> Optional[Hashable]:
+        with self._lock:
+            return self._db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def snapshot(self) -> Tuple[Optional[Hashable], List[dict]]:
+        with self._transaction() as db:
+            stamp = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+            proxies = [json.loads(config) for config, in db.execute('SELECT config FROM proxies ORDER BY seq')]
+        return stamp, proxies
+
+    def insert(self, proxy: dict) -> bool:
+        try:
+            with self._transaction(write=True) as db:
+                db.execute('INSERT INTO proxies (id, name, target_url, enabled, config) VALUES (?, ?, ?, ?, ?)',
+                           self._row(proxy))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def update(self, proxy_id: str, changes: dict) -> Optional[dict]:
+        with self._transaction(write=True) as db:
+            row = db.execute('SELECT config FROM proxies WHERE id = ?', (proxy_id,)).fetchone()
+            if row is None:
+                return None
+            proxy = {**json.loads(row[0]), **changes, 'id': proxy_id}
+            self._upsert(db, proxy)
+        return proxy
+
+    def delete(self, proxy_id: str) -> bool:
+        with self._transaction(write=True) as db:
+            return db.execute('DELETE FROM proxies WHERE id = ?', (proxy_id,)).rowcount > 0
+
+    def import_proxies(self, proxies: List[dict], replace: bool = False) -> Dict[str, int]:
+        ids = [p['id'] for p in proxies]
+        with self._transaction(write=True) as db:
+            existing = {proxy_id for proxy_id, in db.execute('SELECT id FROM proxies')}
+            deleted = 0
+            if replace:
+                stale = [(proxy_id,) for proxy_id in existing.difference(ids)]
+                db.executemany('DELETE FROM proxies WHERE id = ?', stale)
+                deleted = len(stale)
+            for proxy in proxies:
+                self._upsert(db, proxy)
+        updated = len(existing.intersection(ids))
+        return {'created': len(set(ids)) - updated, 'updated': updated, 'deleted': deleted}
+
+    def query(self, search: Optional[str] = None, enabled: Optional[bool] = None,
+              offset: int = 0, limit: Optional[int] = None) -> Tuple[List[dict], int]:
+        where, params = [], []
+        if enabled is not None:
+            where.append('enabled = ?')
+            params.append(int(enabled))
+        if search:
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            where.append("(id LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\' OR target_url LIKE ? ESCAPE '\\')")
+            params.extend([pattern] * 3)
+        clause = f" WHERE {' AND '.join(where)}" if where else ''
+
+        with self._transaction() as db:
+            total = db.execute(f'SELECT COUNT(*) FROM proxies{clause}', params).fetchone()[0]
+            rows = db.execute(f'SELECT config FROM proxies{clause} ORDER BY seq LIMIT ? OFFSET ?',
+                              [*params, -1 if limit is None else limit, offset])
+            proxies = [json.loads(config) for config, in rows]
+        return proxies, total
+
+
+def open_store(backend: str, config_file: Path, database_file: Path) -> ProxyStore:
+    """Create the configured store ("sqlite" or "json")"""
+    if backend == 'json':
+        return JsonProxyStore(config_file)
+    if backend == 'sqlite':
+        return SqliteProxyStore(database_file, json_file=config_file)
+    raise ValueError(f"Unknown proxy store '{backend}'")
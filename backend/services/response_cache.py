@@ -0,0 +1,615 @@
+"""Shared HTTP cache for upstream responses, following RFC 9111 semantics"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+import aiofiles
+import aiofiles.os
+import httpx
+
+from ..config.settings import (
+    RESPONSE_CACHE_DIR,
+    RESPONSE_CACHE_DISK_BYTES,
+    RESPONSE_CACHE_MAX_OBJECT_BYTES,
+    RESPONSE_CACHE_MEMORY_BYTES,
+    WORKERS,
+)
+from ..utils.headers import (
+    byte_range_bounds,
+    etag_matches,
+    if_range_matches,
+    parse_byte_range,
+    parse_cache_control,
+)
+
+# Status codes a shared cache may store (RFC 9110 section 15.1, subset)
+CACHEABLE_STATUS_CODES = frozenset([200, 203, 301, 404, 410])
+
+# Headers that are not stored with a cached response
+UNSTORED_HEADERS = frozenset([
+    'age', 'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade',
+])
+
+# Headers from a 304 that must not replace the stored ones
+NOT_MODIFIED_IGNORED_HEADERS = frozenset(['content-length', 'content-encoding', 'transfer-encoding'])
+
+# Headers left out of a 304 served from a stored response: they describe
+# a body that isn't sent (RFC 9110 section 15.4.5)
+NOT_MODIFIED_OMITTED_HEADERS = frozenset([
+    'content-length', 'content-encoding', 'content-type', 'content-language', 'content-range',
+    'transfer-encoding',
+])
+
+# Headers replaced when a range of a stored body is served
+PARTIAL_REPLACED_HEADERS = frozenset(['content-length', 'content-range', 'accept-ranges'])
+
+# Suffix of proxy directories set aside to be deleted
+DELETED_DIR_SUFFIX = '.deleted'
+
+# Upper bound for heuristic freshness (RFC 9111 section 4.2.2)
+MAX_HEURISTIC_LIFETIME = 24 * 60 * 60
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    """Parse an HTTP date header into a timestamp"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _hash(value: str) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    """A stored upstream response; the body is kept exactly as received"""
+    key: str
+    proxy_id: str
+    url: str
+    status_code: int
+    headers: List[Tuple[str, str]]
+    stored_at: float
+    body: bytes = b''
+
+    def header(self, name: str) -> Optional[str]:
+        for key, value in self.headers:
+            if key == name:
+                return value
+        return None
+
+    def age(self, now: float) -> float:
+        return max(0.0, now - self.stored_at)
+
+    def freshness_lifetime(self) -> float:
+        """How long the response is fresh, from explicit or heuristic expiry"""
+        cache_control = parse_cache_control(self.header('cache-control'))
+        for directive in ('s-maxage', 'max-age'):
+            if directive in cache_control:
+                try:
+                    return float(cache_control[directive])
+                except (TypeError, ValueError):
+                    return 0.0
+
+        date = _parse_http_date(self.header('date')) or self.stored_at
+        expires = self.header('expires')
+        if expires is not None:
+            expires_at = _parse_http_date(expires)
+            return max(0.0, expires_at - date) if expires_at else 0.0
+
+        last_modified = _parse_http_date(self.header('last-modified'))
+        if last_modified is not None:
+            return min(MAX_HEURISTIC_LIFETIME, max(0.0, (date - last_modified) / 10))
+        return 0.0
+
+    def is_fresh(self, request_cache_control: Mapping[str, Optional[str]]) -> bool:
+        """Whether the entry can be served without revalidation"""
+        response_cache_control = parse_cache_control(self.header('cache-control'))
+        if 'no-cache' in response_cache_control or 'no-cache' in request_cache_control:
+            return False
+
+        lifetime = self.freshness_lifetime()
+        if 'max-age' in request_cache_control:
+            try:
+                lifetime = min(lifetime, float(request_cache_control['max-age']))
+            except (TypeError, ValueError):
+                pass
+        return self.age(time.time()) < lifetime
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Validators to revalidate the entry with the upstream"""
+        headers = {}
+        etag = self.header('etag')
+        if etag:
+            headers['if-none-match'] = etag
+        last_modified = self.header('last-modified')
+        if last_modified:
+            headers['if-modified-since'] = last_modified
+        return headers
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Whether a client's If-None-Match matches this entry (weak comparison)"""
+        return etag_matches(if_none_match, self.header('etag'))
+
+    def to_response(self, request: httpx.Request, if_none_match: Optional[str] = None,
+                    byte_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+                    if_range: Optional[str] = None) -> httpx.Response:
+        """Build an httpx response serving this entry, or the requested range of it"""
+        headers = list(self.headers) + [('age', str(int(self.age(time.time()))))]
+        if self.matches(if_none_match):
+            headers = [(k, v) for k, v in headers if k not in NOT_MODIFIED_OMITTED_HEADERS]
+            return httpx.Response(304, headers=headers, stream=httpx.ByteStream(b''), request=request)
+        if (byte_range is not None and self.status_code == 200
+                and if_range_matches(if_range, self.header('etag'), self.header('last-modified'))):
+            return self._partial_response(request, headers, byte_range)
+        return httpx.Response(self.status_code, headers=headers,
+                              stream=httpx.ByteStream(self.body), request=request)
+
+    def _partial_response(self, request: httpx.Request, headers: List[Tuple[str, str]],
+                          byte_range: Tuple[Optional[int], Optional[int]]) -> httpx.Response:
+        size = len(self.body)
+        bounds = byte_range_bounds(byte_range, size)
+        if bounds is None:
+            return httpx.Response(416, headers=[('content-range', f'bytes */{size}'), ('content-length', '0')],
+                                  stream=httpx.ByteStream(b''), request=request)
+        start, end = bounds
+        body = self.body[start:end + 1]
+        headers = [(k, v) for k, v in headers if k not in PARTIAL_REPLACED_HEADERS] + [
+            ('accept-ranges', 'bytes'),
+            ('content-range', f'bytes {start}-{end}/{size}'),
+            ('content-length', str(len(body))),
+        ]
+        return httpx.Response(206, headers=headers, stream=httpx.ByteStream(body), request=request)
+
+    def meta(self, vary: Dict[str, str]) -> dict:
+        return {
+            'proxy_id': self.proxy_id,
+            'url': self.url,
+            'status_code': self.status_code,
+            'headers': self.headers,
+            'stored_at': self.stored_at,
+            'vary': vary,
+        }
+
+
+class _CaptureStream(httpx.AsyncByteStream):
+    """Relays an upstream body while keeping a copy to store once it completes"""
+
+    def __init__(self, response: httpx.Response, on_complete, limit: int):
+        self._response = response
+        self._on_complete = on_complete
+        self._limit = limit
+
+    async def __aiter__(self):
+        chunks = []
+        size = 0
+        async for chunk in self._response.aiter_raw():
+            if chunks is not None:
+                size += len(chunk)
+                if size > self._limit:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            self._on_complete(b''.join(chunks))
+
+    async def aclose(self) -> None:
+        await self._response.aclose()
+
+
+class ResponseCache:
+    """Two-tier (memory + disk) shared cache in front of upstream requests
+
+    Only GET responses that are explicitly cacheable, or carry validators
+    for revalidation, are stored. Stale entries are revalidated with
+    If-None-Match/If-Modified-Since, and Vary is honoured by keying each
+    variant on the request headers the upstream listed.
+
+    With several server workers the disk tier is shared: a miss in this
+    worker's index also looks for a file written by another worker.
+    """
+
+    memory_bytes: int = RESPONSE_CACHE_MEMORY_BYTES
+    disk_bytes: int = RESPONSE_CACHE_DISK_BYTES
+    max_object_bytes: int = RESPONSE_CACHE_MAX_OBJECT_BYTES
+    directory: Path = RESPONSE_CACHE_DIR
+    shared: bool = WORKERS > 1
+
+    _memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+    _memory_size: int = 0
+    _disk: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+    _disk_size: int = 0
+    _vary: Dict[Tuple[str, str], Tuple[str, ...]] = {}
+    _tasks: Set[asyncio.Task] = set()
+
+    hits: int = 0
+    misses: int = 0
+    revalidations: int = 0
+    stores: int = 0
+
+    @staticmethod
+    def _proxy_dir_name(proxy_id: str) -> str:
+        return _hash(proxy_id)[:16]
+
+    @classmethod
+    def _variant(cls, proxy_id: str, url: str, headers: Mapping[str, str]) -> Tuple[str, Dict[str, str]]:
+        """Key of the variant selected by the request headers"""
+        names = cls._vary.get((proxy_id, url), ())
+        vary = {name: headers.get(name, '') for name in names}
+        parts = [proxy_id, url] + [f'{name}:{value}' for name, value in vary.items()]
+        return _hash('\n'.join(parts)), vary
+
+    @classmethod
+    async def load_disk_index(cls) -> None:
+        """Index cached files on disk (called at startup)"""
+        def scan():
+            entries = []
+            vary = {}
+            if not cls.directory.exists():
+                return entries, vary
+            for proxy_dir in cls.directory.iterdir():
+                if not proxy_dir.is_dir():
+                    continue
+                if proxy_dir.suffix == DELETED_DIR_SUFFIX:
+                    # Left over from an invalidation interrupted by a restart
+                    shutil.rmtree(proxy_dir, ignore_errors=True)
+                    continue
+                for path in proxy_dir.iterdir():
+                    try:
+                        if path.suffix == '.meta':
+                            body = path.with_suffix('.body')
+                            size = path.stat().st_size + body.stat().st_size
+                            entries.append((path.stat().st_mtime, path.stem, proxy_dir.name, size))
+                        elif path.suffix == '.vary':
+                            spec = json.loads(path.read_text())
+                            vary[(spec['proxy_id'], spec['url'])] = tuple(spec['names'])
+                    except (OSError, ValueError, KeyError):
+                        continue
+            return entries, vary
+
+        entries, vary = await asyncio.to_thread(scan)
+        cls._vary.update(vary)
+        for _, key, dir_name, size in sorted(entries):
+            cls._disk[key] = (dir_name, size)
+            cls._disk_size += size
+
+    @classmethod
+    async def lookup(cls, proxy_id: str, url: str, headers: Mapping[str, str]) -> Optional[CacheEntry]:
+        """Find the stored variant for a request in memory, then on disk"""
+        key, _ = cls._variant(proxy_id, url, headers)
+
+        entry = cls._memory.get(key)
+        if entry is not None:
+            cls._memory.move_to_end(key)
+            return entry
+
+        location = cls._disk.get(key)
+        if location is None and cls.shared:
+            key, location = await cls._adopt(proxy_id, url, headers)
+        if location is None:
+            return None
+
+        base = cls.directory / location[0] / key
+        try:
+            async with aiofiles.open(base.with_suffix('.meta'), 'r') as f:
+                meta = json.loads(await f.read())
+            async with aiofiles.open(base.with_suffix('.body'), 'rb') as f:
+                body = await f.read()
+        except (OSError, ValueError):
+            cls._forget_disk(key)
+            return None
+
+        cls._disk.move_to_end(key)
+        entry = CacheEntry(
+            key=key,
+            proxy_id=meta['proxy_id'],
+            url=meta['url'],
+            status_code=meta['status_code'],
+            headers=[tuple(h) for h in meta['headers']],
+            stored_at=meta['stored_at'],
+            body=body,
+        )
+        cls._remember(entry)
+        return entry
+
+    @classmethod
+    async def _adopt(cls, proxy_id: str, url: str,
+                     headers: Mapping[str, str]) -> Tuple[str, Optional[Tuple[str, int]]]:
+        """Index a variant that another worker wrote to the disk tier
+
+        Returns the variant key and its disk location, if the files exist.
+        """
+        dir_name = cls._proxy_dir_name(proxy_id)
+        directory = cls.directory / dir_name
+        if (proxy_id, url) not in cls._vary:
+            # The Vary names decide the key, and are written next to the entries
+            try:
+                async with aiofiles.open(directory / (_hash(f'{proxy_id}\n{url}') + '.vary'), 'r') as f:
+                    cls._vary[(proxy_id, url)] = tuple(json.loads(await f.read())['names'])
+            except (OSError, ValueError, KeyError):
+                return cls._variant(proxy_id, url, headers)[0], None
+
+        key, _ = cls._variant(proxy_id, url, headers)
+        if key in cls._disk:
+            return key, cls._disk[key]
+        base = directory / key
+        try:
+            size = ((await aiofiles.os.stat(base.with_suffix('.meta'))).st_size
+                    + (await aiofiles.os.stat(base.with_suffix('.body'))).st_size)
+        except OSError:
+            return key, None
+
+        cls._disk[key] = (dir_name, size)
+        cls._disk_size += size
+        cls._trim_disk()
+        return key, cls._disk.get(key)
+
+    @classmethod
+    async def fetch(cls, send: Callable[[httpx.Request], Awaitable[httpx.Response]],
+                    request: httpx.Request, proxy_id: str) -> httpx.Response:
+        """Send a request upstream, answering or revalidating from the cache
+
+        Args:
+            send: Sends a request upstream and returns the streamed response
+        """
+        request_cache_control = parse_cache_control(request.headers.get('cache-control'))
+        if request.method != 'GET' or 'no-store' in request_cache_control:
+            return await send(request)
+
+        byte_range = None
+        if 'range' in request.headers:
+            byte_range = parse_byte_range(request.headers['range'])
+            if byte_range is None:
+                # Several or malformed ranges: leave them to the upstream
+                return await send(request)
+
+        url = str(request.url)
+        if_none_match = request.headers.get('if-none-match')
+        entry = await cls.lookup(proxy_id, url, request.headers)
+
+        if byte_range is not None:
+            # Ranges are cut from a fresh full copy; partial responses are never stored
+            if entry is not None and entry.status_code == 200 and entry.is_fresh(request_cache_control):
+                cls.hits += 1
+                return entry.to_response(request, if_none_match, byte_range, request.headers.get('if-range'))
+            return await send(request)
+
+        if entry is not None:
+            if entry.is_fresh(request_cache_control):
+                cls.hits += 1
+                return entry.to_response(request, if_none_match)
+
+            # Revalidate our copy instead of the client's
+            validators = entry.conditional_headers()
+            if validators:
+                for name in ('if-none-match', 'if-modified-since'):
+                    request.headers.pop(name, None)
+                request.headers.update(validators)
+
+        response = await send(request)
+
+        if entry is not None and response.status_code == 304:
+            await response.aclose()
+            cls.revalidations += 1
+            entry = cls._refresh_entry(entry, response)
+            return entry.to_response(request, if_none_match)
+
+        cls.misses += 1
+        if not cls._is_storable(request, response):
+            return response
+
+        def store(body: bytes):
+            cls._spawn(cls._store(proxy_id, url, request, response, body))
+
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_CaptureStream(response, store, cls.max_object_bytes),
+            request=request,
+            extensions=response.extensions,
+        )
+
+    @classmethod
+    def _is_storable(cls, request: httpx.Request, response: httpx.Response) -> bool:
+        """Whether a shared cache may store this response"""
+        if response.status_code not in CACHEABLE_STATUS_CODES:
+            return False
+        if 'set-cookie' in response.headers or response.headers.get('vary', '').strip() == '*':
+            return False
+
+        cache_control = parse_cache_control(response.headers.get('cache-control'))
+        if 'no-store' in cache_control or 'private' in cache_control:
+            return False
+        if 'authorization' in request.headers and not (
+                {'public', 's-maxage', 'must-revalidate'} & cache_control.keys()):
+            return False
+
+        explicit = ('max-age' in cache_control or 's-maxage' in cache_control
+                    or 'expires' in response.headers)
+        validators = 'etag' in response.headers or 'last-modified' in response.headers
+        if not explicit and not validators:
+            return False
+
+        try:
+            length = int(response.headers.get('content-length', 0))
+        except ValueError:
+            return False
+        return length <= cls.max_object_bytes
+
+    @classmethod
+    async def _store(cls, proxy_id: str, url: str, request: httpx.Request,
+                     response: httpx.Response, body: bytes) -> None:
+        """Store a completed response in memory and on disk"""
+        vary_names = tuple(sorted(
+            name.strip().lower() for name in response.headers.get('vary', '').split(',') if name.strip()
+        ))
+        cls._vary[(proxy_id, url)] = vary_names
+        key, vary = cls._variant(proxy_id, url, request.headers)
+
+        try:
+            initial_age = float(response.headers.get('age', 0))
+        except ValueError:
+            initial_age = 0.0
+
+        entry = CacheEntry(
+            key=key,
+            proxy_id=proxy_id,
+            url=url,
+            status_code=response.status_code,
+            headers=[(k, v) for k, v in response.headers.multi_items() if k not in UNSTORED_HEADERS],
+            stored_at=time.time() - initial_age,
+            body=body,
+        )
+        cls.stores += 1
+        cls._remember(entry)
+        await cls._write(entry, vary, vary_names)
+
+    @classmethod
+    def _refresh_entry(cls, entry: CacheEntry, not_modified: httpx.Response) -> CacheEntry:
+        """Update a stored entry with the headers of a 304 response"""
+        updated = {k for k, _ in not_modified.headers.multi_items()
+                   if k not in UNSTORED_HEADERS and k not in NOT_MODIFIED_IGNORED_HEADERS}
+        headers = [(k, v) for k, v in entry.headers if k not in updated]
+        headers += [(k, v) for k, v in not_modified.headers.multi_items() if k in updated]
+
+        refreshed = CacheEntry(
+            key=entry.key,
+            proxy_id=entry.proxy_id,
+            url=entry.url,
+            status_code=entry.status_code,
+            headers=headers,
+            stored_at=time.time(),
+            body=entry.body,
+        )
+        cls._remember(refreshed)
+        _, vary = cls._variant(entry.proxy_id, entry.url, not_modified.request.headers)
+        cls._spawn(cls._write(refreshed, vary, cls._vary.get((entry.proxy_id, entry.url), ())))
+        return refreshed
+
+    @classmethod
+    def _remember(cls, entry: CacheEntry) -> None:
+        """Keep an entry in the memory tier if it fits"""
+        size = len(entry.body)
+        if size > cls.memory_bytes // 8:
+            return
+        previous = cls._memory.pop(entry.key, None)
+        if previous is not None:
+            cls._memory_size -= len(previous.body)
+        cls._memory[entry.key] = entry
+        cls._memory_size += size
+        while cls._memory_size > cls.memory_bytes:
+            _, evicted = cls._memory.popitem(last=False)
+            cls._memory_size -= len(evicted.body)
+
+    @classmethod
+    async def _write(cls, entry: CacheEntry, vary: Dict[str, str], vary_names: Tuple[str, ...]) -> None:
+        """Write an entry to the disk tier, replacing files atomically"""
+        if not cls.disk_bytes:
+            return
+
+        dir_name = cls._proxy_dir_name(entry.proxy_id)
+        directory = cls.directory / dir_name
+        base = directory / entry.key
+        suffix = uuid.uuid4().hex
+        try:
+            await aiofiles.os.makedirs(directory, exist_ok=True)
+            files = [
+                (base.with_suffix('.body'), entry.body),
+                (base.with_suffix('.meta'), json.dumps(entry.meta(vary)).encode('utf-8')),
+                (directory / (_hash(f'{entry.proxy_id}\n{entry.url}') + '.vary'),
+                 json.dumps({'proxy_id': entry.proxy_id, 'url': entry.url, 'names': vary_names}).encode('utf-8')),
+            ]
+            for path, data in files:
+                temp = path.with_name(f'{path.name}.{suffix}.tmp')
+                async with aiofiles.open(temp, 'wb') as f:
+                    await f.write(data)
+                await aiofiles.os.replace(temp, path)
+        except OSError:
+            return
+
+        size = len(entry.body) + len(files[1][1])
+        previous = cls._disk.pop(entry.key, None)
+        if previous is not None:
+            cls._disk_size -= previous[1]
+        cls._disk[entry.key] = (dir_name, size)
+        cls._disk_size += size
+        cls._trim_disk()
+
+    @classmethod
+    def _trim_disk(cls) -> None:
+        """Evict the least recently used disk entries until the tier fits its budget"""
+        while cls._disk_size > cls.disk_bytes and cls._disk:
+            key, _ = next(iter(cls._disk.items()))
+            cls._forget_disk(key)
+
+    @classmethod
+    def _forget_disk(cls, key: str) -> None:
+        """Remove an entry from the disk tier"""
+        location = cls._disk.pop(key, None)
+        if location is None:
+            return
+        cls._disk_size -= location[1]
+        base = cls.directory / location[0] / key
+        for suffix in ('.meta', '.body'):
+            try:
+                os.unlink(base.with_suffix(suffix))
+            except OSError:
+                pass
+
+    @classmethod
+    def _spawn(cls, coro) -> None:
+        """Run a cache write in the background, keeping a reference to it"""
+        task = asyncio.get_running_loop().create_task(coro)
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+
+    @classmethod
+    def invalidate_proxy(cls, proxy_id: str) -> None:
+        """Drop every cached response of a proxy"""
+        for key in [k for k, e in cls._memory.items() if e.proxy_id == proxy_id]:
+            cls._memory_size -= len(cls._memory.pop(key).body)
+        for vary_key in [k for k in cls._vary if k[0] == proxy_id]:
+            del cls._vary[vary_key]
+
+        dir_name = cls._proxy_dir_name(proxy_id)
+        for key in [k for k, (d, _) in cls._disk.items() if d == dir_name]:
+            cls._disk_size -= cls._disk.pop(key)[1]
+
+        # Called on the request path when a proxy changes, so the directory
+        # is only renamed here and deleted in a background thread
+        deleted = cls.directory / f'{dir_name}.{uuid.uuid4().hex}{DELETED_DIR_SUFFIX}'
+        try:
+            os.rename(cls.directory / dir_name, deleted)
+        except OSError:
+            return
+        threading.Thread(target=shutil.rmtree, args=(deleted,), kwargs={'ignore_errors': True},
+                         name='response-cache-cleanup', daemon=True).start()
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Counters describing cache usage"""
+        return {
+            'memory_entries': len(cls._memory),
+            'memory_bytes': cls._memory_size,
+            'disk_entries': len(cls._disk),
+            'disk_bytes': cls._disk_size,
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'revalidations': cls.revalidations,
+            'stores': cls.stores,
+        }
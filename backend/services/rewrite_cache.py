@@ -0,0 +1,143 @@
+"""Bounded LRU cache for rewritten HTML/CSS output"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Mapping, Optional, Tuple
+
+from ..config.settings import REWRITE_CACHE_MAX_BYTES, REWRITE_CACHE_MAX_ENTRY_BYTES
+from ..utils.headers import parse_cache_control
+
+CacheKey = Tuple[str, str, str]
+
+
+class RewriteCacheEntry:
+    """Rewritten body plus any compressed variants produced for it"""
+
+    __slots__ = ('body', 'variants')
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.variants: Dict[str, bytes] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(v) for v in self.variants.values())
+
+
+class RewriteCache:
+    """Size-aware LRU of rewrite results
+
+    Entries are keyed by (proxy_id, url, validator) where the validator is the
+    upstream ETag plus the request headers named in Vary or, failing that, a
+    hash of the upstream body. Responses to credentialed requests and private
+    responses are not cached. Eviction is by total stored bytes, including
+    compressed variants.
+    """
+
+    max_bytes: int = REWRITE_CACHE_MAX_BYTES
+    max_entry_bytes: int = REWRITE_CACHE_MAX_ENTRY_BYTES
+
+    _entries: "OrderedDict[CacheKey, RewriteCacheEntry]" = OrderedDict()
+    _size: int = 0
+    _lock = threading.Lock()
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @staticmethod
+    def cacheable(request_headers: Mapping[str, str], response_headers: Mapping[str, str]) -> bool:
+        """Whether the rewrite of a response may be kept and served to anyone"""
+        if 'cookie' in request_headers or 'authorization' in request_headers:
+            return False
+        if 'set-cookie' in response_headers or response_headers.get('vary', '').strip() == '*':
+            return False
+        cache_control = parse_cache_control(response_headers.get('cache-control'))
+        return 'no-store' not in cache_control and 'private' not in cache_control
+
+    @staticmethod
+    def validator_key(proxy_id: str, url: str, request_headers: Mapping[str, str],
+                      response_headers: Mapping[str, str]) -> Optional[CacheKey]:
+        """Build a key from the upstream ETag, or None if there is none
+
+        Last-Modified alone is too coarse: a page can change twice within a second.
+        """
+        etag = response_headers.get('etag')
+        if not etag:
+            return None
+        names = sorted(name.strip().lower() for name in response_headers.get('vary', '').split(',') if name.strip())
+        validator = '\n'.join([etag] + [f'{name}:{request_headers.get(name, "")}' for name in names])
+        return (proxy_id, url, validator)
+
+    @staticmethod
+    def content_key(proxy_id: str, url: str, content: bytes) -> CacheKey:
+        """Build a key from a hash of the upstream body"""
+        return (proxy_id, url, 'sha256:' + hashlib.sha256(content).hexdigest())
+
+    @classmethod
+    def get(cls, key: CacheKey) -> Optional[RewriteCacheEntry]:
+        """Return a cached rewrite result and mark it recently used"""
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is None:
+                cls.misses += 1
+                return None
+            cls._entries.move_to_end(key)
+            cls.hits += 1
+            return entry
+
+    @classmethod
+    def put(cls, key: CacheKey, body: bytes) -> RewriteCacheEntry:
+        """Store a rewrite result, evicting least recently used entries
+
+        The returned entry is not cached when it exceeds the entry size limit.
+        """
+        entry = RewriteCacheEntry(body)
+        if not cls.max_bytes or len(body) > cls.max_entry_bytes:
+            return entry
+
+        with cls._lock:
+            previous = cls._entries.pop(key, None)
+            if previous is not None:
+                cls._size -= previous.size
+            cls._entries[key] = entry
+            cls._size += entry.size
+            cls._evict()
+        return entry
+
+    @classmethod
+    def add_variant(cls, key: CacheKey, entry: RewriteCacheEntry, encoding: str, data: bytes) -> None:
+        """Attach a compressed variant to an entry, accounting for its size"""
+        with cls._lock:
+            if encoding in entry.variants:
+                return
+            entry.variants[encoding] = data
+            if cls._entries.get(key) is entry:
+                cls._size += len(data)
+                cls._evict()
+
+    @classmethod
+    def _evict(cls) -> None:
+        while cls._size > cls.max_bytes:
+            _, evicted = cls._entries.popitem(last=False)
+            cls._size -= evicted.size
+            cls.evictions += 1
+
+    @classmethod
+    def invalidate_proxy(cls, proxy_id: str) -> None:
+        """Drop every entry belonging to a proxy"""
+        with cls._lock:
+            for key in [k for k in cls._entries if k[0] == proxy_id]:
+                cls._size -= cls._entries.pop(key).size
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Counters describing cache usage"""
+        return {
+            'entries': len(cls._entries),
+            'bytes': cls._size,
+            'max_bytes': cls.max_bytes,
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'evictions': cls.evictions,
+        }
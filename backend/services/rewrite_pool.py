@@ -0,0 +1,88 @@
+"""Worker pool that keeps CPU-bound rewriting off the event loop"""
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from ..config.settings import (
+    REWRITE_OFFLOAD_THRESHOLD,
+    REWRITE_POOL_MAX_QUEUE,
+    REWRITE_POOL_MODE,
+    REWRITE_POOL_WORKERS,
+    WORKERS,
+)
+
+T = TypeVar('T')
+
+
+class RewritePoolSaturated(Exception):
+    """Raised when the rewrite queue is full and the caller should pass content through"""
+
+
+class RewritePool:
+    """Dispatches large rewrites to a thread or process pool
+
+    Small bodies are rewritten inline since dispatch would cost more than
+    the rewrite itself. At most REWRITE_POOL_MAX_QUEUE rewrites may be
+    pending at once; beyond that RewritePoolSaturated is raised.
+    """
+
+    threshold: int = REWRITE_OFFLOAD_THRESHOLD
+    max_queue: int = REWRITE_POOL_MAX_QUEUE
+
+    _executor: Optional[Executor] = None
+    _pending: int = 0
+
+    inline: int = 0
+    offloaded: int = 0
+    rejected: int = 0
+
+    @classmethod
+    def start(cls) -> None:
+        """Create the worker pool (called at application startup)"""
+        if cls._executor is not None:
+            return
+        # Server workers each have a pool, so they split the cores between them
+        workers = REWRITE_POOL_WORKERS or max(1, min(4, (os.cpu_count() or 1) // WORKERS))
+        if REWRITE_POOL_MODE == 'process':
+            cls._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            cls._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rewrite')
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Stop the worker pool (called at application shutdown)"""
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
+
+    @classmethod
+    async def run(cls, func: Callable[..., T], *args, size: int) -> T:
+        """Run a rewrite function, offloading it when the input is large"""
+        if cls._executor is None or size < cls.threshold:
+            cls.inline += 1
+            return func(*args)
+
+        if cls._pending >= cls.max_queue:
+            cls.rejected += 1
+            raise RewritePoolSaturated()
+
+        cls._pending += 1
+        cls.offloaded += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(cls._executor, func, *args)
+        finally:
+            cls._pending -= 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Counters describing pool usage"""
+        return {
+            'mode': REWRITE_POOL_MODE,
+            'pending': cls._pending,
+            'max_queue': cls.max_queue,
+            'inline': cls.inline,
+            'offloaded': cls.offloaded,
+            'rejected': cls.rejected,
+        }
@@ -0,0 +1,248 @@
+"""Coalescing of identical concurrent upstream requests"""
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+from fastapi import HTTPException, Response
+
+from ..config.settings import COALESCE_MAX_BODY_BYTES, COALESCE_MAX_WAIT
+
+# Methods whose concurrent requests may share one response (HEAD isn't proxied)
+COALESCED_METHODS = frozenset(['GET'])
+
+# Request headers that commonly select a different response; requests only
+# share a fetch when all of them match. Cookie and Authorization keep
+# different users' responses apart, Range and If-Range different parts.
+KEY_HEADERS = ('accept', 'accept-encoding', 'accept-language', 'authorization', 'cookie', 'range', 'if-range')
+
+FlightKey = Tuple[str, ...]
+
+
+class SharedResponse:
+    """A complete response that can be replayed to every waiter"""
+
+    __slots__ = ('status_code', 'raw_headers', 'body', 'vary')
+
+    def __init__(self, status_code: int, raw_headers: List[Tuple[bytes, bytes]], body: bytes,
+                 vary: Dict[str, str]):
+        self.status_code = status_code
+        self.raw_headers = raw_headers
+        self.body = body
+        # Request header values of the leader for each name listed in Vary
+        self.vary = vary
+
+    def matches(self, request_headers: Mapping[str, str]) -> bool:
+        """Whether the response also answers a waiter's request"""
+        return all(request_headers.get(name, '') == value for name, value in self.vary.items())
+
+    def to_response(self) -> Response:
+        response = Response(content=self.body, status_code=self.status_code)
+        response.raw_headers = list(self.raw_headers)
+        return response
+
+
+class SharedError(HTTPException):
+    """The error of a flight, raised to a request that joined it"""
+
+
+class Flight:
+    """The leading request's response, and the copy shared with joining requests
+
+    shared resolves to a SharedResponse once the body is complete, or to
+    None when the response can't be shared.
+    """
+
+    __slots__ = ('response', 'shared')
+
+    def __init__(self, response: Response, shared: "asyncio.Future[Optional[SharedResponse]]"):
+        self.response = response
+        self.shared = shared
+
+
+class TeeStream:
+    """Streams a body to the leading request while recording it for the joining ones"""
+
+    def __init__(self, response: Response, vary: Dict[str, str], limit: int):
+        self._source = response.body_iterator
+        self._status_code = response.status_code
+        self._raw_headers = list(response.raw_headers)
+        self._vary = vary
+        self._limit = limit
+        self._chunks: Optional[List[bytes]] = []
+        self._size = 0
+        self.shared: "asyncio.Future[Optional[SharedResponse]]" = asyncio.get_running_loop().create_future()
+
+    async def __aiter__(self):
+        complete = False
+        try:
+            async for chunk in self._source:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                if self._chunks is not None:
+                    self._size += len(chunk)
+                    if self._size > self._limit:
+                        # Too large to hold: the rest is only streamed to the leading request
+                        self._chunks = None
+                    else:
+                        self._chunks.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            self._settle(complete)
+
+    async def aclose(self) -> None:
+        """Stop streaming; joining requests fetch on their own"""
+        self._settle(False)
+        aclose = getattr(self._source, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+    def _settle(self, complete: bool) -> None:
+        if self.shared.done():
+            return
+        if complete and self._chunks is not None:
+            self.shared.set_result(SharedResponse(self._status_code, self._raw_headers,
+                                                  b''.join(self._chunks), self._vary))
+        else:
+            self.shared.set_result(None)
+
+
+class SingleFlight:
+    """Lets identical concurrent requests share one upstream fetch
+
+    The first request of a key starts the fetch in its own task so that it
+    survives the first client going away. The response is streamed to that
+    request while its body is recorded (up to max_body_bytes), and the
+    complete body is replayed to every request that joined before it
+    ended; an error is raised to all of them. A joining request fetches on
+    its own when the flight takes longer than max_wait, when the response
+    is too large, sets cookies or varies on headers that differ, or when
+    the first request stops reading it.
+    """
+
+    max_wait: float = COALESCE_MAX_WAIT
+    max_body_bytes: int = COALESCE_MAX_BODY_BYTES
+
+    _flights: Dict[FlightKey, asyncio.Task] = {}
+
+    flights: int = 0
+    joined: int = 0
+    fallbacks: int = 0
+
+    @staticmethod
+    def key(proxy_id: str, method: str, url: str, headers: Mapping[str, str]) -> FlightKey:
+        """Build the key under which identical requests are coalesced"""
+        return (proxy_id, method, url, *(headers.get(name, '') for name in KEY_HEADERS))
+
+    @classmethod
+    async def run(cls, key: FlightKey, request_headers: Mapping[str, str],
+                  produce: Callable[[], Awaitable[Response]]) -> Tuple[Response, bool]:
+        """Produce a response, or share the one already being produced for the key
+
+        Returns the response and whether it was shared from another request.
+        The flight's error is raised to a joining request as a SharedError.
+        """
+        task = cls._flights.get(key)
+        if task is None:
+            return await cls._lead(key, request_headers, produce), False
+
+        try:
+            result = await asyncio.wait_for(cls._shared(task), cls.max_wait)
+        except asyncio.TimeoutError:
+            result = None
+        except HTTPException as e:
+            cls.joined += 1
+            raise SharedError(e.status_code, e.detail, e.headers) from e
+        if result is not None and result.matches(request_headers):
+            cls.joined += 1
+            return result.to_response(), True
+
+        cls.fallbacks += 1
+        return await produce(), False
+
+    @staticmethod
+    async def _shared(task: asyncio.Task) -> Optional[SharedResponse]:
+        """Wait for the flight's shared response without cancelling it on timeout"""
+        flight = await asyncio.shield(task)
+        return await asyncio.shield(flight.shared)
+
+    @classmethod
+    async def _lead(cls, key: FlightKey, request_headers: Mapping[str, str],
+                    produce: Callable[[], Awaitable[Response]]) -> Response:
+        task = asyncio.get_running_loop().create_task(cls._fetch(request_headers, produce))
+        cls._flights[key] = task
+        cls.flights += 1
+
+        def land(*_) -> None:
+            if cls._flights.get(key) is task:
+                del cls._flights[key]
+
+        def fetched(finished: asyncio.Task) -> None:
+            # Requests keep joining until the shared body is known
+            if finished.cancelled() or finished.exception() is not None:
+                land()
+            else:
+                finished.result().shared.add_done_callback(land)
+
+        task.add_done_callback(fetched)
+        try:
+            flight = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Nobody will read the response of this request
+            task.add_done_callback(_discard)
+            raise
+        return flight.response
+
+    @classmethod
+    async def _fetch(cls, request_headers: Mapping[str, str], produce: Callable[[], Awaitable[Response]]) -> Flight:
+        """Produce the response and arrange for it to be shared"""
+        response = await produce()
+        shared = asyncio.get_running_loop().create_future()
+        vary = cls._vary_values(response, request_headers)
+        if vary is None or 'set-cookie' in response.headers:
+            shared.set_result(None)
+            return Flight(response, shared)
+
+        if getattr(response, 'body_iterator', None) is None:
+            shared.set_result(SharedResponse(response.status_code, list(response.raw_headers), response.body, vary))
+            return Flight(response, shared)
+
+        tee = TeeStream(response, vary, cls.max_body_bytes)
+        response.body_iterator = tee
+        return Flight(response, tee.shared)
+
+    @staticmethod
+    def _vary_values(response: Response, request_headers: Mapping[str, str]) -> Optional[Dict[str, str]]:
+        """Map the request headers named in Vary to the values this response was made for
+
+        Returns None when the response varies on everything.
+        """
+        names = [name.strip().lower() for name in response.headers.get('vary', '').split(',') if name.strip()]
+        if '*' in names:
+            return None
+        return {name: request_headers.get(name, '') for name in names if name not in KEY_HEADERS}
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Counters describing coalescing"""
+        return {
+            'in_flight': len(cls._flights),
+            'flights': cls.flights,
+            'joined': cls.joined,
+            'fallbacks': cls.fallbacks,
+        }
+
+
+def _discard(task: asyncio.Task) -> None:
+    """Release the response of a flight whose leading request has gone away"""
+    if task.cancelled() or task.exception() is not None:
+        return
+    response = task.result().response
+
+    async def close():
+        aclose = getattr(getattr(response, 'body_iterator', None), 'aclose', None)
+        if aclose is not None:
+            await aclose()
+        if response.background is not None:
+            await response.background()
+
+    asyncio.get_running_loop().create_task(close())
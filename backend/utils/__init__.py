@@ -1,10 +1,52 @@
 """Utils module initialization"""
-from .headers import modify_headers_for_proxy, modify_response_headers
-from .rewrite import rewrite_css_content, rewrite_html_content
+from .headers import (
+    append_vary,
+    byte_range_bounds,
+    etag_matches,
+    if_range_matches,
+    modify_headers_for_proxy,
+    modify_response_headers,
+    parse_byte_range,
+    parse_cache_control,
+    proxy_request_headers,
+    proxy_response_headers,
+)
+from .rewrite import (
+    CLIENT_SCRIPT_PATH,
+    SERVICE_WORKER_PATH,
+    HTMLRewriter,
+    RewritePlan,
+    SnippetInserter,
+    css_bytes_rewritable,
+    forget_rewrite_plan,
+    rewrite_css_bytes,
+    rewrite_css_content,
+    rewrite_html_content,
+    rewrite_html_with_subresources,
+    rewrite_plan,
+)
 
 __all__ = [
     'modify_headers_for_proxy',
     'modify_response_headers',
+    'proxy_request_headers',
+    'proxy_response_headers',
+    'append_vary',
+    'etag_matches',
+    'parse_cache_control',
+    'parse_byte_range',
+    'byte_range_bounds',
+    'if_range_matches',
+    'HTMLRewriter',
+    'RewritePlan',
+    'SnippetInserter',
+    'SERVICE_WORKER_PATH',
+    'CLIENT_SCRIPT_PATH',
+    'rewrite_plan',
+    'forget_rewrite_plan',
     'rewrite_html_content',
-    'rewrite_css_content'
+    'rewrite_html_with_subresources',
+    'rewrite_css_content',
+    'rewrite_css_bytes',
+    'css_bytes_rewritable',
 ]
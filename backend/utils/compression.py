@@ -0,0 +1,106 @@
+"""Utility functions for negotiating and applying response compression"""
+import zlib
+from typing import Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Encodings in order of preference, limited to those available
+AVAILABLE_ENCODINGS = tuple(
+    name for name, available in (('br', brotli is not None), ('zstd', zstandard is not None), ('gzip', True))
+    if available
+)
+
+# Media types that are already compressed and gain nothing from another pass
+COMPRESSED_MEDIA_PREFIXES = ('image/', 'video/', 'audio/', 'font/woff')
+COMPRESSED_MEDIA_TYPES = frozenset([
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-bzip2',
+    'application/x-7z-compressed', 'application/x-xz', 'application/zstd', 'application/pdf',
+    'application/octet-stream', 'application/wasm', 'application/font-woff',
+])
+COMPRESSIBLE_IMAGE_TYPES = frozenset(['image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon', 'image/bmp'])
+
+
+def negotiate_encoding(accept_encoding: Optional[str],
+                       available: Tuple[str, ...] = AVAILABLE_ENCODINGS) -> Optional[str]:
+    """Pick the preferred available encoding accepted by the client"""
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    wildcard = accepted.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    """Whether a media type is worth compressing"""
+    media_type = (content_type or '').split(';', 1)[0].strip().lower()
+    if not media_type or media_type in COMPRESSED_MEDIA_TYPES:
+        return False
+    if media_type in COMPRESSIBLE_IMAGE_TYPES:
+        return True
+    return not media_type.startswith(COMPRESSED_MEDIA_PREFIXES)
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """Compress a complete body with the given content-coding"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(min(level, 9), zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+class StreamCompressor:
+    """Incremental compressor that flushes after every chunk for streamed bodies"""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=min(level, 11))
+        elif encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        elif encoding == 'gzip':
+            self._compressor = zlib.compressobj(min(level, 9), zlib.DEFLATED, 31)
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a chunk and flush it so the client can decode it right away"""
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        if self.encoding == 'zstd':
+            return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        """End the compressed stream"""
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
@@ -1,7 +1,37 @@
 """Utility functions for handling HTTP headers"""
-from typing import Dict
+from typing import Dict, Iterable, List, MutableMapping, Optional, Tuple
 from urllib.parse import urlparse
 
+RawHeaders = List[Tuple[bytes, bytes]]
+
+# Hop-by-hop headers, which apply to a single connection and are never forwarded
+HOP_BY_HOP_HEADERS = frozenset([
+    b'connection', b'keep-alive', b'proxy-authenticate', b'proxy-authorization',
+    b'te', b'trailers', b'transfer-encoding', b'upgrade',
+])
+
+# Headers that prevent the target from being embedded in an iframe
+FRAME_BLOCKING_HEADERS = frozenset([
+    b'x-frame-options', b'content-security-policy', b'content-security-policy-report-only',
+])
+
+# CORS headers added to every proxied response
+CORS_RESPONSE_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'GET, POST, PUT, DELETE, PATCH, OPTIONS'),
+    (b'access-control-allow-headers', b'*'),
+]
+
+REQUEST_DROPPED_HEADERS = HOP_BY_HOP_HEADERS | {b'host'}
+RESPONSE_DROPPED_HEADERS = (
+    HOP_BY_HOP_HEADERS | FRAME_BLOCKING_HEADERS | frozenset(name for name, _ in CORS_RESPONSE_HEADERS)
+)
+# Framing headers that no longer apply once the body has been decoded and rewritten.
+# Byte offsets of the rewritten body differ from the target's, so ranges aren't offered.
+DECODED_RESPONSE_DROPPED_HEADERS = (
+    RESPONSE_DROPPED_HEADERS | {b'content-encoding', b'content-length', b'accept-ranges'}
+)
+
 
 def modify_headers_for_proxy(headers: Dict[str, str], target_url: str, proxy_id: str) -> Dict[str, str]:
     """Modify request headers for proxying"""
@@ -53,6 +83,7 @@ def modify_response_headers(headers: Dict[str, str], remove_encoding: bool = Fal
     if remove_encoding:
         modified_headers.pop('content-encoding', None)
         modified_headers.pop('content-length', None)  # Length will be different after rewriting
+        modified_headers.pop('accept-ranges', None)  # So will byte offsets
 
     # Add CORS headers
     modified_headers['access-control-allow-origin'] = '*'
@@ -60,3 +91,129 @@ def modify_response_headers(headers: Dict[str, str], remove_encoding: bool = Fal
     modified_headers['access-control-allow-headers'] = '*'
 
     return modified_headers
+
+
+def proxy_request_headers(raw: Iterable[Tuple[bytes, bytes]], target_url: str, proxy_id: str) -> RawHeaders:
+    """Raw-header version of modify_headers_for_proxy
+
+    Works on the (name, value) byte pairs of an ASGI scope, whose names are
+    already lowercase, and keeps repeated headers.
+    """
+    parsed = urlparse(target_url)
+    netloc = parsed.netloc.encode('latin-1')
+    origin = f"{parsed.scheme}://{parsed.netloc}".encode('latin-1')
+    marker = f'/proxy/{proxy_id}/'.encode('latin-1')
+
+    headers = [(b'host', netloc)]
+    for name, value in raw:
+        if name in REQUEST_DROPPED_HEADERS:
+            continue
+        if name == b'origin':
+            value = origin
+        elif name == b'referer' and marker in value:
+            # Keep the path but point the referer at the target
+            value = origin + b'/' + value.split(marker, 1)[1]
+        headers.append((name, value))
+    return headers
+
+
+def proxy_response_headers(raw: Iterable[Tuple[bytes, bytes]], remove_encoding: bool = False) -> RawHeaders:
+    """Raw-header version of modify_response_headers
+
+    Repeated headers such as Set-Cookie are kept as separate lines.
+    """
+    dropped = DECODED_RESPONSE_DROPPED_HEADERS if remove_encoding else RESPONSE_DROPPED_HEADERS
+    headers = []
+    for name, value in raw:
+        name = name.lower()
+        if name not in dropped:
+            headers.append((name, value))
+    headers.extend(CORS_RESPONSE_HEADERS)
+    return headers
+
+
+def append_vary(headers: MutableMapping[str, str], name: str) -> None:
+    """Add a header name to the Vary header if it is not listed yet"""
+    current = headers.get('vary', '')
+    names = [v.strip().lower() for v in current.split(',') if v.strip()]
+    if name.lower() not in names and '*' not in names:
+        headers['vary'] = f"{current}, {name}" if current else name
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Parse a Cache-Control header into a dict of lowercase directives"""
+    directives = {}
+    if not value:
+        return directives
+    for part in value.split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+    return directives
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Whether an If-None-Match header matches an ETag (weak comparison)"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def parse_byte_range(value: Optional[str]) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """Parse a Range header holding a single byte range
+
+    Returns (first, last) as written, with None for an open end ("500-")
+    or the start of a suffix range ("-500"). Returns None when the header
+    is missing, malformed or lists several ranges.
+    """
+    if not value:
+        return None
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash or not (first + last).isdigit():
+        return None
+    if not first:
+        return None, int(last)
+    if last and int(last) < int(first):
+        return None
+    return int(first), int(last) if last else None
+
+
+def byte_range_bounds(byte_range: Tuple[Optional[int], Optional[int]], size: int) -> Optional[Tuple[int, int]]:
+    """Resolve a parsed byte range against a body size
+
+    Returns inclusive (start, end) offsets, or None when the range is unsatisfiable.
+    """
+    first, last = byte_range
+    if first is None:
+        if not last or not size:
+            return None
+        return max(0, size - last), size - 1
+    if first >= size:
+        return None
+    return first, size - 1 if last is None else min(last, size - 1)
+
+
+def if_range_matches(if_range: Optional[str], etag: Optional[str], last_modified: Optional[str]) -> bool:
+    """Whether an If-Range header allows serving a partial response
+
+    Entity tags are compared strongly and dates must equal Last-Modified
+    exactly; a missing If-Range always allows it.
+    """
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return etag is not None and not etag.startswith('W/') and if_range == etag
+    return last_modified is not None and if_range == last_modified
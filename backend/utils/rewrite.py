@@ -1,46 +1,49 @@
 """Utility functions for rewriting HTML, CSS, and JavaScript content"""
+import codecs
+import hashlib
 import re
-from typing import Optional
+from html import escape
+from html.parser import HTMLParser
+from typing import AnyStr, Callable, Dict, Generic, List, Optional, Pattern, Tuple
 
-from bs4 import BeautifulSoup
+# Tags and attributes whose URLs are rewritten to go through the proxy
+URL_TAGS = frozenset(['a', 'link', 'script', 'img', 'iframe', 'form', 'video', 'audio', 'source'])
+URL_ATTRIBUTES = frozenset(['href', 'src', 'action', 'data', 'poster'])
 
+# Preload destinations (the "as" of a Link preload) of subresources announced for a page
+PRELOAD_DESTINATIONS = frozenset(['style', 'script', 'image'])
 
-def rewrite_html_content(content: str, proxy_id: str, target_url: str) -> str:
-    """Rewrite HTML content to work through the proxy"""
-    try:
-        soup = BeautifulSoup(content, 'html.parser')
-        proxy_base = f'/proxy/{proxy_id}'
-
-        # Rewrite all absolute URLs in common attributes
-        for tag in soup.find_all(['a', 'link', 'script', 'img', 'iframe', 'form', 'video', 'audio', 'source']):
-            for attr in ['href', 'src', 'action', 'data', 'poster']:
-                if tag.has_attr(attr):
-                    url = tag[attr]
-                    # Skip if already proxied, empty, or a data/javascript/mailto URL
-                    if not url or url.startswith(('data:', 'javascript:', 'mailto:', '#', proxy_base)):
-                        continue
-                    # Rewrite absolute paths
-                    if url.startswith('/'):
-                        tag[attr] = f'{proxy_base}{url}'
-                    # Rewrite relative URLs (only if they're simple paths without protocols)
-                    elif not url.startswith(('http://', 'https://', '//')):
-                        tag[attr] = f'{proxy_base}/{url}'
-
-        # Rewrite inline style attributes
-        for tag in soup.find_all(style=True):
-            original_style = tag['style']
-            tag['style'] = rewrite_css_content(original_style, proxy_id)
-
-        # Rewrite <style> blocks
-        for style_tag in soup.find_all('style'):
-            if style_tag.string:
-                original_css = style_tag.string
-                rewritten_css = rewrite_css_content(original_css, proxy_id)
-                style_tag.string = rewritten_css
-
-        # Inject JavaScript to intercept fetch/XMLHttpRequest
-        script = soup.new_tag('script')
-        script.string = f"""
+# URL prefixes left as they are: inline data, other schemes, fragments and other hosts
+KEPT_URL_PREFIXES = ('data:', 'javascript:', 'mailto:', '#', 'http://', 'https://', '//')
+
+# Where CSS URLs start: after "url(" and an optional quote, and after the
+# quote of an @import with a bare string. Only a prefix is ever inserted,
+# so the rest of the URL needn't be matched.
+CSS_URL_START = r'url\(\s*["\']?'
+CSS_IMPORT_START = r'@import\s*["\']'
+CSS_IMAGE_SET_START = r'image-set\('
+# Tokens inside image-set(): strings, which are URLs when not nested in
+# another function such as type(), and parentheses
+CSS_IMAGE_SET_TOKEN = r'"[^"\\\n]*(?:\\.[^"\\\n]*)*"|\'[^\'\\\n]*(?:\\.[^\'\\\n]*)*\'|(\()|(\))'
+# What may follow a URL start without the URL needing a prefix, on top of
+# KEPT_URL_PREFIXES: the end of an empty url() or string
+CSS_EMPTY_URL_ENDS = ('"', "'", ')')
+
+CSS_IMAGE_SET_START_REGEX = (re.compile(CSS_IMAGE_SET_START), re.compile(CSS_IMAGE_SET_START.encode('ascii')))
+CSS_IMAGE_SET_TOKEN_REGEX = (re.compile(CSS_IMAGE_SET_TOKEN), re.compile(CSS_IMAGE_SET_TOKEN.encode('ascii')))
+
+# Where the service worker mode snippet goes: right after the opening <head> or <body> tag
+SNIPPET_ANCHOR = re.compile(rb'<(?:head|body)(?:\s[^>]*)?>', re.IGNORECASE)
+
+CSS_CHARSET_RULE = re.compile(rb'@charset "([A-Za-z0-9_.:-]+)";')
+
+# Codec names (as normalised by codecs.lookup) whose ASCII bytes are always ASCII characters
+ASCII_COMPATIBLE_CHARSETS = frozenset(['utf-8', 'utf-8-sig', 'ascii', 'latin-1', 'koi8-r', 'koi8-u', 'mac-roman'])
+
+
+def build_interceptor_script(proxy_base: str, target_url: str) -> str:
+    """Build the script injected into pages to route fetch, XMLHttpRequest and WebSocket through the proxy"""
+    return f"""
         (function() {{
             const proxyBase = '{proxy_base}';
             const targetUrl = '{target_url}';
@@ -62,50 +65,542 @@ def rewrite_html_content(content: str, proxy_id: str, target_url: str) -> str:
                 }}
                 return originalOpen.call(this, method, url, ...rest);
             }};
+
+            // Intercept WebSocket
+            const OriginalWebSocket = window.WebSocket;
+            const targetHost = new URL(targetUrl).host;
+            const proxySocketUrl = function(url) {{
+                const parsed = new URL(url, window.location.href);
+                if (parsed.host !== targetHost && parsed.host !== window.location.host) {{
+                    return url;
+                }}
+                if (parsed.pathname !== proxyBase && !parsed.pathname.startsWith(proxyBase + '/')) {{
+                    parsed.pathname = proxyBase + parsed.pathname;
+                }}
+                parsed.protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+                parsed.host = window.location.host;
+                return parsed.toString();
+            }};
+            window.WebSocket = function(url, protocols) {{
+                return protocols === undefined
+                    ? new OriginalWebSocket(proxySocketUrl(url))
+                    : new OriginalWebSocket(proxySocketUrl(url), protocols);
+            }};
+            window.WebSocket.prototype = OriginalWebSocket.prototype;
+            ['CONNECTING', 'OPEN', 'CLOSING', 'CLOSED'].forEach(function(name) {{
+                window.WebSocket[name] = OriginalWebSocket[name];
+            }});
         }})();
         """
-        if soup.head:
-            soup.head.insert(0, script)
-        elif soup.body:
-            soup.body.insert(0, script)
 
-        return str(soup)
-    except Exception as e:
-        # Return original content if rewriting fails
+
+# Path under a proxy's prefix where its service worker mode scripts are served
+SERVICE_WORKER_PATH = '__nebula/sw.js'
+CLIENT_SCRIPT_PATH = '__nebula/client.js'
+
+
+def build_service_worker_script(proxy_base: str, target_url: str) -> str:
+    """Build the service worker that routes a proxied page's requests through the proxy
+
+    Requests for the proxy's own origin outside its prefix, and requests for
+    the target's origin, are re-sent under the prefix. Navigations are left
+    alone: those within the scope already are under the prefix.
+    """
+    return f"""
+        const proxyBase = '{proxy_base}';
+        const target = new URL('{target_url}');
+        const targetPath = target.pathname.replace(/\\/$/, '');
+
+        self.addEventListener('install', function() {{
+            self.skipWaiting();
+        }});
+        self.addEventListener('activate', function(event) {{
+            event.waitUntil(self.clients.claim());
+        }});
+
+        function proxiedPath(url) {{
+            if (url.origin === self.location.origin) {{
+                if (url.pathname === proxyBase || url.pathname.startsWith(proxyBase + '/')) {{
+                    return null;
+                }}
+                return url.pathname;
+            }}
+            if (url.origin === target.origin && url.pathname.startsWith(targetPath)) {{
+                return url.pathname.slice(targetPath.length) || '/';
+            }}
+            return null;
+        }}
+
+        async function forward(request, url) {{
+            const init = {{
+                method: request.method,
+                headers: request.headers,
+                credentials: request.credentials === 'omit' ? 'omit' : 'include',
+                cache: request.cache,
+                redirect: request.redirect,
+                referrer: request.referrer,
+                integrity: request.integrity,
+            }};
+            if (request.method !== 'GET' && request.method !== 'HEAD') {{
+                init.body = await request.arrayBuffer();
+            }}
+            return fetch(url, init);
+        }}
+
+        self.addEventListener('fetch', function(event) {{
+            const request = event.request;
+            if (request.mode === 'navigate') {{
+                return;
+            }}
+            const url = new URL(request.url);
+            const path = proxiedPath(url);
+            if (path !== null) {{
+                event.respondWith(forward(request, self.location.origin + proxyBase + path + url.search));
+            }}
+        }});
+        """
+
+
+def build_client_script(proxy_base: str, target_url: str) -> str:
+    """Build the script pages load in service worker mode
+
+    Registers the service worker, reloading the page once when it wasn't
+    controlled yet, since its subresources then bypassed the worker. Links
+    and forms leaving the worker's scope are pointed back under the prefix,
+    and fetch, XMLHttpRequest and WebSocket are patched as in server mode for
+    browsers without service workers and for sockets, which workers don't see.
+    """
+    return build_interceptor_script(proxy_base, target_url) + f"""
+        (function() {{
+            const proxyBase = '{proxy_base}';
+            const reloadedKey = 'nebula-sw-reloaded:' + proxyBase;
+
+            if ('serviceWorker' in navigator) {{
+                navigator.serviceWorker.register(proxyBase + '/{SERVICE_WORKER_PATH}', {{scope: proxyBase + '/'}})
+                    .then(function() {{
+                        if (!navigator.serviceWorker.controller && !sessionStorage.getItem(reloadedKey)) {{
+                            sessionStorage.setItem(reloadedKey, '1');
+                            navigator.serviceWorker.ready.then(function() {{
+                                window.location.reload();
+                            }});
+                        }}
+                    }})
+                    .catch(function() {{}});
+            }}
+
+            const proxiedUrl = function(url) {{
+                const parsed = new URL(url, window.location.href);
+                if (parsed.origin === window.location.origin && parsed.pathname !== proxyBase
+                        && !parsed.pathname.startsWith(proxyBase + '/')) {{
+                    parsed.pathname = proxyBase + parsed.pathname;
+                }}
+                return parsed.href;
+            }};
+            document.addEventListener('click', function(event) {{
+                const link = event.target.closest ? event.target.closest('a[href]') : null;
+                if (link && !link.href.startsWith('javascript:')) {{
+                    link.href = proxiedUrl(link.href);
+                }}
+            }}, true);
+            document.addEventListener('submit', function(event) {{
+                event.target.action = proxiedUrl(event.target.action);
+            }}, true);
+        }})();
+        """
+
+
+def rewrite_url(url: str, proxy_base: str) -> str:
+    """Rewrite a single URL attribute value to go through the proxy"""
+    # Skip if already proxied, empty, or a data/javascript/mailto URL
+    if not url or url.startswith(('data:', 'javascript:', 'mailto:', '#', proxy_base)):
+        return url
+    # Rewrite absolute paths
+    if url.startswith('/'):
+        return f'{proxy_base}{url}'
+    # Rewrite relative URLs (only if they're simple paths without protocols)
+    if not url.startswith(('http://', 'https://', '//')):
+        return f'{proxy_base}/{url}'
+    return url
+
+
+class CssRules(Generic[AnyStr]):
+    """Compiled patterns and prefixes for rewriting CSS of one proxy, as str or bytes
+
+    The url() and @import patterns match from the token up to the start
+    of a URL that needs the proxy prefix, consuming its leading slash, so
+    splitting on them leaves the places to insert "/proxy/<id>/".
+    """
+
+    __slots__ = ('url_start', 'import_start', 'image_set_start', 'image_set_token',
+                 'import_keyword', 'image_set_keyword', 'kept', 'absolute', 'base', 'base_slash')
+
+    def __init__(self, proxy_base: str, binary: bool):
+        encode = (lambda text: text.encode('utf-8')) if binary else (lambda text: text)
+        kept = KEPT_URL_PREFIXES + CSS_EMPTY_URL_ENDS + (proxy_base,)
+        needs_prefix = '(?!' + '|'.join(re.escape(prefix) for prefix in kept) + ')/?'
+        self.url_start = re.compile(encode(f'({CSS_URL_START}){needs_prefix}'))
+        self.import_start = re.compile(encode(f'({CSS_IMPORT_START}){needs_prefix}'))
+        self.image_set_start = CSS_IMAGE_SET_START_REGEX[binary]
+        self.image_set_token = CSS_IMAGE_SET_TOKEN_REGEX[binary]
+        self.import_keyword = encode('@import')
+        self.image_set_keyword = encode('image-set(')
+        self.kept = tuple(encode(prefix) for prefix in kept)
+        self.absolute = encode('/')
+        self.base = encode(proxy_base)
+        self.base_slash = encode(proxy_base + '/')
+
+
+class RewritePlan:
+    """Everything rewriting needs for one proxy, built once and reused
+
+    Holds the proxy's URL prefix, the injected <script> element, the CSS
+    rules and the scripts of service worker mode. Plans are cached per proxy
+    by rewrite_plan() and dropped with forget_rewrite_plan() when the proxy
+    changes.
+    """
+
+    __slots__ = ('proxy_id', 'target_url', 'proxy_base', 'proxy_prefix', 'script_tag', 'css_text', 'css_bytes',
+                 'service_worker', 'client_script', 'client_version', 'snippet')
+
+    def __init__(self, proxy_id: str, target_url: Optional[str] = None):
+        self.proxy_id = proxy_id
+        self.target_url = target_url
+        self.proxy_base = f'/proxy/{proxy_id}'
+        self.proxy_prefix = self.proxy_base + '/'
+        self.script_tag = None
+        self.service_worker = self.client_script = self.client_version = self.snippet = None
+        if target_url is not None:
+            self.script_tag = f'<script>{build_interceptor_script(self.proxy_base, target_url)}</script>'
+            self.service_worker = build_service_worker_script(self.proxy_base, target_url).encode('utf-8')
+            self.client_script = build_client_script(self.proxy_base, target_url).encode('utf-8')
+            # Versions the client script's URL so browsers may cache it for good
+            self.client_version = hashlib.sha256(self.client_script).hexdigest()[:16]
+            client_src = f'{self.proxy_prefix}{CLIENT_SCRIPT_PATH}?v={self.client_version}'
+            self.snippet = f'<script src="{escape(client_src)}"></script>'.encode('utf-8')
+        self.css_text = CssRules(self.proxy_base, binary=False)
+        self.css_bytes = CssRules(self.proxy_base, binary=True)
+
+
+_plans: Dict[str, RewritePlan] = {}
+
+
+def rewrite_plan(proxy_id: str, target_url: Optional[str] = None) -> RewritePlan:
+    """Get the rewrite plan of a proxy, building it on first use
+
+    Without target_url any cached plan of the proxy will do; plans built
+    without one have no injected script.
+    """
+    plan = _plans.get(proxy_id)
+    if plan is None or (target_url is not None and plan.target_url != target_url):
+        plan = _plans[proxy_id] = RewritePlan(proxy_id, target_url)
+    return plan
+
+
+def forget_rewrite_plan(proxy_id: str) -> None:
+    """Drop the cached rewrite plan of a proxy"""
+    _plans.pop(proxy_id, None)
+
+
+def _prefix_urls(pattern: Pattern[AnyStr], content: AnyStr, prefix: AnyStr) -> AnyStr:
+    """Insert a prefix wherever a URL start pattern matched"""
+    parts = pattern.split(content)
+    if len(parts) == 1:
         return content
+    parts[1::2] = [start + prefix for start in parts[1::2]]
+    return content[:0].join(parts)
 
 
-def rewrite_css_content(content: str, proxy_id: str) -> str:
-    """Rewrite CSS content to proxy URL references"""
-    try:
-        proxy_base = f'/proxy/{proxy_id}'
+def _prefix_image_set_strings(content: AnyStr, rules: CssRules[AnyStr]) -> AnyStr:
+    """Insert the proxy prefix before the bare string URLs of image-set()"""
+    parts = []
+    last = 0
+    for match in rules.image_set_start.finditer(content):
+        depth = 1
+        for token in rules.image_set_token.finditer(content, match.end()):
+            group = token.lastindex
+            if group == 1:
+                depth += 1
+            elif group == 2:
+                depth -= 1
+                if not depth:
+                    break
+            elif depth == 1:
+                start = token.start() + 1
+                if not content.startswith(rules.kept, start):
+                    parts.append(content[last:start])
+                    parts.append(rules.base if content.startswith(rules.absolute, start) else rules.base_slash)
+                    last = start
+    if not parts:
+        return content
+    parts.append(content[last:])
+    return content[:0].join(parts)
+
+
+def _rewrite_css(content: AnyStr, rules: CssRules[AnyStr]) -> AnyStr:
+    """Insert the proxy prefix before every URL in a stylesheet
+
+    URLs keep their quoting and escapes since only a prefix is added.
+    Most stylesheets only hold url()s, found in a single scan; @import
+    strings and image-set() are looked for only when present.
+    """
+    content = _prefix_urls(rules.url_start, content, rules.base_slash)
+    if rules.import_keyword in content:
+        content = _prefix_urls(rules.import_start, content, rules.base_slash)
+    if rules.image_set_keyword in content:
+        content = _prefix_image_set_strings(content, rules)
+    return content
+
+
+class SnippetInserter:
+    """Inserts a snippet after a page's opening <head> (or <body>) tag, without parsing the page
+
+    Bytes are only held back until the tag is found. When it isn't within
+    the first max_search bytes, the page is left as it is.
+    """
+
+    def __init__(self, snippet: bytes, max_search: int = 64 * 1024):
+        self.snippet = snippet
+        self.max_search = max_search
+        self._buffer: Optional[bytearray] = bytearray()
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Take the next chunk of the page and return the bytes that are ready"""
+        if self._buffer is None:
+            return chunk
+        self._buffer += chunk
+        match = SNIPPET_ANCHOR.search(self._buffer)
+        if match is not None:
+            self._buffer[match.end():match.end()] = self.snippet
+        elif len(self._buffer) < self.max_search:
+            return b''
+        data = bytes(self._buffer)
+        self._buffer = None
+        return data
+
+    def finish(self) -> bytes:
+        """Return whatever is still held back at the end of the page"""
+        data = bytes(self._buffer or b'')
+        self._buffer = None
+        return data
+
 
-        def replace_url(match):
-            # Extract the URL (remove quotes if present)
-            url = match.group(1).strip('\'"').strip()
+class HTMLRewriter(HTMLParser):
+    """Incremental HTML rewriter that emits rewritten output chunk by chunk
 
-            # Skip data URIs, already proxied URLs, and hash references
-            if url.startswith(('data:', '#', proxy_base)):
-                return match.group(0)
+    Markup is tokenized as it arrives. Tags without URLs to rewrite are
+    re-emitted verbatim; URL attributes, inline styles and <style> blocks are
+    rewritten in the same pass, and the interceptor script is inserted right
+    after the opening <head> (or <body> when there is no head).
 
-            # Skip if already proxied
-            if url.startswith(proxy_base):
-                return match.group(0)
+    With on_subresource, every stylesheet, classic script and eagerly loaded
+    image the page refers to through the proxy is reported as it is seen,
+    as (destination, rewritten URL).
+    """
 
-            # Rewrite absolute paths
-            if url.startswith('/'):
-                new_url = f'url("{proxy_base}{url}")'
-                return new_url
-            # Rewrite relative paths
+    def __init__(self, proxy_id: str, target_url: str,
+                 on_subresource: Optional[Callable[[str, str], None]] = None):
+        super().__init__(convert_charrefs=False)
+        self.proxy_id = proxy_id
+        self.plan = rewrite_plan(proxy_id, target_url)
+        self.proxy_base = self.plan.proxy_base
+        self.on_subresource = on_subresource
+        self._output: List[str] = []
+        self._style: Optional[List[str]] = None
+        self._injected = False
+        self._held: Tuple[str, Optional[List[str]], int] = ('', None, 0)
+
+    def rewrite_chunk(self, data: str) -> str:
+        """Feed a chunk of markup and return the output that is ready so far"""
+        self._hold()
+        self.feed(data)
+        return self._drain()
+
+    def finish(self) -> str:
+        """Flush any buffered markup at the end of the document"""
+        self._hold()
+        self.close()
+        if self._style is not None:
+            self._output.extend(self._style)
+            self._style = None
+        return self._drain()
+
+    def abandon(self, data: str = '') -> str:
+        """Give up after rewrite_chunk(data) or finish() raised
+
+        Returns the markup held back before the failed call followed by
+        data, both as they came in; the output of the failed call is dropped.
+        """
+        rawdata, style, style_size = self._held
+        self._output.clear()
+        held = ''.join(style[:style_size]) if style is not None else ''
+        return held + rawdata + data
+
+    def _hold(self):
+        # What has been fed but not returned yet, in case the next step fails
+        style = self._style
+        self._held = (self.rawdata, style, len(style) if style is not None else 0)
+
+    def _drain(self) -> str:
+        output = ''.join(self._output)
+        self._output.clear()
+        return output
+
+    def _rewrite_attrs(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        """Return rewritten attributes, or None if nothing changed"""
+        rewrite_urls = tag in URL_TAGS
+        changed = False
+        rewritten = []
+        for name, value in attrs:
+            if value is not None:
+                if rewrite_urls and name in URL_ATTRIBUTES:
+                    new_value = rewrite_url(value, self.proxy_base)
+                elif name == 'style':
+                    new_value = _rewrite_css(value, self.plan.css_text)
+                else:
+                    new_value = value
+                if new_value != value:
+                    changed = True
+                    value = new_value
+            rewritten.append((name, value))
+        return rewritten if changed else None
+
+    def _emit_tag(self, tag: str, attrs, self_closing: bool) -> None:
+        rewritten = self._rewrite_attrs(tag, attrs)
+        if rewritten is None:
+            self._output.append(self.get_starttag_text())
+        else:
+            parts = [f'<{tag}']
+            for name, value in rewritten:
+                parts.append(f' {name}' if value is None else f' {name}="{escape(value)}"')
+            parts.append('/>' if self_closing else '>')
+            self._output.append(''.join(parts))
+
+        if self.on_subresource is not None and tag in ('link', 'script', 'img'):
+            self._note_subresource(tag, dict(attrs if rewritten is None else rewritten))
+
+        if not self._injected and tag in ('head', 'body'):
+            self._output.append(self.plan.script_tag)
+            self._injected = True
+
+    def _note_subresource(self, tag: str, attrs: Dict[str, Optional[str]]) -> None:
+        if tag == 'link':
+            url = attrs.get('href')
+            rel = (attrs.get('rel') or '').lower().split()
+            if 'stylesheet' in rel:
+                destination = 'style'
+            elif 'preload' in rel:
+                destination = (attrs.get('as') or '').lower()
             else:
-                new_url = f'url("{proxy_base}/{url}")'
-                return new_url
+                return
+        elif tag == 'script':
+            # Module scripts would need modulepreload
+            url = attrs.get('src')
+            destination = 'script' if (attrs.get('type') or '').lower() != 'module' else ''
+        else:
+            url = attrs.get('src')
+            destination = 'image' if (attrs.get('loading') or '').lower() != 'lazy' else ''
+        if destination in PRELOAD_DESTINATIONS and url and url.startswith(self.plan.proxy_prefix):
+            self.on_subresource(destination, url)
+
+    def handle_starttag(self, tag, attrs):
+        self._emit_tag(tag, attrs, self_closing=False)
+        if tag == 'style':
+            self._style = []
+
+    def handle_startendtag(self, tag, attrs):
+        self._emit_tag(tag, attrs, self_closing=True)
 
-        # Match url(...) with various quote styles
-        original_content = content
-        content = re.sub(r'url\([\s]*([^)]+)[\s]*\)', replace_url, content)
+    def handle_endtag(self, tag):
+        if tag == 'style' and self._style is not None:
+            self._output.append(_rewrite_css(''.join(self._style), self.plan.css_text))
+            self._style = None
+        self._output.append(f'</{tag}>')
 
+    def handle_data(self, data):
+        if self._style is not None:
+            self._style.append(data)
+        else:
+            self._output.append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(f'&{name};')
+
+    def handle_charref(self, name):
+        self.handle_data(f'&#{name};')
+
+    def handle_comment(self, data):
+        self._output.append(f'<!--{data}-->')
+
+    def handle_decl(self, decl):
+        self._output.append(f'<!{decl}>')
+
+    def handle_pi(self, data):
+        self._output.append(f'<?{data}>')
+
+    def unknown_decl(self, data):
+        # CDATA sections (in SVG and MathML) end with "]]>", other marked sections with "]>"
+        if data.upper().startswith('CDATA['):
+            self._output.append(f'<![{data}]]>')
+        else:
+            self._output.append(f'<![{data}]>')
+
+
+def rewrite_html_content(content: str, proxy_id: str, target_url: str) -> str:
+    """Rewrite HTML content to work through the proxy"""
+    try:
+        rewriter = HTMLRewriter(proxy_id, target_url)
+        return rewriter.rewrite_chunk(content) + rewriter.finish()
+    except Exception:
+        # Return original content if rewriting fails
         return content
-    except Exception as e:
+
+
+def rewrite_html_with_subresources(content: str, proxy_id: str, target_url: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """Rewrite HTML content and list the subresources it refers to through the proxy"""
+    subresources = []
+    try:
+        rewriter = HTMLRewriter(proxy_id, target_url, on_subresource=lambda *item: subresources.append(item))
+        return rewriter.rewrite_chunk(content) + rewriter.finish(), subresources
+    except Exception:
+        return content, []
+
+
+def rewrite_css_content(content: str, proxy_id: str) -> str:
+    """Rewrite CSS content to proxy URL references"""
+    try:
+        return _rewrite_css(content, rewrite_plan(proxy_id).css_text)
+    except Exception:
         # Return original content if rewriting fails
         return content
+
+
+def rewrite_css_bytes(content: bytes, proxy_id: str) -> bytes:
+    """Rewrite an encoded stylesheet to proxy URL references without decoding it
+
+    Only valid for ASCII-compatible encodings; see css_bytes_rewritable().
+    """
+    try:
+        return _rewrite_css(content, rewrite_plan(proxy_id).css_bytes)
+    except Exception:
+        return content
+
+
+def css_bytes_rewritable(content: bytes, charset: Optional[str]) -> bool:
+    """Whether a stylesheet's encoding lets it be rewritten as bytes
+
+    Its URL syntax must be plain ASCII that can't appear inside multi-byte
+    characters, which holds for UTF-8 and the single-byte charsets.
+    """
+    if content.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return False
+    match = CSS_CHARSET_RULE.match(content)
+    if match is not None:
+        charset = match.group(1).decode('ascii')
+    if charset is None:
+        # Decoded as UTF-8 by default
+        return True
+    try:
+        name = codecs.lookup(charset).name
+    except LookupError:
+        return False
+    return name in ASCII_COMPATIBLE_CHARSETS or name.startswith(('iso8859-', 'cp125'))
@@ -0,0 +1 @@
+"""Load and micro benchmarks for Nebula Proxy"""
@@ -0,0 +1,47 @@
+"""Compare two benchmark result files
+
+Usage:
+    python -m benchmarks.compare baseline.json candidate.json
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, Tuple
+
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return '     n/a'
+    return f"{(after - before) / before * 100:+7.1f}%"
+
+
+def index_load(report: dict) -> Dict[Tuple[str, int], dict]:
+    return {(row['scenario'], row['concurrency']): row for row in report.get('load', {}).get('proxy', [])}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('baseline', type=Path)
+    parser.add_argument('candidate', type=Path)
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text())
+    candidate = json.loads(args.candidate.read_text())
+    print(f"baseline  {baseline['meta'].get('commit')}\ncandidate {candidate['meta'].get('commit')}\n")
+
+    before_load, after_load = index_load(baseline), index_load(candidate)
+    for key in sorted(before_load.keys() & after_load.keys()):
+        before, after = before_load[key], after_load[key]
+        print(f"{key[0]:<14} c={key[1]:<4} rps {before['rps']:>9.1f} -> {after['rps']:>9.1f} "
+              f"{change(before['rps'], after['rps'])}   "
+              f"p99 {before['latency_ms']['p99']:>8.2f} -> {after['latency_ms']['p99']:>8.2f} ms "
+              f"{change(before['latency_ms']['p99'], after['latency_ms']['p99'])}")
+
+    before_micro, after_micro = baseline.get('micro', {}), candidate.get('micro', {})
+    for name in sorted(before_micro.keys() & after_micro.keys()):
+        before, after = before_micro[name]['best_us'], after_micro[name]['best_us']
+        print(f"{name:<32} {before:>12.2f} -> {after:>12.2f} us {change(before, after)}")
+
+
+if __name__ == '__main__':
+    main()
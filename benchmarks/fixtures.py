@@ -0,0 +1,94 @@
+"""Deterministic fixture bodies shared by the fake upstream and the microbenchmarks"""
+import random
+from functools import lru_cache
+
+SEED = 1234
+
+
+@lru_cache(maxsize=None)
+def html_page(sections: int = 2000) -> str:
+    """A large server-rendered page with many links, images, inline styles and a <style> block"""
+    rng = random.Random(SEED)
+    parts = [
+        '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n<title>Benchmark page</title>\n',
+        '<link rel="stylesheet" href="/static/site.css">\n<script src="/static/app.js"></script>\n',
+        '<style>\n',
+    ]
+    for i in range(50):
+        parts.append(f'.c{i} {{ background: url("/img/bg{i}.png") no-repeat; color: #{rng.randrange(1 << 24):06x}; }}\n')
+    parts.append('</style>\n</head>\n<body>\n<nav>\n')
+    for i in range(100):
+        parts.append(f'<a href="/section/{i}">Section {i}</a>\n')
+    parts.append('</nav>\n<main>\n')
+    for i in range(sections):
+        words = ' '.join(f'word{rng.randrange(1000)}' for _ in range(30))
+        parts.append(
+            f'<article class="c{i % 50}" id="a{i}">\n'
+            f'<h2><a href="articles/{i}.html">Article {i}</a></h2>\n'
+            f'<img src="/img/{i}.jpg" alt="Image {i}" style="border: 1px solid #ccc">\n'
+            f'<p>{words} &amp; more</p>\n'
+            f'<form action="/comment/{i}" method="post"><input name="q" value="x"></form>\n'
+            '</article>\n'
+        )
+    parts.append('</main>\n<script>console.log("loaded");</script>\n</body>\n</html>\n')
+    return ''.join(parts)
+
+
+@lru_cache(maxsize=None)
+def css_sheet(rules: int = 5000) -> str:
+    """A stylesheet dominated by url() references in a mix of quoting styles"""
+    rng = random.Random(SEED)
+    quotes = ('', '"', "'")
+    parts = ['@import url("/static/reset.css");\n']
+    for i in range(rules):
+        quote = quotes[i % 3]
+        path = f'/img/sprite{i}.png' if i % 2 else f'img/icon{i}.svg'
+        parts.append(
+            f'.r{i} {{ background-image: url({quote}{path}{quote}); '
+            f'margin: {rng.randrange(20)}px; color: #{rng.randrange(1 << 24):06x}; }}\n'
+        )
+        if i % 10 == 0:
+            parts.append(f'.d{i} {{ background: url(data:image/gif;base64,R0lGODlhAQABAAAAACw=); }}\n')
+    return ''.join(parts)
+
+
+@lru_cache(maxsize=None)
+def binary_blob(size: int = 1024 * 1024) -> bytes:
+    """Incompressible bytes, as served for images or archives"""
+    return random.Random(SEED).randbytes(size)
+
+
+def request_headers() -> dict:
+    """Headers a browser sends for a page loaded through the proxy"""
+    return {
+        'host': 'localhost:8000',
+        'connection': 'keep-alive',
+        'user-agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+        'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'accept-encoding': 'gzip, deflate, br',
+        'accept-language': 'en-US,en;q=0.9',
+        'cookie': 'session=abcdef0123456789; theme=dark',
+        'origin': 'http://localhost:8000',
+        'referer': 'http://localhost:8000/proxy/bench/section/1',
+        'upgrade-insecure-requests': '1',
+        'sec-fetch-dest': 'iframe',
+        'sec-fetch-mode': 'navigate',
+    }
+
+
+def response_headers() -> dict:
+    """Headers a typical application sends with a page"""
+    return {
+        'content-type': 'text/html; charset=utf-8',
+        'content-length': '123456',
+        'content-encoding': 'gzip',
+        'cache-control': 'no-cache',
+        'connection': 'keep-alive',
+        'keep-alive': 'timeout=5',
+        'x-frame-options': 'SAMEORIGIN',
+        'content-security-policy': "default-src 'self'; frame-ancestors 'self'",
+        'strict-transport-security': 'max-age=31536000',
+        'set-cookie': 'session=abcdef0123456789; Path=/; HttpOnly',
+        'vary': 'Accept-Encoding',
+        'date': 'Mon, 01 Jan 2024 00:00:00 GMT',
+    }
@@ -0,0 +1,149 @@
+"""Closed-loop HTTP load driver and process resource sampling"""
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def drive(url: str, concurrency: int, duration: float, method: str = 'GET',
+                body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None,
+                unique: bool = False) -> dict:
+    """Keep `concurrency` requests in flight against a URL for `duration` seconds
+
+    Bodies are read raw so the client doesn't spend time decompressing.
+    Latency is measured to the last byte of the response.
+
+    Args:
+        unique: Append an `i=<n>` query parameter so every request targets a distinct URL
+    """
+    latencies: List[float] = []
+    errors = 0
+    statuses: Dict[int, int] = {}
+    received = 0
+    counter = 0
+    separator = '&' if '?' in url else '?'
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    timeout = httpx.Timeout(60.0)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+
+        async def worker():
+            nonlocal errors, received, counter
+            while time.perf_counter() < deadline:
+                counter += 1
+                request_url = f'{url}{separator}i={counter}' if unique else url
+                begin = time.perf_counter()
+                try:
+                    async with client.stream(method, request_url, content=body, headers=headers) as response:
+                        async for chunk in response.aiter_raw():
+                            received += len(chunk)
+                        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - begin)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+        'seconds': elapsed,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'received_bytes': received,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': latencies[-1] * 1000 if latencies else 0.0,
+        },
+    }
+
+
+def stat_fields(pid: int) -> List[str]:
+    """Fields of /proc/<pid>/stat after the parenthesised command name (field 3 onwards)"""
+    with open(f'/proc/{pid}/stat') as f:
+        return f.read().rsplit(')', 1)[1].split()
+
+
+class ProcessSampler:
+    """CPU time and peak RSS of another process and its children, read from /proc
+
+    Children cover uvicorn's worker processes. Only available on Linux;
+    elsewhere every figure is reported as None.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.available = os.path.exists(f'/proc/{pid}/stat')
+
+    def pids(self) -> List[int]:
+        """The process and its direct children"""
+        pids = [self.pid]
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    # ppid is field 4
+                    if int(stat_fields(int(entry))[1]) == self.pid:
+                        pids.append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    continue
+        return pids
+
+    def cpu_seconds(self) -> Optional[float]:
+        """User plus system CPU time consumed so far"""
+        if not self.available:
+            return None
+        ticks = 0
+        for pid in self.pids():
+            try:
+                # utime and stime are fields 14 and 15
+                fields = stat_fields(pid)
+            except OSError:
+                continue
+            ticks += int(fields[11]) + int(fields[12])
+        return ticks / CLOCK_TICKS
+
+    def peak_rss_bytes(self) -> Optional[int]:
+        """Sum of each process's peak resident set size since start or the last reset"""
+        if not self.available:
+            return None
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmHWM:'):
+                            total += int(line.split()[1]) * 1024
+            except OSError:
+                continue
+        return total
+
+    def reset_peak_rss(self) -> None:
+        """Start a new peak RSS measurement window (Linux 4.0+)"""
+        if not self.available:
+            return
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/clear_refs', 'w') as f:
+                    f.write('5')
+            except OSError:
+                pass
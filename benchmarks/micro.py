@@ -0,0 +1,93 @@
+"""Microbenchmarks for the rewrite and header utilities"""
+import statistics
+import time
+from typing import Callable, Dict, Optional
+
+from backend.utils.headers import (
+    modify_headers_for_proxy,
+    modify_response_headers,
+    parse_cache_control,
+    proxy_request_headers,
+    proxy_response_headers,
+)
+from backend.utils.rewrite import HTMLRewriter, rewrite_css_bytes, rewrite_css_content, rewrite_html_content
+
+from .fixtures import css_sheet, html_page, request_headers, response_headers
+
+PROXY_ID = 'bench'
+TARGET_URL = 'http://127.0.0.1:9100'
+STREAM_CHUNK = 16 * 1024
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float, size: Optional[int] = None) -> dict:
+    """Time a callable over `repeat` rounds of at least `min_time` seconds each"""
+    # Calibrate the number of calls per round
+    number = 1
+    while True:
+        begin = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - begin
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    per_call = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        for _ in range(number):
+            func()
+        per_call.append((time.perf_counter() - begin) / number)
+
+    result = {
+        'calls_per_round': number,
+        'rounds': repeat,
+        'best_us': min(per_call) * 1e6,
+        'median_us': statistics.median(per_call) * 1e6,
+    }
+    if size is not None:
+        result['input_bytes'] = size
+        result['mb_per_s'] = size / min(per_call) / 1e6
+    return result
+
+
+def stream_html(page: str) -> str:
+    rewriter = HTMLRewriter(PROXY_ID, TARGET_URL)
+    parts = [rewriter.rewrite_chunk(page[i:i + STREAM_CHUNK]) for i in range(0, len(page), STREAM_CHUNK)]
+    parts.append(rewriter.finish())
+    return ''.join(parts)
+
+
+def run_all(repeat: int = 5, min_time: float = 0.2) -> Dict[str, dict]:
+    """Run every microbenchmark and return results keyed by name"""
+    page = html_page()
+    sheet = css_sheet()
+    encoded_sheet = sheet.encode('utf-8')
+    small_page = html_page(20)
+    request = request_headers()
+    response = response_headers()
+    raw_request = [(k.encode('latin-1'), v.encode('latin-1')) for k, v in request.items()]
+    raw_response = [(k.encode('latin-1'), v.encode('latin-1')) for k, v in response.items()]
+    cache_control = 'public, max-age=3600, s-maxage=600, stale-while-revalidate=30, no-transform'
+
+    benchmarks = {
+        'rewrite_html_content': (lambda: rewrite_html_content(page, PROXY_ID, TARGET_URL), len(page)),
+        'rewrite_html_content_small': (lambda: rewrite_html_content(small_page, PROXY_ID, TARGET_URL),
+                                       len(small_page)),
+        'html_rewriter_streamed': (lambda: stream_html(page), len(page)),
+        'rewrite_css_content': (lambda: rewrite_css_content(sheet, PROXY_ID), len(sheet)),
+        'rewrite_css_bytes': (lambda: rewrite_css_bytes(encoded_sheet, PROXY_ID), len(encoded_sheet)),
+        'modify_headers_for_proxy': (lambda: modify_headers_for_proxy(request, TARGET_URL, PROXY_ID), None),
+        'modify_response_headers': (lambda: modify_response_headers(response), None),
+        'modify_response_headers_decoded': (lambda: modify_response_headers(response, remove_encoding=True), None),
+        'proxy_request_headers': (lambda: proxy_request_headers(raw_request, TARGET_URL, PROXY_ID), None),
+        'proxy_response_headers': (lambda: proxy_response_headers(raw_response), None),
+        'proxy_response_headers_decoded': (lambda: proxy_response_headers(raw_response, remove_encoding=True),
+                                           None),
+        'parse_cache_control': (lambda: parse_cache_control(cache_control), None),
+    }
+
+    return {
+        name: measure(func, repeat, min_time, size)
+        for name, (func, size) in benchmarks.items()
+    }
@@ -0,0 +1,233 @@
+"""Run the benchmark suite and save the results as JSON
+
+Starts the stand-in upstream and the proxy as uvicorn subprocesses, drives
+each scenario through the proxy at every requested concurrency, records
+throughput, latency percentiles and the proxy's CPU time and peak RSS,
+then runs the microbenchmarks.
+
+Usage:
+    python -m benchmarks.run [--scenarios html,css] [--concurrency 1,16,64] [--duration 10] [--workers 4]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from . import micro
+from .load import ProcessSampler, drive
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+BROWSER_HEADERS = {'accept-encoding': 'gzip, br', 'accept': '*/*'}
+
+
+@dataclass
+class Scenario:
+    path: str
+    proxy_id: str = 'bench'
+    method: str = 'GET'
+    body_size: int = 0
+    unique: bool = False
+    description: str = ''
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    'html': Scenario('/html', description='Large HTML page, rewrite served from cache'),
+    'html_uncached': Scenario('/html', unique=True, description='Large HTML page rewritten on every request'),
+    'css': Scenario('/css', description='Stylesheet with many url()s, rewrite served from cache'),
+    'css_uncached': Scenario('/css', unique=True, description='Stylesheet rewritten on every request'),
+    'blob': Scenario('/blob', description='1 MiB binary relayed as-is'),
+    'blob_cached': Scenario('/blob?max_age=3600', proxy_id='bench-cached',
+                            description='1 MiB binary served from the response cache'),
+    'stream': Scenario('/stream', description='Slow upstream streaming 20 chunks'),
+    'small': Scenario('/small', description='Tiny JSON response'),
+    'upload': Scenario('/echo', method='POST', body_size=256 * 1024, description='256 KiB request body echoed'),
+}
+
+
+def start_server(app: str, port: int, env: Optional[dict] = None) -> subprocess.Popen:
+    command = [sys.executable, '-m', 'uvicorn', app, '--host', '127.0.0.1', '--port', str(port),
+               '--log-level', 'warning', '--no-access-log']
+    return subprocess.Popen(command, cwd=REPO_DIR, env={**os.environ, **(env or {})})
+
+
+def wait_until_ready(url: str, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not start within {timeout} seconds")
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def write_config(config_dir: Path, upstream_url: str) -> None:
+    proxies = [
+        {'id': 'bench', 'name': 'Bench', 'target_url': upstream_url},
+        {'id': 'bench-cached', 'name': 'Bench cached', 'target_url': upstream_url, 'cache_enabled': True},
+    ]
+    (config_dir / 'proxies.json').write_text(json.dumps(proxies, indent=2))
+
+
+def git_revision() -> dict:
+    def git(*args) -> str:
+        return subprocess.run(['git', *args], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    try:
+        return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+    except OSError:
+        return {'commit': None, 'dirty': None}
+
+
+async def run_scenario(name: str, scenario: Scenario, base_url: str, concurrency: int, duration: float,
+                       warmup: float, sampler: Optional[ProcessSampler]) -> dict:
+    url = f"{base_url}/proxy/{scenario.proxy_id}{scenario.path}" if sampler else f"{base_url}{scenario.path}"
+    body = os.urandom(scenario.body_size) if scenario.body_size else None
+    options = dict(method=scenario.method, body=body, headers=BROWSER_HEADERS, unique=scenario.unique)
+
+    if warmup:
+        await drive(url, concurrency, warmup, **options)
+
+    cpu_before = None
+    if sampler is not None:
+        sampler.reset_peak_rss()
+        cpu_before = sampler.cpu_seconds()
+
+    result = await drive(url, concurrency, duration, **options)
+
+    if sampler is not None:
+        cpu_after = sampler.cpu_seconds()
+        if cpu_before is not None and cpu_after is not None:
+            result['cpu_seconds'] = cpu_after - cpu_before
+            result['cpu_percent'] = result['cpu_seconds'] / result['seconds'] * 100
+        result['peak_rss_bytes'] = sampler.peak_rss_bytes()
+
+    return {'scenario': name, 'concurrency': concurrency, **result}
+
+
+def print_row(target: str, row: dict) -> None:
+    latency = row['latency_ms']
+    cpu = row.get('cpu_percent')
+    rss = row.get('peak_rss_bytes')
+    print(f"{target:<7} {row['scenario']:<14} c={row['concurrency']:<4} {row['rps']:>9.1f} rps  "
+          f"p50 {latency['p50']:>8.2f}  p95 {latency['p95']:>8.2f}  p99 {latency['p99']:>8.2f} ms  "
+          f"cpu {'-' if cpu is None else f'{cpu:.0f}%':>5}  "
+          f"rss {'-' if rss is None else f'{rss / 2 ** 20:.1f}MiB':>9}  errors {row['errors']}",
+          flush=True)
+
+
+def run_load(args) -> Dict[str, List[dict]]:
+    results: Dict[str, List[dict]] = {'proxy': [], 'direct': []}
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+    proxy_url = f"http://127.0.0.1:{args.proxy_port}"
+
+    with tempfile.TemporaryDirectory(prefix='nebula-bench-') as config_dir:
+        write_config(Path(config_dir), upstream_url)
+        env = {'CONFIG_DIR': config_dir, 'SERVER_TIMING_ENABLED': 'false', 'WEB_CONCURRENCY': str(args.workers)}
+        upstream = start_server('benchmarks.upstream:app', args.upstream_port)
+        proxy = start_server('backend.main:app', args.proxy_port, env)
+        try:
+            wait_until_ready(f"{upstream_url}/small")
+            wait_until_ready(f"{proxy_url}/_rproxy/stats")
+            sampler = ProcessSampler(proxy.pid)
+
+            for name in args.scenarios:
+                for concurrency in args.concurrency:
+                    row = asyncio.run(run_scenario(name, SCENARIOS[name], proxy_url, concurrency,
+                                                   args.duration, args.warmup, sampler))
+                    results['proxy'].append(row)
+                    print_row('proxy', row)
+                    if args.direct:
+                        row = asyncio.run(run_scenario(name, SCENARIOS[name], upstream_url, concurrency,
+                                                       args.duration, args.warmup, None))
+                        results['direct'].append(row)
+                        print_row('direct', row)
+        finally:
+            stop_server(proxy)
+            stop_server(upstream)
+
+    return results
+
+
+def parse_list(value: str) -> List[str]:
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', type=parse_list, default=list(SCENARIOS),
+                        help=f"Comma-separated scenarios (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--concurrency', type=lambda v: [int(c) for c in parse_list(v)], default=[1, 16, 64],
+                        help='Comma-separated concurrency levels (default: 1,16,64)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per measurement (default: 10)')
+    parser.add_argument('--warmup', type=float, default=2.0, help='Warm-up seconds per measurement (default: 2)')
+    parser.add_argument('--direct', action='store_true', help='Also measure the upstream without the proxy')
+    parser.add_argument('--skip-load', action='store_true', help='Only run the microbenchmarks')
+    parser.add_argument('--skip-micro', action='store_true', help='Only run the load scenarios')
+    parser.add_argument('--micro-repeat', type=int, default=5, help='Rounds per microbenchmark (default: 5)')
+    parser.add_argument('--workers', type=int, default=1, help='Proxy worker processes (default: 1)')
+    parser.add_argument('--upstream-port', type=int, default=9100)
+    parser.add_argument('--proxy-port', type=int, default=9180)
+    parser.add_argument('--output', type=Path, help='Result file (default: benchmarks/results/<time>-<commit>.json)')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    revision = git_revision()
+    started = datetime.now(timezone.utc)
+    report = {
+        'meta': {
+            'started': started.isoformat(),
+            **revision,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'workers': args.workers,
+        },
+        'scenarios': {name: SCENARIOS[name].description for name in args.scenarios},
+    }
+
+    if not args.skip_load:
+        report['load'] = run_load(args)
+
+    if not args.skip_micro:
+        report['micro'] = micro.run_all(repeat=args.micro_repeat)
+        for name, result in report['micro'].items():
+            throughput = f"  {result['mb_per_s']:.1f} MB/s" if 'mb_per_s' in result else ''
+            print(f"micro   {name:<32} best {result['best_us']:>12.2f} us{throughput}")
+
+    output = args.output
+    if output is None:
+        commit = (revision['commit'] or 'unknown')[:10]
+        output = RESULTS_DIR / f"{started.strftime('%Y%m%dT%H%M%S')}-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
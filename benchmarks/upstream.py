@@ -0,0 +1,65 @@
+"""Stand-in upstream application serving the benchmark fixtures
+
+Run it on its own with:
+    uvicorn benchmarks.upstream:app --port 9100
+"""
+import asyncio
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+from .fixtures import binary_blob, css_sheet, html_page
+
+app = FastAPI(title="Benchmark upstream")
+
+
+def unique_suffix(request: Request, comment: str) -> str:
+    """Make the body differ per request so the proxy's rewrite cache can't serve it"""
+    token = request.query_params.get('i')
+    return comment.format(token) if token else ''
+
+
+@app.get("/html")
+async def html(request: Request, sections: int = 2000):
+    """Large HTML page"""
+    body = html_page(sections) + unique_suffix(request, '<!-- {} -->\n')
+    return Response(body, media_type='text/html; charset=utf-8')
+
+
+@app.get("/css")
+async def css(request: Request, rules: int = 5000):
+    """Stylesheet with many url() references"""
+    body = css_sheet(rules) + unique_suffix(request, '/* {} */\n')
+    return Response(body, media_type='text/css')
+
+
+@app.get("/blob")
+async def blob(size: int = 1024 * 1024, max_age: int = 0):
+    """Binary body relayed without rewriting, cacheable when max_age is given"""
+    headers = {'cache-control': f'public, max-age={max_age}'} if max_age else None
+    return Response(binary_blob(size), media_type='application/octet-stream', headers=headers)
+
+
+@app.get("/stream")
+async def stream(chunks: int = 20, chunk_size: int = 16 * 1024, delay: float = 0.01):
+    """Slow response streamed in chunks"""
+    chunk = binary_blob(chunk_size)
+
+    async def body():
+        for _ in range(chunks):
+            await asyncio.sleep(delay)
+            yield chunk
+
+    return StreamingResponse(body(), media_type='application/octet-stream')
+
+
+@app.get("/small")
+async def small():
+    """Tiny JSON response, dominated by per-request overhead"""
+    return {"status": "ok"}
+
+
+@app.post("/echo")
+async def echo(request: Request):
+    """Echo the request body back"""
+    return Response(await request.body(), media_type='application/octet-stream')
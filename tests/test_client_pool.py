@@ -0,0 +1,65 @@
+"""Pooled upstream clients"""
+import asyncio
+
+import httpx
+
+from backend.services.client_pool import ClientPool
+
+UPSTREAM = 'http://127.0.0.1:8123'
+
+
+def test_cookies_are_not_shared_between_users():
+    client, _ = ClientPool._build_client(ClientPool._client_settings({'target_url': UPSTREAM}))
+    login = httpx.Request('GET', f'{UPSTREAM}/login', headers={'cookie': 'session=alice'})
+    client.cookies.extract_cookies(httpx.Response(200, headers={'set-cookie': 'session=alice; Path=/'},
+                                                  request=login))
+
+    assert not client.cookies
+    assert 'cookie' not in client.build_request('GET', f'{UPSTREAM}/').headers
+    request = client.build_request('GET', f'{UPSTREAM}/', headers={'cookie': 'session=bob'})
+    assert request.headers.get_list('cookie') == ['session=bob']
+
+
+def replaced_client_with_open_response():
+    ClientPool._clients.clear()
+    config = {'id': 'app', 'target_url': UPSTREAM}
+    client = ClientPool.get_client(config)
+    _, _, transport = ClientPool._clients['app']
+    # As if a response were still being relayed
+    transport.open_responses += 1
+    transport.idle.clear()
+    assert ClientPool.get_client({**config, 'timeout': 5.0}) is not client
+    return client, transport
+
+
+def test_replaced_client_closes_once_its_responses_are_done():
+    async def scenario():
+        client, transport = replaced_client_with_open_response()
+        await asyncio.sleep(0.01)
+        assert not client.is_closed
+        transport._response_closed()
+        await asyncio.sleep(0.01)
+        assert client.is_closed
+        assert not ClientPool._closing
+        await ClientPool.close_all()
+
+    asyncio.run(scenario())
+
+
+def test_shutdown_closes_replaced_clients_right_away():
+    async def scenario():
+        client, _ = replaced_client_with_open_response()
+        await ClientPool.close_all()
+        assert client.is_closed
+        assert not ClientPool._closing
+        assert not ClientPool._clients
+
+    asyncio.run(scenario())
+
+
+def test_replaced_client_is_closed_outside_the_event_loop():
+    ClientPool._clients.clear()
+    config = {'id': 'app', 'target_url': UPSTREAM}
+    client = ClientPool.get_client(config)
+    ClientPool.invalidate('app')
+    assert client.is_closed
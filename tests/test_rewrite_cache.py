@@ -0,0 +1,34 @@
+"""Keys and admission of the rewrite cache"""
+from backend.services.rewrite_cache import RewriteCache
+
+URL = 'http://127.0.0.1:8123/'
+
+
+def key(request_headers, response_headers):
+    if not RewriteCache.cacheable(request_headers, response_headers):
+        return None
+    return RewriteCache.validator_key('app', URL, request_headers, response_headers)
+
+
+def test_credentialed_requests_are_not_cached():
+    assert key({'cookie': 'session=alice'}, {'etag': '"a"'}) is None
+    assert key({'authorization': 'Bearer x'}, {'etag': '"a"'}) is None
+
+
+def test_private_responses_are_not_cached():
+    assert key({}, {'etag': '"a"', 'cache-control': 'private, max-age=60'}) is None
+    assert key({}, {'etag': '"a"', 'cache-control': 'no-store'}) is None
+    assert key({}, {'etag': '"a"', 'set-cookie': 'session=alice'}) is None
+    assert key({}, {'etag': '"a"', 'vary': '*'}) is None
+
+
+def test_last_modified_alone_is_no_validator():
+    assert key({}, {'last-modified': 'Sat, 17 Oct 2026 10:00:00 GMT'}) is None
+
+
+def test_vary_headers_are_part_of_the_key():
+    response = {'etag': '"a"', 'vary': 'Accept-Language'}
+    english = key({'accept-language': 'en'}, response)
+    assert english is not None
+    assert english != key({'accept-language': 'fr'}, response)
+    assert english == key({'accept-language': 'en', 'user-agent': 'other'}, response)
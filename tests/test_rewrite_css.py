@@ -0,0 +1,23 @@
+"""CSS rewriting behaviour that deliberately differs from the BeautifulSoup-era rewriter"""
+from backend.utils.rewrite import rewrite_css_bytes, rewrite_css_content
+
+CSS = (
+    '.a { background: url(https://example.com/a.png); }\n'
+    '.b { background: url("//cdn.example.com/b.png"); }\n'
+    '.c { background: url(/c.png); }\n'
+)
+
+REWRITTEN = (
+    '.a { background: url(https://example.com/a.png); }\n'
+    '.b { background: url("//cdn.example.com/b.png"); }\n'
+    '.c { background: url(/proxy/app/c.png); }\n'
+)
+
+
+def test_urls_of_other_hosts_are_kept():
+    # The old rewriter turned these into /proxy/app/https://example.com/a.png
+    assert rewrite_css_content(CSS, 'app') == REWRITTEN
+
+
+def test_urls_of_other_hosts_are_kept_in_bytes():
+    assert rewrite_css_bytes(CSS.encode('utf-8'), 'app') == REWRITTEN.encode('utf-8')
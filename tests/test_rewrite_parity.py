@@ -0,0 +1,130 @@
+"""Parity of the streaming HTML rewriter with the BeautifulSoup rewriter it replaced
+
+Each rewrite_corpus/<name>.html has a <name>.expected.html holding the
+output of the BeautifulSoup implementation, unedited. The pages are well
+formed: BeautifulSoup repaired broken nesting while the streaming rewriter
+relays markup as it comes.
+
+BeautifulSoup re-serialised whole documents, so outputs are compared as
+token streams: attribute order, quoting, entity spelling, whitespace and
+the syntax of void and self-closing elements are ignored, as is the body
+of the injected interceptor script.
+"""
+import re
+from html.parser import HTMLParser
+from pathlib import Path
+
+import pytest
+
+from backend.utils.rewrite import HTMLRewriter, rewrite_html_content
+
+CORPUS = Path(__file__).parent / 'rewrite_corpus'
+CASES = sorted(path.stem for path in CORPUS.glob('*.html') if not path.stem.endswith('.expected'))
+
+PROXY_ID = 'app'
+TARGET_URL = 'http://127.0.0.1:8123'
+
+CSS_URL = re.compile(r'''url\(\s*(["']?)(.*?)\1\s*\)''')
+
+# Elements without end tags
+VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                           'source', 'track', 'wbr'])
+
+
+def normalize_css(text: str) -> str:
+    return CSS_URL.sub(r'url(\2)', text)
+
+
+class Tokens(HTMLParser):
+    """Tags, text and declarations of a document, in a comparable form"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tokens = []
+        self._text = []
+
+    def _flush(self):
+        text = ' '.join(''.join(self._text).split())
+        self._text.clear()
+        if text:
+            self.tokens.append(('text', normalize_css(text)))
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        attrs = sorted((name, normalize_css(value or '')) for name, value in attrs)
+        self.tokens.append(('start', tag, attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag not in VOID_ELEMENTS:
+            self.tokens.append(('end', tag))
+
+    def handle_data(self, data):
+        if 'const proxyBase' in data:
+            data = '[interceptor script]'
+        self._text.append(data)
+
+    def handle_comment(self, data):
+        self._flush()
+        self.tokens.append(('comment', data))
+
+    def handle_decl(self, decl):
+        self._flush()
+        self.tokens.append(('decl', decl.lower()))
+
+    def unknown_decl(self, data):
+        self._flush()
+        self.tokens.append(('marked section', data))
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def tokens(html: str):
+    parser = Tokens()
+    parser.feed(html)
+    parser.close()
+    return parser.tokens
+
+
+def source(name: str) -> str:
+    return (CORPUS / f'{name}.html').read_text(encoding='utf-8')
+
+
+def rewrite_in_chunks(html: str, chunks) -> str:
+    rewriter = HTMLRewriter(PROXY_ID, TARGET_URL)
+    output = []
+    start = 0
+    for end in chunks:
+        output.append(rewriter.rewrite_chunk(html[start:end]))
+        start = end
+    output.append(rewriter.rewrite_chunk(html[start:]))
+    output.append(rewriter.finish())
+    return ''.join(output)
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_matches_baseline(name):
+    expected = (CORPUS / f'{name}.expected.html').read_text(encoding='utf-8')
+    assert tokens(rewrite_html_content(source(name), PROXY_ID, TARGET_URL)) == tokens(expected)
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 64])
+@pytest.mark.parametrize('name', CASES)
+def test_fixed_size_chunks(name, size):
+    html = source(name)
+    whole = rewrite_html_content(html, PROXY_ID, TARGET_URL)
+    assert rewrite_in_chunks(html, range(size, len(html), size)) == whole
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_every_split_point(name):
+    html = source(name)
+    whole = rewrite_html_content(html, PROXY_ID, TARGET_URL)
+    for split in range(1, len(html)):
+        assert rewrite_in_chunks(html, [split]) == whole, f'split at {split}'
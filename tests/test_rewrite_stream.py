@@ -0,0 +1,53 @@
+"""Relaying a page whose rewriting fails part way through"""
+import asyncio
+
+import httpx
+
+from backend.routes.proxy_handler import rewrite_html_stream
+from backend.utils.rewrite import HTMLRewriter
+
+PROXY_ID = 'app'
+TARGET_URL = 'http://127.0.0.1:8123'
+
+
+def failing_rewriter():
+    def on_subresource(destination, url):
+        if 'boom' in url:
+            raise RuntimeError(url)
+    return HTMLRewriter(PROXY_ID, TARGET_URL, on_subresource=on_subresource)
+
+
+def relay(chunks):
+    async def body():
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+
+    async def collect():
+        response = httpx.Response(200, content=body(), headers={'content-type': 'text/html; charset=utf-8'})
+        return [chunk async for chunk in rewrite_html_stream(response, failing_rewriter())]
+
+    return b''.join(asyncio.run(collect())).decode('utf-8')
+
+
+def test_markup_held_in_the_parser_is_relayed():
+    chunks = ['<p>Before</p><p cla', 'ss="x">Text<img src="/boom.png">Rest', ' and more</p>']
+    output = relay(chunks)
+    assert output.endswith('<p>Before</p><p class="x">Text<img src="/boom.png">Rest and more</p>')
+
+
+def test_buffered_style_is_relayed():
+    chunks = ['<style>.a { background: url(/a.png); }', '</style><img src="/boom.png"><p>Rest</p>']
+    output = relay(chunks)
+    assert output.endswith('<style>.a { background: url(/a.png); }</style><img src="/boom.png"><p>Rest</p>')
+
+
+def test_abandon_returns_held_markup_and_chunk():
+    rewriter = failing_rewriter()
+    assert rewriter.rewrite_chunk('<p>One</p><a hr') == '<p>One</p>'
+    chunk = 'ef="/x">Two</a><img src="/boom.png">'
+    try:
+        rewriter.rewrite_chunk(chunk)
+    except RuntimeError:
+        assert rewriter.abandon(chunk) == '<a hr' + chunk
+    else:
+        raise AssertionError('the rewriter did not fail')
@@ -0,0 +1,97 @@
+"""Coalescing of identical concurrent requests"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from backend.services.single_flight import SharedError, SingleFlight
+
+KEY = ('app', 'GET', 'http://127.0.0.1:8123/page')
+
+
+async def read(response) -> bytes:
+    return b''.join([chunk async for chunk in response.body_iterator])
+
+
+def test_leader_streams_and_followers_get_the_whole_body():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def body():
+            yield b'first '
+            await release.wait()
+            yield b'second'
+
+        async def produce():
+            return StreamingResponse(body())
+
+        leader, shared = await SingleFlight.run(KEY, {}, produce)
+        assert not shared
+        follower = asyncio.create_task(SingleFlight.run(KEY, {}, produce))
+        await asyncio.sleep(0)
+        chunks = leader.body_iterator.__aiter__()
+        # The first chunk reaches the leader before the upstream body is complete
+        assert await chunks.__anext__() == b'first '
+        release.set()
+        assert [chunk async for chunk in chunks] == [b'second']
+        response, shared = await follower
+        assert shared
+        assert response.body == b'first second'
+        assert not SingleFlight._flights
+
+    asyncio.run(scenario())
+
+
+def test_followers_fetch_on_their_own_when_the_body_is_too_large(monkeypatch):
+    monkeypatch.setattr(SingleFlight, 'max_body_bytes', 4)
+
+    async def scenario():
+        release = asyncio.Event()
+        fetches = []
+
+        async def body():
+            yield b'0123'
+            await release.wait()
+            yield b'4567'
+
+        async def produce():
+            fetches.append(1)
+            return StreamingResponse(body())
+
+        leader, _ = await SingleFlight.run(KEY, {}, produce)
+        follower = asyncio.create_task(SingleFlight.run(KEY, {}, produce))
+        await asyncio.sleep(0)
+        release.set()
+        assert await read(leader) == b'01234567'
+        response, shared = await follower
+        assert not shared
+        assert await read(response) == b'01234567'
+        assert len(fetches) == 2
+
+    asyncio.run(scenario())
+
+
+def test_followers_get_the_error_as_a_shared_error():
+    async def scenario():
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def produce():
+            started.set()
+            await release.wait()
+            raise HTTPException(status_code=504, detail='Timed out waiting for target')
+
+        leader = asyncio.create_task(SingleFlight.run(KEY, {}, produce))
+        await started.wait()
+        follower = asyncio.create_task(SingleFlight.run(KEY, {}, produce))
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(HTTPException) as leader_error:
+            await leader
+        assert not isinstance(leader_error.value, SharedError)
+        with pytest.raises(SharedError) as follower_error:
+            await follower
+        assert follower_error.value.status_code == 504
+
+    asyncio.run(scenario())